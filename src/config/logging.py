@@ -1,44 +1,76 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import logging
+import atexit
+import queue
+import json
 import os
 
 
-def custom_path_filter(path):
-    # Define the project root name
-    project_root = "VAIS-RAG-Patterns"
-    
-    # Find the index of the project root in the path
-    idx = path.find(project_root)
-    if idx != -1:
-        # Extract the portion of the path after the project root
-        path = path[idx+len(project_root):]
-    return path
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] [%(module)s] [%(threadName)s]: %(message)s"
 
-class CustomLogRecord(logging.LogRecord):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.pathname = custom_path_filter(self.pathname)
+# Attributes every LogRecord has; anything else was passed through `extra=` and is kept in
+# JSON output.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
 
 
-def setup_logger(log_filename="app.log", log_dir="logs"):
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats each record as one JSON object per line, including any `extra=` fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'module': record.module,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+_listener = None
+
+
+def setup_logger(log_filename="app.log", log_dir="logs", level=None, json_lines=None,
+                 max_bytes=10 * 1024 * 1024, backup_count=5):
+    """
+    Configure the root logger to hand records to a background writer thread.
+
+    Callers only enqueue the record (formatting its %-style message once); the listener
+    thread does the stream and file I/O, so slow disks or terminals never stall workers.
+    The log file rotates at `max_bytes`. LOG_LEVEL and LOG_FORMAT=json override `level`
+    and `json_lines` from the environment.
+    """
+    global _listener
+    root = logging.getLogger()
+    if _listener is not None:
+        return root
+
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    if json_lines is None:
+        json_lines = os.environ.get('LOG_FORMAT', 'text').lower() == 'json'
+
     # Ensure the logging directory exists
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-
-    # Define the log file path
-    log_filepath = os.path.join(log_dir, log_filename)
-
-    # Define the logging configuration
-    logging.setLogRecordFactory(CustomLogRecord)
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] [%(module)s] [%(pathname)s]: %(message)s",
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler(log_filepath)
-        ]
-    )
-
-    # Return the configured logger
-    return logging.getLogger()
-
-logger = setup_logger()
\ No newline at end of file
+    os.makedirs(log_dir, exist_ok=True)
+    formatter = JsonLinesFormatter() if json_lines else logging.Formatter(TEXT_FORMAT)
+    stream_handler = logging.StreamHandler()
+    file_handler = RotatingFileHandler(os.path.join(log_dir, log_filename), maxBytes=max_bytes,
+                                       backupCount=backup_count, delay=True)
+    for handler in (stream_handler, file_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+    # Drain whatever is still queued when the interpreter exits.
+    atexit.register(_listener.stop)
+
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
+    return root
+
+logger = setup_logger()
@@ -2,7 +2,7 @@ from src.config.logging import logger
 from typing import Dict
 from typing import Any
 import subprocess
-import yaml
+import threading
 import os
 
 
@@ -34,6 +34,61 @@ class Config:
         self.CREDENTIALS_PATH = self.__config['credentials_json']
         self._set_google_credentials(self.CREDENTIALS_PATH)
         self.TEXT_GEN_MODEL_NAME = self.__config['text_gen_model_name']
+        self.MAX_WORKERS = self.__config.get('max_workers', 4)
+        self.RESPONSE_CACHE_DIR = self.__config.get('response_cache_dir', './data/cache/responses')
+        self.RESPONSE_CACHE_MAX_MB = self.__config.get('response_cache_max_mb', 512)
+        self.RESPONSE_CACHE_MAX_AGE_DAYS = self.__config.get('response_cache_max_age_days', 30)
+        self.REQUESTS_PER_MINUTE = self.__config.get('requests_per_minute', 60)
+        self.TOKENS_PER_MINUTE = self.__config.get('tokens_per_minute', 4000000)
+        self.MAX_RETRIES = self.__config.get('max_retries', 6)
+        self.STAGE_PDFS = self.__config.get('stage_pdfs', False)
+        self.STAGING_PREFIX = self.__config.get('staging_prefix', 'staged')
+        self.SLICE_PAGES = self.__config.get('slice_pages', False)
+        self.SLICE_PAGE_NEIGHBOURS = self.__config.get('slice_page_neighbours', 1)
+        self.PAGE_INDEX = self.__config.get('page_index', False)
+        self.PAGE_INDEX_DIR = self.__config.get('page_index_dir', './data/cache/page_index')
+        self.PAGE_INDEX_TOP_K = self.__config.get('page_index_top_k', 8)
+        self.PAGE_INDEX_NEIGHBOURS = self.__config.get('page_index_neighbours', 1)
+        self.BACKEND = self.__config.get('backend', 'vertex')
+        self.REPLAY_FILE = self.__config.get('replay_file', './data/cache/replay.jsonl')
+        self.REPLAY_RECORD = self.__config.get('replay_record', False)
+        self.SYNTHETIC_LATENCY = self.__config.get('synthetic_latency', 0.0)
+        self.SYNTHETIC_JITTER = self.__config.get('synthetic_jitter', 0.0)
+        self.SYNTHETIC_ERROR_RATE = self.__config.get('synthetic_error_rate', 0.0)
+        self.SYNTHETIC_ITEMS = self.__config.get('synthetic_items', 5)
+        self.OUTPUT_COMPRESSION = self.__config.get('output_compression', None)
+        self.TEMPLATE_RELOAD_INTERVAL = self.__config.get('template_reload_interval', 1.0)
+        self.TELEMETRY_EXPORTERS = self.__config.get('telemetry_exporters', ['jsonl'])
+        self.TELEMETRY_DIR = self.__config.get('telemetry_dir', './data/telemetry')
+        self.PROMPT_COST_PER_1K_TOKENS = self.__config.get('prompt_cost_per_1k_tokens', 0.00125)
+        self.COMPLETION_COST_PER_1K_TOKENS = self.__config.get('completion_cost_per_1k_tokens', 0.005)
+        self.CACHED_COST_PER_1K_TOKENS = self.__config.get('cached_cost_per_1k_tokens', 0.0003125)
+        self.CONTEXT_CACHE = self.__config.get('context_cache', False)
+        self.CONTEXT_CACHE_TTL = self.__config.get('context_cache_ttl', 600)
+        self.CONTEXT_CACHE_MIN_TOKENS = self.__config.get('context_cache_min_tokens', 32768)
+        self.METRIC_STORE = self.__config.get('metric_store', False)
+        self.METRIC_STORE_DIR = self.__config.get('metric_store_dir', './data/store')
+        self.PLANNER_STRATEGY = self.__config.get('planner_strategy', 'auto')
+        self.PLANNER_FUSED_MAX_PAGES = self.__config.get('planner_fused_max_pages', 80)
+        self.PLANNER_FUSED_MAX_MB = self.__config.get('planner_fused_max_mb', 20)
+        self.PLANNER_FUSED_MAX_HIT_PAGES = self.__config.get('planner_fused_max_hit_pages', 15)
+        self.PLANNER_FUSED_MAX_INVALID = self.__config.get('planner_fused_max_invalid', 0.5)
+        self.QUARANTINE_DIR = self.__config.get('quarantine_dir', './data/quarantine')
+        self.EXTRACTION_CHUNK_SIZE = self.__config.get('extraction_chunk_size', 50)
+        self.EXTRACTION_CHUNK_WORKERS = self.__config.get('extraction_chunk_workers', 4)
+        self.MAX_CONTINUATIONS = self.__config.get('max_continuations', 3)
+        self.DEDUP = self.__config.get('dedup', False)
+        self.DEDUP_INDEX = self.__config.get('dedup_index', './data/cache/dedup_index.jsonl')
+        self.DEDUP_NEAR_DUPLICATES = self.__config.get('dedup_near_duplicates', False)
+        self.DEDUP_THRESHOLD = self.__config.get('dedup_threshold', 0.9)
+        self.SERVICE_PIPELINE = self.__config.get('service_pipeline', 'multi_step')
+        self.SERVICE_DB = self.__config.get('service_db', './data/cache/jobs.sqlite3')
+        self.SERVICE_POLL_INTERVAL = self.__config.get('service_poll_interval', 5.0)
+        self.SERVICE_SETTLE_SECONDS = self.__config.get('service_settle_seconds', 2.0)
+        self.SERVICE_MAX_PENDING = self.__config.get('service_max_pending', 100)
+        self.SERVICE_MAX_ATTEMPTS = self.__config.get('service_max_attempts', 3)
+        self.SERVICE_RETRY_DELAY = self.__config.get('service_retry_delay', 30.0)
+        self.SERVICE_TELEMETRY_INTERVAL = self.__config.get('service_telemetry_interval', 60.0)
 
     @staticmethod
     def _load_config(config_path: str) -> Dict[str, Any]:
@@ -46,11 +101,12 @@ class Config:
         Returns:
         - dict: Loaded configuration data.
         """
+        import yaml
         try:
             with open(config_path, 'r') as file:
                 return yaml.safe_load(file)
         except Exception as e:
-            logger.error(f"Failed to load the configuration file. Error: {e}")
+            logger.error("Failed to load the configuration file. Error: %s", e)
 
     @staticmethod
     def _set_google_credentials(credentials_path: str) -> None:
@@ -63,4 +119,27 @@ class Config:
         os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_path
 
 
-config = Config()
\ No newline at end of file
+class LazyConfig:
+    """
+    Module-level stand-in for the Config singleton.
+
+    config.yml is only read (and the credentials variable only set) on the first attribute
+    access, so importing a module that holds a reference to `config` costs nothing.
+    """
+
+    def __init__(self):
+        self._config = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._config is None:
+            # Worker threads may race to the first access; only one of them loads the file.
+            with self._lock:
+                if self._config is None:
+                    self._config = Config()
+        return getattr(self._config, name)
+
+
+config = LazyConfig()
@@ -0,0 +1,278 @@
+from src.generate.jsonl import jsonl_doc_id
+from src.generate.jsonl import iter_jsonl
+from src.generate.jsonl import is_jsonl
+from src.generate import taxonomy
+from src.config.logging import logger
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import argparse
+import json
+import time
+import math
+import re
+import os
+
+
+GEN_DIR = './data/generated'
+
+# Canonical unit -> GWh per unit, for pure energy units.
+ENERGY_UNITS_GWH = {
+    'wh': 1e-9, 'kwh': 1e-6, 'mwh': 1e-3, 'gwh': 1.0, 'twh': 1e3,
+    'j': 2.77778e-13, 'kj': 2.77778e-10, 'mj': 2.77778e-7, 'gj': 2.77778e-4, 'tj': 0.277778, 'pj': 277.778,
+    'mmbtu': 2.93071e-4,
+}
+
+# Volume and mass units are converted with a heating value that depends on the fuel family.
+FUEL_UNITS = ('l', 'gal', 'm3', 'bbl', 't')
+FUEL_FAMILIES = ('liquid', 'gas', 'biogas', 'coal', 'solid_biomass', 'other')
+FUEL_UNITS_GWH = np.array([
+    # l           gal          m3          bbl         t
+    [1.1166e-5,   4.2268e-5,   1.1166e-2,  1.7753e-3,  1.163e-2],   # liquid fuels (diesel, oil, biofuels)
+    [np.nan,      np.nan,      1.055e-5,   np.nan,     1.4e-2],     # natural gas
+    [np.nan,      np.nan,      6.0e-6,     np.nan,     np.nan],     # landfill, sewage gas, biogas
+    [np.nan,      np.nan,      np.nan,     np.nan,     6.667e-3],   # coal
+    [np.nan,      np.nan,      np.nan,     np.nan,     4.167e-3],   # biomass, wood
+    [np.nan,      np.nan,      np.nan,     np.nan,     np.nan],     # no heating value known
+])
+
+UNIT_SYNONYMS = {
+    'terajoules': 'tj', 'terajoule': 'tj', 'gigajoules': 'gj', 'gigajoule': 'gj', 'megajoules': 'mj',
+    'petajoules': 'pj', 'kilowatt hours': 'kwh', 'megawatt hours': 'mwh', 'gigawatt hours': 'gwh',
+    'liters': 'l', 'litres': 'l', 'liter': 'l', 'litre': 'l', 'kl': 'kl', 'kiloliters': 'kl', 'kilolitres': 'kl',
+    'gallons': 'gal', 'gallon': 'gal', 'cubic meters': 'm3', 'cubic metres': 'm3', 'm³': 'm3',
+    'barrels': 'bbl', 'barrel': 'bbl', 'tonnes': 't', 'tonne': 't', 'tons': 't', 'ton': 't',
+    'metric tons': 't', 'metric tonnes': 't', 'percentage': '%', 'percent': '%',
+}
+
+SCALE_PREFIXES = (('thousands of ', 1e3), ('thousand ', 1e3), ('millions of ', 1e6), ('million ', 1e6))
+
+RESULT_FIELDS = ('tec', 'trec', 'tnrec', 'renewable_share', 'non_renewable_share')
+
+
+def parse_unit(unit: Any) -> Tuple[Optional[str], float]:
+    """
+    Map a raw unit string to (canonical unit, multiplier), e.g. "Thousands of MWh" -> ("mwh", 1000).
+    Returns (None, nan) for missing or unrecognised units.
+    """
+    if unit is None:
+        return None, math.nan
+    text = re.sub(r'\s+', ' ', str(unit)).strip().lower().replace(' ³', '³')
+    scale = 1.0
+    if "('000)" in text:
+        text, scale = text.replace("('000)", '').strip(), 1e3
+    for prefix, factor in SCALE_PREFIXES:
+        if text.startswith(prefix):
+            text, scale = text[len(prefix):], scale * factor
+    text = UNIT_SYNONYMS.get(text, text)
+    if text == 'kl':
+        text, scale = 'l', scale * 1e3
+    if text in ENERGY_UNITS_GWH or text in FUEL_UNITS or text == '%':
+        return text, scale
+    return None, math.nan
+
+
+def fuel_family(code: str) -> str:
+    if code in taxonomy.LIQUID_FUEL_CODES:
+        return 'liquid'
+    if code in taxonomy.GAS_FUEL_CODES:
+        return 'gas'
+    if code in taxonomy.BIOGAS_CODES:
+        return 'biogas'
+    if code in taxonomy.COAL_CODES:
+        return 'coal'
+    if code in taxonomy.SOLID_BIOMASS_CODES:
+        return 'solid_biomass'
+    return 'other'
+
+
+def _to_float(value: Any) -> float:
+    if value is None:
+        return math.nan
+    try:
+        return float(str(value).replace(',', '')) if isinstance(value, str) else float(value)
+    except ValueError:
+        return math.nan
+
+
+class MetricTable:
+    """
+    Columnar view of extracted metric records.
+
+    Attributes:
+        doc_ids (List[str]): Document IDs; `doc` holds indexes into this list.
+        doc (np.ndarray): Document index per row (int32).
+        code (np.ndarray): Normalized metric code per row (str).
+        value (np.ndarray): Raw numeric value per row, NaN when missing (float64).
+        unit (np.ndarray): Raw unit string per row (str, '' when missing).
+        year (np.ndarray): Reporting year per row, NaN when missing (float64).
+        scope (np.ndarray): Scope per row (str, '' when missing).
+    """
+
+    def __init__(self, doc_ids: List[str], doc: np.ndarray, code: np.ndarray, value: np.ndarray,
+                 unit: np.ndarray, year: np.ndarray, scope: np.ndarray):
+        self.doc_ids = doc_ids
+        self.doc = doc
+        self.code = code
+        self.value = value
+        self.unit = unit
+        self.year = year
+        self.scope = scope
+
+    def __len__(self) -> int:
+        return len(self.doc)
+
+    @classmethod
+    def from_records(cls, records_by_doc: Iterable[Tuple[str, Iterable[Dict[str, Any]]]]) -> 'MetricTable':
+        doc_ids, doc, code, value, unit, year, scope = [], [], [], [], [], [], []
+        for doc_index, (doc_id, records) in enumerate(records_by_doc):
+            doc_ids.append(doc_id)
+            for record in records:
+                doc.append(doc_index)
+                code.append(taxonomy.normalize_code(record.get('code')) or '')
+                value.append(_to_float(record.get('value')))
+                raw_unit = record.get('unit')
+                unit.append('' if raw_unit in (None, 'null') else str(raw_unit))
+                year.append(_to_float(record.get('year')))
+                scope.append(str(record.get('scope') or ''))
+        return cls(doc_ids, np.array(doc, dtype=np.int32), np.array(code, dtype=str),
+                   np.array(value, dtype=np.float64), np.array(unit, dtype=str),
+                   np.array(year, dtype=np.float64), np.array(scope, dtype=str))
+
+
+def load_metric_table(gen_dir: str = GEN_DIR) -> MetricTable:
+    """
+    Load every `<doc_id>.jsonl` (optionally compressed) in a directory into one MetricTable.
+
+    Records are streamed file by file, so only the columns are ever held in memory.
+    """
+    filenames = sorted(filename for filename in os.listdir(gen_dir) if is_jsonl(filename))
+    return MetricTable.from_records((jsonl_doc_id(filename), iter_jsonl(os.path.join(gen_dir, filename)))
+                                    for filename in filenames)
+
+
+def to_gwh(table: MetricTable) -> np.ndarray:
+    """
+    Convert every row to GWh with lookup tables; rows that cannot be converted are NaN.
+
+    Only the distinct unit strings and codes are parsed in Python; the per-row work is array
+    indexing.
+    """
+    unique_units, unit_inverse = np.unique(table.unit, return_inverse=True)
+    parsed = [parse_unit(unit) for unit in unique_units]
+    energy_factor = np.array([ENERGY_UNITS_GWH.get(canonical, np.nan) * scale for canonical, scale in parsed], dtype=np.float64)
+    fuel_unit = np.array([FUEL_UNITS.index(canonical) if canonical in FUEL_UNITS else -1 for canonical, _ in parsed], dtype=np.int64)
+    fuel_scale = np.array([scale for _, scale in parsed], dtype=np.float64)
+
+    unique_codes, code_inverse = np.unique(table.code, return_inverse=True)
+    family = np.array([FUEL_FAMILIES.index(fuel_family(code)) for code in unique_codes], dtype=np.int64)
+
+    row_fuel_unit = fuel_unit[unit_inverse]
+    fuel_factor = np.where(row_fuel_unit >= 0,
+                           FUEL_UNITS_GWH[family[code_inverse], np.maximum(row_fuel_unit, 0)] * fuel_scale[unit_inverse],
+                           np.nan)
+    factor = np.where(np.isnan(energy_factor[unit_inverse]), fuel_factor, energy_factor[unit_inverse])
+    return table.value * factor
+
+
+def percent_values(table: MetricTable) -> np.ndarray:
+    """
+    Row values that are valid percentages (unit "%", "percent" or "percentage" and within
+    0-100); NaN elsewhere, so shares tagged with an energy unit or a sentinel are ignored.
+    """
+    unique_units, unit_inverse = np.unique(table.unit, return_inverse=True)
+    is_percent = np.array([parse_unit(unit) == ('%', 1.0) for unit in unique_units], dtype=bool)
+    valid = is_percent[unit_inverse] & (table.value >= 0) & (table.value <= 100)
+    return np.where(valid, table.value, np.nan)
+
+
+def _first_per_doc(mask: np.ndarray, values: np.ndarray, doc: np.ndarray, n_docs: int) -> np.ndarray:
+    """
+    Value of the first row matching `mask` in each document, NaN where there is none.
+    """
+    result = np.full(n_docs, np.nan)
+    rows = np.flatnonzero(mask & ~np.isnan(values))
+    docs, first = np.unique(doc[rows], return_index=True)
+    result[docs] = values[rows[first]]
+    return result
+
+
+def _sum_per_doc(mask: np.ndarray, values: np.ndarray, doc: np.ndarray, n_docs: int) -> np.ndarray:
+    """
+    Sum of valid rows matching `mask` per document, NaN where there are none.
+    """
+    valid = mask & ~np.isnan(values)
+    sums = np.bincount(doc[valid], weights=values[valid], minlength=n_docs)
+    counts = np.bincount(doc[valid], minlength=n_docs)
+    return np.where(counts > 0, sums, np.nan)
+
+
+def aggregate(table: MetricTable) -> Dict[str, np.ndarray]:
+    """
+    Compute TEC/TREC/TNREC (GWh) and renewable shares for every document in one pass.
+
+    Directly reported totals (429/432/711) take precedence over the sum of their components;
+    a missing TEC falls back to TREC + TNREC, and a missing TNREC to TEC - TREC. Shares use
+    the reported 819/817 percentages when they are valid percentages, otherwise TREC/TEC.
+    """
+    n_docs = len(table.doc_ids)
+    gwh = to_gwh(table)
+    code = table.code
+
+    renewable = np.isin(code, list(taxonomy.RENEWABLE_CODES))
+    non_renewable = np.isin(code, list(taxonomy.NON_RENEWABLE_CODES))
+
+    direct_tec = _first_per_doc(code == taxonomy.TOTAL_ENERGY, gwh, table.doc, n_docs)
+    direct_trec = _first_per_doc(code == taxonomy.TOTAL_RENEWABLE, gwh, table.doc, n_docs)
+    direct_tnrec = _first_per_doc(code == taxonomy.TOTAL_NON_RENEWABLE, gwh, table.doc, n_docs)
+
+    trec = np.where(np.isnan(direct_trec), _sum_per_doc(renewable, gwh, table.doc, n_docs), direct_trec)
+    tnrec = np.where(np.isnan(direct_tnrec), _sum_per_doc(non_renewable, gwh, table.doc, n_docs), direct_tnrec)
+    tec = np.where(np.isnan(direct_tec), trec + tnrec, direct_tec)
+    tnrec = np.where(np.isnan(tnrec), tec - trec, tnrec)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        computed_share = np.where(tec > 0, trec / tec, np.nan)
+    percent = percent_values(table)
+    reported_share = _first_per_doc(code == taxonomy.SHARE_RENEWABLE, percent, table.doc, n_docs) / 100.0
+    reported_non_share = _first_per_doc(code == taxonomy.SHARE_NON_RENEWABLE, percent, table.doc, n_docs) / 100.0
+    renewable_share = np.where(np.isnan(reported_share), computed_share, reported_share)
+    non_renewable_share = np.where(np.isnan(reported_non_share), 1.0 - renewable_share, reported_non_share)
+
+    return {'tec': tec, 'trec': trec, 'tnrec': tnrec,
+            'renewable_share': renewable_share, 'non_renewable_share': non_renewable_share}
+
+
+def to_records(doc_ids: List[str], results: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    """
+    Turn aggregation arrays into one JSON-friendly dict per document (NaN becomes None).
+    """
+    return [
+        {'doc_id': doc_id, **{field: None if np.isnan(results[field][i]) else float(results[field][i]) for field in RESULT_FIELDS}}
+        for i, doc_id in enumerate(doc_ids)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate extracted energy metrics per document (GWh).")
+    parser.add_argument('gen_dir', nargs='?', default=GEN_DIR)
+    parser.add_argument('--store', action='store_true',
+                        help="Read the gen_dir results from the Parquet metric store instead of the JSONL files")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.store:
+        from src.generate.metric_store import MetricStore, store_dir
+        table = MetricStore(store_dir(args.gen_dir)).to_metric_table()
+    else:
+        table = load_metric_table(args.gen_dir)
+    loaded = time.perf_counter()
+    results = aggregate(table)
+    done = time.perf_counter()
+    for record in to_records(table.doc_ids, results):
+        print(json.dumps(record))
+    logger.info("Aggregated %s rows from %s documents (load %.3fs, aggregate %.1fms)",
+                len(table), len(table.doc_ids), loaded - start, (done - loaded) * 1000)
+
+
+if __name__ == '__main__':
+    main()
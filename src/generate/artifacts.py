@@ -0,0 +1,50 @@
+from src.config.logging import logger
+from typing import Any, Optional
+import threading
+import json
+import os
+
+
+class ArtifactStore:
+    """
+    Optional per-document persistence for intermediate step outputs.
+
+    Each artifact is stored as `<root_dir>/<doc_id>/<name>.json`, so documents processed in
+    parallel never share a file. Writes go to a temporary file first and are moved into
+    place atomically.
+
+    Attributes:
+        root_dir (str): Directory holding one sub-directory per document.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+
+    def path(self, doc_id: str, name: str) -> str:
+        return os.path.join(self.root_dir, doc_id, f'{name}.json')
+
+    def exists(self, doc_id: str, name: str) -> bool:
+        return os.path.exists(self.path(doc_id, name))
+
+    def save(self, doc_id: str, name: str, data: Any) -> str:
+        """
+        Persist an artifact for a document and return its path.
+        """
+        file_path = self.path(doc_id, name)
+        logger.info("Saving artifact %s for %s to %s", name, doc_id, file_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, file_path)
+        return file_path
+
+    def load(self, doc_id: str, name: str) -> Optional[Any]:
+        """
+        Load an artifact for a document, or None if it was never saved.
+        """
+        file_path = self.path(doc_id, name)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, 'r') as file:
+            return json.load(file)
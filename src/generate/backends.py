@@ -0,0 +1,546 @@
+from src.generate.context_cache import create_context_cache
+from src.generate.context_cache import ContextCacheManager
+from src.generate.telemetry import current_document
+from src.generate.cache import make_cache_key
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import functools
+import threading
+import hashlib
+import random
+import string
+import json
+import time
+import os
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+
+# Safety settings sent with every Vertex AI request, by enum name so the pipelines (and
+# batch prediction) do not need the SDK to refer to them.
+SAFETY_SETTINGS = {
+    'HARM_CATEGORY_UNSPECIFIED': 'BLOCK_NONE',
+    'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_NONE',
+    'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
+    'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
+    'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_NONE',
+}
+
+
+class BlobPart:
+    """
+    Inline content part (PDF bytes, serialized step outputs) independent of any SDK.
+
+    Attributes:
+        data (bytes): Raw content.
+        mime_type (str): MIME type of the content.
+    """
+
+    def __init__(self, data: bytes, mime_type: str):
+        self.data = data
+        self.mime_type = mime_type
+        self._digest = None
+
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Used for cache keys; hashing the bytes once is cheaper than serializing them.
+        return {'inline_data': {'mime_type': self.mime_type, 'sha256': self.digest()}}
+
+
+class UriPart:
+    """
+    Content part referencing a file in Cloud Storage.
+
+    Attributes:
+        uri (str): `gs://` URI of the file.
+        mime_type (str): MIME type of the file.
+        pages (Optional[int]): Page count of a staged PDF, used for token estimates only.
+        size (Optional[int]): Size of the file in bytes, used for token estimates only.
+    """
+
+    def __init__(self, uri: str, mime_type: str, pages: Optional[int] = None, size: Optional[int] = None):
+        self.uri = uri
+        self.mime_type = mime_type
+        self.pages = pages
+        self.size = size
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'file_data': {'mime_type': self.mime_type, 'file_uri': self.uri}}
+
+
+class ModelRequest:
+    """
+    One structured-output generation request, as seen by every backend.
+
+    Attributes:
+        model_name (str): Model the request is addressed to.
+        system_instruction (List[str]): System instruction texts.
+        contents (List[Any]): Prompt parts: strings, BlobPart or UriPart.
+        response_schema (Dict[str, Any]): JSON schema the response must follow.
+        generation_config (Dict[str, Any]): Generation settings besides the schema.
+        step (Optional[str]): Pipeline step issuing the request; a label only, not part of the key.
+        cache_prefix (Optional[int]): Number of leading contents that, with the system instruction,
+            are shared with other requests and worth serving from a context cache; None disables
+            context caching for the request.
+    """
+
+    def __init__(self, model_name: str, system_instruction: List[str], contents: List[Any],
+                 response_schema: Dict[str, Any], generation_config: Optional[Dict[str, Any]] = None,
+                 step: Optional[str] = None, cache_prefix: Optional[int] = None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.contents = contents
+        self.response_schema = response_schema
+        self.generation_config = generation_config or {'response_mime_type': 'application/json'}
+        self.step = step
+        self.cache_prefix = cache_prefix
+        self._key = None
+
+    @property
+    def key(self) -> str:
+        """
+        Content hash of the request, shared by the response cache and recordings.
+        """
+        if self._key is None:
+            self._key = make_cache_key(self.model_name, self.system_instruction, self.contents,
+                                       self.response_schema, self.generation_config)
+        return self._key
+
+    def payload_bytes(self) -> int:
+        """
+        Approximate bytes sent: inline data plus prompt and instruction text.
+        """
+        total = 0
+        for item in list(self.contents) + list(self.system_instruction or []):
+            if isinstance(item, str):
+                total += len(item.encode('utf-8'))
+            elif isinstance(item, BlobPart):
+                total += len(item.data)
+            elif isinstance(item, UriPart):
+                total += len(item.uri)
+        return total
+
+
+class ModelResponse:
+    """
+    Backend-neutral model response.
+
+    Attributes:
+        text (str): Response text (JSON for structured output).
+        finish_reason (str): Why generation stopped, e.g. STOP or MAX_TOKENS.
+        safety_ratings (List[Any]): Safety ratings reported for the candidate.
+        total_tokens (Optional[int]): Billed tokens, when the backend reports them.
+        prompt_tokens (Optional[int]): Input tokens, when the backend reports them.
+        completion_tokens (Optional[int]): Output tokens, when the backend reports them.
+        cached_tokens (Optional[int]): Input tokens served from a context cache (included in
+            `prompt_tokens`), when the backend reports them.
+    """
+
+    def __init__(self, text: str, finish_reason: str = 'STOP', safety_ratings: Optional[List[Any]] = None,
+                 total_tokens: Optional[int] = None, prompt_tokens: Optional[int] = None,
+                 completion_tokens: Optional[int] = None, cached_tokens: Optional[int] = None):
+        self.text = text
+        self.finish_reason = finish_reason
+        self.safety_ratings = safety_ratings or []
+        self.total_tokens = total_tokens
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+
+
+class ModelBackend:
+    """
+    Interface every extraction step talks to instead of a concrete SDK.
+    """
+
+    name = 'base'
+
+    def model_id(self, model_name: str) -> str:
+        """
+        Model name used in request keys, so responses from different backends never mix.
+        """
+        return model_name
+
+    def generate(self, request: ModelRequest) -> ModelResponse:
+        raise NotImplementedError
+
+    def warm(self, model_name: str, system_instructions: List[List[str]]) -> None:
+        """
+        Prepare whatever the backend needs for these (model, system instruction) pairs ahead
+        of the first request. Backends without per-model setup do nothing.
+        """
+
+    def release(self, doc_id: Optional[str] = None) -> None:
+        """
+        Free server-side state held for `doc_id` (or for the whole run when None), such as
+        context caches. Backends without such state do nothing.
+        """
+
+
+@functools.lru_cache(maxsize=None)
+def vertex_safety_settings() -> Dict[Any, Any]:
+    from vertexai.generative_models import HarmBlockThreshold, HarmCategory
+    return {HarmCategory[category]: HarmBlockThreshold[threshold] for category, threshold in SAFETY_SETTINGS.items()}
+
+
+def to_vertex_part(item: Any) -> Any:
+    from vertexai.generative_models import Part
+    if isinstance(item, BlobPart):
+        return Part.from_data(data=item.data, mime_type=item.mime_type)
+    if isinstance(item, UriPart):
+        return Part.from_uri(item.uri, mime_type=item.mime_type)
+    return item
+
+
+class VertexBackend(ModelBackend):
+    """
+    Calls Gemini through the Vertex AI SDK, which is only imported on first use.
+
+    Model clients are built once per (model name, system instruction) and shared by every
+    document and worker thread, so per-request setup is limited to the request itself. With
+    a context cache, requests marked with a `cache_prefix` send only what follows the cached
+    prefix (the system instruction and the leading contents); when the prefix cannot be cached
+    they are sent whole.
+
+    Attributes:
+        model_factory (Optional[Callable]): Builds the model from (model_name, system_instruction=...);
+            defaults to `GenerativeModel`. Fakes from `src.generate.fakes` can be plugged in here.
+        context_cache (Optional[ContextCacheManager]): Manager for server-side prefix caches.
+    """
+
+    name = 'vertex'
+
+    def __init__(self, model_factory: Optional[Callable[..., Any]] = None,
+                 context_cache: Optional[ContextCacheManager] = None):
+        self.model_factory = model_factory
+        self.context_cache = context_cache
+        self._models: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+        self._lock = threading.Lock()
+
+    def _factory(self) -> Callable[..., Any]:
+        if self.model_factory is not None:
+            return self.model_factory
+        import vertexai
+        from vertexai.generative_models import GenerativeModel
+        vertexai.init(project=config.PROJECT_ID, location=config.REGION)
+        self.model_factory = GenerativeModel
+        return GenerativeModel
+
+    def _pooled(self, key: Tuple[str, Tuple[str, ...]], build: Callable[[], Any]) -> Any:
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = build()
+                    self._models[key] = model
+                    logger.debug("Built %s client (%s clients pooled)", key[0], len(self._models))
+        return model
+
+    def model(self, model_name: str, system_instruction: List[str]) -> Any:
+        """
+        Return the pooled client for this model and system instruction, building it on first use.
+        """
+        return self._pooled((model_name, tuple(system_instruction)),
+                            lambda: self._factory()(model_name, system_instruction=list(system_instruction)))
+
+    def warm(self, model_name: str, system_instructions: List[List[str]]) -> None:
+        # Also pays the SDK import before workers start rather than inside the first request.
+        vertex_safety_settings()
+        for system_instruction in system_instructions:
+            self.model(model_name, system_instruction)
+
+    def _cached_request(self, request: ModelRequest) -> Optional[Tuple[Any, List[Any]]]:
+        """
+        Return (model bound to the cached prefix, remaining contents), or None to send the request whole.
+        """
+        if self.context_cache is None or request.cache_prefix is None:
+            return None
+        self._factory()
+        # A model bound to cached content cannot take its own system instruction, so the
+        # instruction is always cached with the prefix and never sent as user content.
+        prefix = request.contents[:request.cache_prefix]
+        cached = self.context_cache.acquire(request.model_name, request.system_instruction, prefix, current_document.get())
+        if cached is None:
+            return None
+        model = self._pooled((cached.name, ()), lambda: self.context_cache.service.model(cached.name, request.model_name))
+        return model, request.contents[request.cache_prefix:]
+
+    def release(self, doc_id: Optional[str] = None) -> None:
+        if self.context_cache is None:
+            return
+        names = self.context_cache.release(doc_id)
+        with self._lock:
+            for name in names:
+                self._models.pop((name, ()), None)
+
+    def to_parts(self, contents: List[Any]) -> List[Any]:
+        """
+        Convert prompt parts to Vertex AI SDK parts.
+        """
+        return [to_vertex_part(item) for item in contents]
+
+    def call_options(self, request: ModelRequest) -> Dict[str, Any]:
+        """
+        Keyword arguments for `generate_content` besides the contents.
+        """
+        from vertexai.generative_models import GenerationConfig
+        return {'generation_config': GenerationConfig(response_schema=request.response_schema, **request.generation_config),
+                'safety_settings': vertex_safety_settings()}
+
+    def generate(self, request: ModelRequest) -> ModelResponse:
+        cached = self._cached_request(request)
+        if cached is None:
+            model, contents = self.model(request.model_name, request.system_instruction), request.contents
+        else:
+            model, contents = cached
+        response = model.generate_content(self.to_parts(contents), **self.call_options(request))
+        candidate = response.candidates[0]
+        usage = getattr(response, 'usage_metadata', None)
+        return ModelResponse(response.text,
+                             finish_reason=getattr(candidate.finish_reason, 'name', str(candidate.finish_reason)),
+                             safety_ratings=list(candidate.safety_ratings),
+                             total_tokens=getattr(usage, 'total_token_count', None),
+                             prompt_tokens=getattr(usage, 'prompt_token_count', None),
+                             completion_tokens=getattr(usage, 'candidates_token_count', None),
+                             cached_tokens=getattr(usage, 'cached_content_token_count', None))
+
+
+class ReplayMissError(Exception):
+    """
+    Raised when a replay backend has no recorded response for a request.
+    """
+
+
+class ReplayBackend(ModelBackend):
+    """
+    Answers requests from a JSONL recording keyed by request hash.
+
+    With an `inner` backend, misses are forwarded to it and appended to the recording, so one
+    run against Vertex AI records a session that can later be replayed offline.
+
+    Attributes:
+        path (str): Recording file.
+        inner (Optional[ModelBackend]): Backend used (and recorded) on misses.
+        hits (int): Requests answered from the recording.
+    """
+
+    name = 'replay'
+
+    def __init__(self, path: str, inner: Optional[ModelBackend] = None):
+        self.path = path
+        self.inner = inner
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry['key']] = entry
+        logger.info("Loaded %s recorded responses from %s", len(self._entries), path)
+
+    def model_id(self, model_name: str) -> str:
+        if self.inner is not None:
+            return self.inner.model_id(model_name)
+        # Replay under whatever id the recording backend used (e.g. "synthetic/<model>").
+        recorded = {entry['model_name'] for entry in self._entries.values()}
+        return next((name for name in sorted(recorded) if name == model_name or name.endswith(f'/{model_name}')), model_name)
+
+    def warm(self, model_name: str, system_instructions: List[List[str]]) -> None:
+        if self.inner is not None:
+            self.inner.warm(model_name, system_instructions)
+
+    def release(self, doc_id: Optional[str] = None) -> None:
+        if self.inner is not None:
+            self.inner.release(doc_id)
+
+    def generate(self, request: ModelRequest) -> ModelResponse:
+        with self._lock:
+            entry = self._entries.get(request.key)
+            if entry is not None:
+                self.hits += 1
+        if entry is not None:
+            return ModelResponse(entry['text'], entry.get('finish_reason', 'STOP'), total_tokens=entry.get('total_tokens'),
+                                 prompt_tokens=entry.get('prompt_tokens'), completion_tokens=entry.get('completion_tokens'))
+        if self.inner is None:
+            raise ReplayMissError(f"No recorded response for request {request.key[:12]} ({request.model_name})")
+
+        response = self.inner.generate(request)
+        entry = {'key': request.key, 'model_name': request.model_name, 'text': response.text,
+                 'finish_reason': response.finish_reason, 'total_tokens': response.total_tokens,
+                 'prompt_tokens': response.prompt_tokens, 'completion_tokens': response.completion_tokens}
+        with self._lock:
+            self._entries[request.key] = entry
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(entry) + '\n')
+        return response
+
+
+_CATEGORY_CHARS = {
+    sre_parse.CATEGORY_DIGIT: string.digits,
+    sre_parse.CATEGORY_WORD: string.ascii_letters + string.digits + '_',
+    sre_parse.CATEGORY_SPACE: ' ',
+}
+_ANY_CHARS = string.ascii_letters + string.digits + ' '
+
+
+def _chars_in(items: List[Any]) -> str:
+    chars = []
+    for op, value in items:
+        if op is sre_parse.LITERAL:
+            chars.append(chr(value))
+        elif op is sre_parse.RANGE:
+            chars.extend(chr(code) for code in range(value[0], value[1] + 1))
+        elif op is sre_parse.CATEGORY:
+            chars.extend(_CATEGORY_CHARS.get(value, 'x'))
+    return ''.join(chars) or 'x'
+
+
+def _render_pattern(tokens: Any, rng: random.Random, max_repeat: int) -> str:
+    out = []
+    for op, value in tokens:
+        if op is sre_parse.LITERAL:
+            out.append(chr(value))
+        elif op is sre_parse.ANY:
+            out.append(rng.choice(_ANY_CHARS))
+        elif op is sre_parse.IN:
+            out.append(rng.choice(_chars_in(value)))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, sub = value
+            count = rng.randint(low, max(low, min(high, max_repeat)))
+            out.extend(_render_pattern(sub, rng, max_repeat) for _ in range(count))
+        elif op is sre_parse.SUBPATTERN:
+            out.append(_render_pattern(value[-1], rng, max_repeat))
+        elif op is sre_parse.BRANCH:
+            out.append(_render_pattern(rng.choice(value[1]), rng, max_repeat))
+    return ''.join(out)
+
+
+def synthesize(schema: Dict[str, Any], rng: random.Random, items: int = 5, max_string: int = 40) -> Any:
+    """
+    Build a value conforming to a response schema dict.
+
+    Arrays get `items` elements, strings follow their `pattern` (repeats capped at
+    `max_string`) and bounded numbers stay within `minimum`/`maximum`.
+    """
+    if 'enum' in schema:
+        return rng.choice(schema['enum'])
+    kind = str(schema.get('type', 'string')).lower()
+    if kind == 'object':
+        return {name: synthesize(prop, rng, items, max_string) for name, prop in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [synthesize(schema.get('items', {}), rng, items, max_string) for _ in range(items)]
+    if kind in ('number', 'integer'):
+        if 'minimum' in schema and 'maximum' in schema or kind == 'integer':
+            return rng.randint(int(schema.get('minimum', 0)), int(schema.get('maximum', 1000000)))
+        return round(rng.uniform(schema.get('minimum', 0), schema.get('maximum', 1000000)), 2)
+    if kind == 'boolean':
+        return rng.random() < 0.5
+    pattern = schema.get('pattern')
+    if pattern:
+        return _render_pattern(sre_parse.parse(pattern), rng, max_string)
+    return ''.join(rng.choice(_ANY_CHARS) for _ in range(rng.randint(1, max_string)))
+
+
+class SyntheticBackendError(Exception):
+    """
+    Injected transient failure; carries a 503 code so the scheduler retries it.
+    """
+
+    code = 503
+
+
+class SyntheticBackend(ModelBackend):
+    """
+    Offline backend producing schema-conformant JSON with configurable latency and failures.
+
+    Responses are derived from the request hash, so identical requests get identical output
+    (and the response cache behaves as it would with a real model). Latency and injected
+    errors come from a separately seeded generator.
+
+    Attributes:
+        latency (float): Base seconds per call.
+        jitter (float): Extra uniformly distributed seconds per call.
+        error_rate (float): Probability that a call raises SyntheticBackendError.
+        items (int): Number of elements generated for each array in the schema.
+        max_string (int): Upper bound on repeated pattern characters in generated strings.
+        calls (int): Number of generate calls made.
+        failures (int): Number of injected failures.
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 items: int = 5, max_string: int = 40, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.items = items
+        self.max_string = max_string
+        self.seed = seed
+        self.calls = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def model_id(self, model_name: str) -> str:
+        return f'synthetic/{model_name}'
+
+    def generate(self, request: ModelRequest) -> ModelResponse:
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.failures += 1
+        time.sleep(delay)
+        if fail:
+            raise SyntheticBackendError("503 Service unavailable (synthetic)")
+
+        rng = random.Random(f'{self.seed}:{request.key}')
+        text = json.dumps(synthesize(request.response_schema, rng, self.items, self.max_string))
+        # Only output tokens are known here; callers fall back to their prompt estimate.
+        return ModelResponse(text, completion_tokens=len(text) // 4 + 1)
+
+
+def create_backend(kind: Optional[str] = None) -> ModelBackend:
+    """
+    Build the backend named in config.yml (`vertex`, `synthetic` or `replay`).
+    """
+    kind = kind or config.BACKEND
+    if kind == 'vertex':
+        return VertexBackend(context_cache=create_context_cache())
+    if kind == 'synthetic':
+        return SyntheticBackend(latency=config.SYNTHETIC_LATENCY,
+                                jitter=config.SYNTHETIC_JITTER,
+                                error_rate=config.SYNTHETIC_ERROR_RATE,
+                                items=config.SYNTHETIC_ITEMS)
+    if kind == 'replay':
+        return ReplayBackend(config.REPLAY_FILE, inner=VertexBackend(context_cache=create_context_cache()) if config.REPLAY_RECORD else None)
+    raise ValueError(f"Unknown model backend {kind}, expected vertex, synthetic or replay")
+
+
+_default_backend = None
+_default_lock = threading.Lock()
+
+
+def get_backend() -> ModelBackend:
+    """
+    Process-wide backend built from config.yml.
+    """
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            _default_backend = create_backend()
+        return _default_backend
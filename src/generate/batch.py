@@ -0,0 +1,225 @@
+from src.generate.backends import SAFETY_SETTINGS
+from src.generate.artifacts import ArtifactStore
+from src.generate.manifest import RunManifest
+from src.generate.manifest import hash_json
+from src.generate.telemetry import document_context
+from src.generate.staging import get_stager
+from src.generate.staging import PdfStager
+from src.generate.templates import get_prompt
+from src.generate.templates import Prompt
+from src.generate.jsonl import jsonl_path
+from src.generate.metric_store import flush_metric_stores
+from src.generate.metric_store import get_metric_store
+from src.generate import pipeline_all_in_one
+from src.generate import pipeline
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import json
+import os
+import re
+
+
+BATCH_DIR = os.path.join(pipeline.DATA_DIR, 'batch')
+MODES = ('step_1', 'all_in_one')
+
+# Batch requests carry their document ID as a label, so it must be a valid label value.
+LABEL_VALUE = re.compile(r'^[a-z0-9_-]{1,63}$')
+
+
+def to_api_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert a response schema dict into the REST form expected by batch prediction
+    (upper-case OpenAPI type names, everything else unchanged).
+    """
+    converted = {}
+    for key, value in schema.items():
+        if key == 'type' and isinstance(value, str):
+            converted[key] = value.upper()
+        elif key == 'properties':
+            converted[key] = {name: to_api_schema(prop) for name, prop in value.items()}
+        elif key == 'items':
+            converted[key] = to_api_schema(value)
+        else:
+            converted[key] = value
+    return converted
+
+
+def _mode_settings(mode: str) -> Tuple[Prompt, str]:
+    """
+    Return (prompt, user prompt) for a batch mode.
+    """
+    if mode == 'step_1':
+        return get_prompt('step_1'), pipeline.STEP_1_USER_PROMPT
+    if mode == 'all_in_one':
+        return get_prompt('all_in_one'), pipeline_all_in_one.USER_PROMPT
+    raise ValueError(f"Unknown batch mode {mode}, expected one of {MODES}")
+
+
+def build_request(doc_id: str, uri: str, mode: str, system_instruction: str) -> Dict[str, Any]:
+    """
+    Render one document, staged at `uri`, into a batch-prediction request record.
+
+    The document ID travels as the `doc_id` request label, which the batch job echoes back
+    with each prediction.
+    """
+    if not LABEL_VALUE.match(doc_id):
+        raise ValueError(f"Document ID {doc_id!r} is not a valid label value ({LABEL_VALUE.pattern})")
+    prompt, user_prompt = _mode_settings(mode)
+    return {
+        "request": {
+            "labels": {"doc_id": doc_id},
+            "contents": [{
+                "role": "user",
+                "parts": [
+                    {"fileData": {"fileUri": uri, "mimeType": "application/pdf"}},
+                    {"text": user_prompt}
+                ]
+            }],
+            "systemInstruction": {"parts": [{"text": system_instruction}]},
+            "generationConfig": {
+                "responseMimeType": "application/json",
+                "responseSchema": to_api_schema(prompt.response_schema)
+            },
+            "safetySettings": [
+                {"category": category, "threshold": threshold}
+                for category, threshold in SAFETY_SETTINGS.items()
+            ]
+        }
+    }
+
+
+def build_batch_requests(doc_ids: List[str], output_file: str, mode: str = 'step_1',
+                         stager: Optional[PdfStager] = None) -> int:
+    """
+    Write a batch-prediction JSONL input file covering `doc_ids` and return the record count.
+
+    Each PDF is uploaded through the stager (once per content hash) and referenced by the
+    URI it returns.
+    """
+    prompt, _ = _mode_settings(mode)
+    system_instruction = prompt.system_instruction
+    module = pipeline_all_in_one if mode == 'all_in_one' else pipeline
+    stager = stager or get_stager()
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with open(output_file, 'w') as f:
+        for doc_id in doc_ids:
+            uri = stager.stage(os.path.join(module.PDF_DIR, f'{doc_id}.pdf'))
+            f.write(json.dumps(build_request(doc_id, uri, mode, system_instruction)) + '\n')
+    logger.info("Wrote %s %s batch requests to %s", len(doc_ids), mode, output_file)
+    return len(doc_ids)
+
+
+def iter_predictions(predictions_file: str) -> Iterator[Tuple[str, Optional[Any], Optional[str]]]:
+    """
+    Yield (doc_id, parsed output or None, error or None) for each prediction record.
+    """
+    with open(predictions_file, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            doc_id = record['request']['labels']['doc_id']
+            if record.get('status'):
+                yield doc_id, None, record['status']
+                continue
+            try:
+                candidate = record['response']['candidates'][0]
+                text = ''.join(part.get('text', '') for part in candidate['content']['parts'])
+                yield doc_id, json.loads(text.strip()), None
+            except (KeyError, IndexError, ValueError) as e:
+                yield doc_id, None, f"Unparseable prediction: {e}"
+
+
+def validate_prediction(mode: str, output: Any) -> Any:
+    """
+    Check and normalize one prediction the way the online step does: records failing the
+    schema are quarantined, and a response of the wrong shape raises ValueError.
+    """
+    prompt, _ = _mode_settings(mode)
+    if mode == 'all_in_one':
+        pipeline_all_in_one.check_output(output)
+        output['metrics'] = pipeline.validate_records('step_all_in_one', prompt.validator.at('metrics'), output['metrics'])
+        return output
+    return pipeline.validate_records('step_1', prompt.validator, output)
+
+
+def ingest_batch_predictions(predictions_file: str, mode: str = 'step_1',
+                             store: Optional[ArtifactStore] = None,
+                             manifest: Optional[RunManifest] = None) -> Dict[str, int]:
+    """
+    Load a batch-prediction output file into the regular pipeline outputs.
+
+    Predictions are saved as completed step artifacts and checkpointed in the run manifest
+    under the same input hash the online pipelines use. `all_in_one` predictions are also
+    written to `data/generated_all_in_one/<id>.jsonl` and the documents marked done, so the
+    next `pipeline_all_in_one` run skips them; with `step_1` the next online `pipeline` run
+    resumes each document at step 2 and writes `data/generated/<id>.jsonl` as usual.
+    """
+    _mode_settings(mode)
+    counts = {'ingested': 0, 'failed': 0}
+    for doc_id, output, error in iter_predictions(predictions_file):
+        if error is not None:
+            logger.error("Batch prediction failed for %s: %s", doc_id, error)
+            counts['failed'] += 1
+            continue
+        try:
+            with document_context(doc_id):
+                output = validate_prediction(mode, output)
+        except ValueError as e:
+            logger.error("Invalid batch prediction for %s: %s", doc_id, e)
+            counts['failed'] += 1
+            continue
+        module = pipeline_all_in_one if mode == 'all_in_one' else pipeline
+        step_name = 'step_all_in_one' if mode == 'all_in_one' else 'step_1'
+        store = store or ArtifactStore(module.OUTPUT_DIR)
+        store.save(doc_id, step_name, output)
+        pdf_path = os.path.join(module.PDF_DIR, f'{doc_id}.pdf')
+        if manifest is not None and os.path.exists(pdf_path):
+            source_hash = manifest.fingerprint(doc_id, pdf_path)
+            manifest.start_document(doc_id, pdf_path, source_hash)
+            manifest.mark_step(doc_id, step_name, 'done', pipeline.step_input_hash(source_hash, mode),
+                               output_hash=hash_json(output))
+        if mode == 'all_in_one':
+            output_file = jsonl_path(pipeline_all_in_one.GEN_DIR, doc_id, config.OUTPUT_COMPRESSION)
+            pipeline_all_in_one.step_4(output, output_file)
+            metric_store = get_metric_store(pipeline_all_in_one.GEN_DIR)
+            if metric_store is not None:
+                metric_store.append(doc_id, output['metrics'])
+            if manifest is not None and os.path.exists(pdf_path):
+                manifest.mark_document(doc_id, 'done', output_file=output_file,
+                                       prompts=pipeline.prompt_versions(pipeline_all_in_one.PROMPTS))
+        counts['ingested'] += 1
+    flush_metric_stores()
+    logger.info("Ingested %s predictions from %s: %s", mode, predictions_file, counts)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-prediction mode for the extraction pipelines.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Render documents into a batch-prediction JSONL file.")
+    build.add_argument('--mode', choices=MODES, default='step_1')
+    build.add_argument('--output', default=None, help="Defaults to data/batch/<mode>_requests.jsonl")
+    build.add_argument('--bucket', default=None, help="Defaults to the bucket in config.yml")
+    build.add_argument('--prefix', default=None, help="Object prefix of the staged PDFs; defaults to staging_prefix in config.yml")
+
+    ingest = subparsers.add_parser('ingest', help="Write batch-prediction results into the pipeline outputs.")
+    ingest.add_argument('predictions', help="Prediction JSONL returned by the batch job")
+    ingest.add_argument('--mode', choices=MODES, default='step_1')
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        output_file = args.output or os.path.join(BATCH_DIR, f'{args.mode}_requests.jsonl')
+        stager = PdfStager(args.bucket, args.prefix or config.STAGING_PREFIX) if args.bucket or args.prefix else None
+        build_batch_requests(pipeline.list_documents(), output_file, args.mode, stager)
+    else:
+        module = pipeline_all_in_one if args.mode == 'all_in_one' else pipeline
+        ingest_batch_predictions(args.predictions, args.mode,
+                                 manifest=RunManifest(os.path.join(module.OUTPUT_DIR, 'manifest.jsonl')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+from src.generate.backends import ModelBackend, ModelRequest, ModelResponse, SyntheticBackend
+from src.generate.scheduler import RequestScheduler, set_scheduler
+from src.generate.telemetry import Telemetry, set_telemetry
+from src.generate.engine import process_documents
+from src.generate import pipeline_all_in_one
+from src.generate import pipeline
+from src.generate import pipeline_adaptive
+from src.config.logging import logger
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import multiprocessing
+import numpy as np
+import threading
+import argparse
+import platform
+import tempfile
+import logging
+import random
+import psutil
+import json
+import time
+import os
+
+
+BENCHMARK_DIR = os.path.join(pipeline.DATA_DIR, 'benchmark')
+PIPELINES = {'multi_step': pipeline, 'all_in_one': pipeline_all_in_one, 'adaptive': pipeline_adaptive}
+
+FILLER_WORDS = ('company', 'operations', 'report', 'sustainability', 'year', 'group', 'sites', 'performance',
+                'targets', 'emissions', 'community', 'employees', 'safety', 'governance', 'strategy', 'growth')
+METRIC_LINES = ('Total energy consumption {value} MWh', 'Natural gas {value} GJ', 'Diesel {value} litres',
+                'Electricity from renewable sources {value} kWh', 'Coal {value} tonnes', 'Solar {value} MWh')
+
+
+def _escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """
+    Build a minimal text-only PDF with one page per string (lines split on newlines).
+    """
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        f"<< /Type /Pages /Kids [{' '.join(f'{page_id} 0 R' for page_id in page_ids)}] /Count {len(pages)} >>".encode(),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    for page_id, text in zip(page_ids, pages):
+        lines = ' '.join(f'({_escape(line)}) Tj T*' for line in text.split('\n'))
+        stream = f'BT /F1 10 Tf 12 TL 50 800 Td {lines} ET'.encode('latin-1', errors='replace')
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>'.encode())
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+def synthetic_corpus(directory: str, documents: int = 20, pages: int = 30, lines_per_page: int = 40, seed: int = 0) -> List[str]:
+    """
+    Write `documents` report-like PDFs into `directory` and return their document IDs.
+
+    Most lines are filler; roughly one page in five carries energy figures, so page
+    selection and slicing have something realistic to work with.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    doc_ids = []
+    for index in range(documents):
+        doc_id = f'synthetic-{index:04d}'
+        texts = []
+        for _ in range(pages):
+            lines = [' '.join(rng.choice(FILLER_WORDS) for _ in range(12)) for _ in range(lines_per_page)]
+            if rng.random() < 0.2:
+                for line in rng.sample(METRIC_LINES, 3):
+                    lines[rng.randrange(lines_per_page)] = line.format(value=f'{rng.randint(1, 10 ** 6):,}')
+            texts.append('\n'.join(lines))
+        with open(os.path.join(directory, f'{doc_id}.pdf'), 'wb') as file:
+            file.write(make_pdf(texts))
+        doc_ids.append(doc_id)
+    return doc_ids
+
+
+class MeasuringBackend(ModelBackend):
+    """
+    Wraps a backend and records latency and payload size of every call, per step and document.
+
+    The current document is tracked per thread, which matches the engine: each document runs
+    all of its steps inside one worker thread.
+
+    Attributes:
+        inner (ModelBackend): Backend doing the actual work.
+        calls (List[Dict[str, Any]]): One record per call (step, doc_id, latency, bytes, ok).
+    """
+
+    def __init__(self, inner: ModelBackend):
+        self.inner = inner
+        self.name = inner.name
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def model_id(self, model_name: str) -> str:
+        return self.inner.model_id(model_name)
+
+    def warm(self, model_name: str, system_instructions: List[List[str]]) -> None:
+        self.inner.warm(model_name, system_instructions)
+
+    def release(self, doc_id: Optional[str] = None) -> None:
+        self.inner.release(doc_id)
+
+    @contextmanager
+    def document(self, doc_id: str) -> Iterator[None]:
+        self._local.doc_id = doc_id
+        try:
+            yield
+        finally:
+            self._local.doc_id = None
+
+    def generate(self, request: ModelRequest) -> ModelResponse:
+        start = time.perf_counter()
+        response, ok = None, False
+        try:
+            response = self.inner.generate(request)
+            ok = True
+            return response
+        finally:
+            record = {'step': request.step or 'unknown', 'doc_id': getattr(self._local, 'doc_id', None),
+                      'latency': time.perf_counter() - start, 'request_bytes': request.payload_bytes(),
+                      'response_bytes': len(response.text.encode('utf-8')) if response is not None else 0, 'ok': ok}
+            with self._lock:
+                self.calls.append(record)
+
+
+class RssSampler:
+    """
+    Samples the resident set size of this process in the background and keeps the peak.
+
+    Attributes:
+        baseline (int): RSS when sampling started, so in-process runs can report their growth.
+        peak (int): Largest RSS seen while sampling.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> 'RssSampler':
+        self.baseline = self.peak = self._process.memory_info().rss
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'p99': None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'mean': float(np.mean(values)), 'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+
+@contextmanager
+def _redirect(module: Any, pdf_dir: str, gen_dir: str) -> Iterator[None]:
+    """
+    Point a pipeline module at another corpus and output directory for the duration of a run.
+    """
+    saved = module.PDF_DIR, module.GEN_DIR
+    module.PDF_DIR, module.GEN_DIR = pdf_dir, gen_dir
+    try:
+        yield
+    finally:
+        module.PDF_DIR, module.GEN_DIR = saved
+
+
+def run_benchmark(pipeline_name: str, pdf_dir: str, workers: int, backend_factory: Callable[[], ModelBackend],
+                  requests_per_minute: float = 1_000_000, tokens_per_minute: float = 1_000_000_000) -> Dict[str, Any]:
+    """
+    Run one pipeline over every PDF in `pdf_dir` with `workers` threads and measure it.
+
+    Outputs go to a temporary directory; no response cache or manifest is used, so every
+    run does the full work. The process-wide scheduler and telemetry are replaced with fresh
+    ones, so quotas and the telemetry summary cover this run only. Peak RSS is the process's,
+    so it includes earlier runs in the same process; `rss_growth_mb` is relative to the start
+    of this run, and run_isolated measures a run in a process of its own.
+    """
+    module = PIPELINES[pipeline_name]
+    backend = MeasuringBackend(backend_factory())
+    scheduler = RequestScheduler(requests_per_minute, tokens_per_minute, base_delay=0.05, max_delay=1.0)
+    set_scheduler(scheduler)
+    telemetry = Telemetry()
+    set_telemetry(telemetry)
+    doc_ids = pipeline.list_documents(pdf_dir)
+
+    def process(doc_id: str) -> str:
+        with backend.document(doc_id):
+            return module.process_document(doc_id, backend)
+
+    with tempfile.TemporaryDirectory() as gen_dir, _redirect(module, pdf_dir, gen_dir), RssSampler() as rss:
+        start = time.perf_counter()
+        results = process_documents(doc_ids, process, max_workers=workers)
+        elapsed = time.perf_counter() - start
+
+    steps = {}
+    for step in sorted({call['step'] for call in backend.calls}):
+        calls = [call for call in backend.calls if call['step'] == step]
+        steps[step] = {**percentiles([call['latency'] for call in calls if call['ok']]),
+                       'errors': sum(1 for call in calls if not call['ok'])}
+
+    per_doc = {doc_id: 0 for doc_id in doc_ids}
+    for call in backend.calls:
+        if call['doc_id'] in per_doc:
+            per_doc[call['doc_id']] += call['request_bytes']
+    sent = list(per_doc.values())
+    succeeded = [result for result in results if result.ok]
+
+    return {
+        'pipeline': pipeline_name,
+        'corpus': pdf_dir,
+        'workers': workers,
+        'documents': len(doc_ids),
+        'failed': len(results) - len(succeeded),
+        'elapsed_s': elapsed,
+        'docs_per_minute': len(succeeded) / elapsed * 60 if elapsed else None,
+        'document_latency_s': percentiles([result.elapsed for result in succeeded]),
+        'step_latency_s': steps,
+        'model_calls': len(backend.calls),
+        'payload': {
+            'request_bytes_total': sum(call['request_bytes'] for call in backend.calls),
+            'response_bytes_total': sum(call['response_bytes'] for call in backend.calls),
+            'request_bytes_per_document': percentiles(sent),
+        },
+        'peak_rss_mb': rss.peak / (1024 * 1024),
+        'rss_growth_mb': (rss.peak - rss.baseline) / (1024 * 1024),
+        'scheduler': scheduler.stats(),
+        'telemetry': telemetry.summary(),
+    }
+
+
+def _run_with_synthetic_backend(pipeline_name: str, pdf_dir: str, workers: int, backend_settings: Dict[str, Any],
+                                requests_per_minute: float, verbose: bool) -> Dict[str, Any]:
+    if not verbose:
+        logger.setLevel(logging.WARNING)
+    return run_benchmark(pipeline_name, pdf_dir, workers, lambda: SyntheticBackend(**backend_settings),
+                         requests_per_minute=requests_per_minute)
+
+
+def run_isolated(pipeline_name: str, pdf_dir: str, workers: int, backend_settings: Dict[str, Any],
+                 requests_per_minute: float = 1_000_000, verbose: bool = False) -> Dict[str, Any]:
+    """
+    Run one configuration against a SyntheticBackend(**backend_settings) in a freshly spawned
+    process, so its peak RSS and warm-up are not inherited from earlier configurations.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_run_with_synthetic_backend, pipeline_name, pdf_dir, workers, backend_settings,
+                               requests_per_minute, verbose).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the extraction pipelines against a synthetic model.")
+    parser.add_argument('--pipelines', nargs='+', choices=sorted(PIPELINES), default=sorted(PIPELINES))
+    parser.add_argument('--corpus', nargs='+', choices=('synthetic', 'pdfs'), default=['synthetic', 'pdfs'],
+                        help="'synthetic' generates PDFs, 'pdfs' uses data/pdfs")
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--documents', type=int, default=20, help="Synthetic corpus size")
+    parser.add_argument('--pages', type=int, default=30, help="Pages per synthetic document")
+    parser.add_argument('--latency', type=float, default=0.2, help="Base model latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.1, help="Extra random latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of model calls failing with 503")
+    parser.add_argument('--items', type=int, default=10, help="Metrics per synthetic response")
+    parser.add_argument('--rpm', type=float, default=1_000_000, help="Scheduler requests-per-minute quota")
+    parser.add_argument('--output', default=os.path.join(BENCHMARK_DIR, 'results.json'))
+    parser.add_argument('--verbose', action='store_true', help="Keep pipeline INFO logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.setLevel(logging.WARNING)
+
+    backend_settings = {'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate, 'items': args.items}
+
+    runs = []
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        corpora = {}
+        if 'synthetic' in args.corpus:
+            synthetic_corpus(synthetic_dir, args.documents, args.pages)
+            corpora['synthetic'] = synthetic_dir
+        if 'pdfs' in args.corpus:
+            corpora['pdfs'] = pipeline.PDF_DIR
+        for corpus, pdf_dir in corpora.items():
+            for pipeline_name in args.pipelines:
+                for workers in args.workers:
+                    run = run_isolated(pipeline_name, pdf_dir, workers, backend_settings, args.rpm, args.verbose)
+                    run['corpus'] = corpus
+                    runs.append(run)
+                    print(f"{corpus:>9} {pipeline_name:>10} workers={workers:<3} "
+                          f"{run['docs_per_minute']:8.1f} docs/min  failed={run['failed']}  "
+                          f"p99={run['document_latency_s']['p99'] or 0:.2f}s  peak_rss={run['peak_rss_mb']:.0f}MB")
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'settings': vars(args),
+        'runs': runs,
+    }
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+import argparse
+import threading
+import hashlib
+import json
+import time
+import os
+
+
+class KeyLocks:
+    """
+    Per-key locks that exist only while a thread holds or waits for them, so a long-running
+    process does not keep one lock per distinct key it has ever seen.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks: Dict[str, List[Any]] = {}  # key -> [lock, threads holding or waiting]
+
+    @contextmanager
+    def hold(self, key: str) -> Iterator[None]:
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._locks)
+
+
+def _content_digest(item: Any) -> bytes:
+    """
+    Serialize one request element (text, bytes, Part or dict) into stable bytes for hashing.
+    """
+    if item is None:
+        return b'null'
+    if isinstance(item, bytes):
+        return item
+    if isinstance(item, str):
+        return item.encode('utf-8')
+    if hasattr(item, 'to_dict'):
+        item = item.to_dict()
+    return json.dumps(item, sort_keys=True, default=str).encode('utf-8')
+
+
+def make_cache_key(model_name: str,
+                   system_instruction: Optional[Iterable[Any]],
+                   contents: Iterable[Any],
+                   response_schema: Optional[Dict[str, Any]],
+                   generation_config: Any = None) -> str:
+    """
+    Hash everything that determines a model response into a hex digest.
+    """
+    digest = hashlib.sha256()
+    sections = (
+        [model_name],
+        list(system_instruction or []),
+        list(contents),
+        [response_schema],
+        [generation_config],
+    )
+    for section in sections:
+        digest.update(b'\x1e')
+        for item in section:
+            part = _content_digest(item)
+            digest.update(len(part).to_bytes(8, 'big'))
+            digest.update(part)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache of raw model response texts.
+
+    Entries live in `<cache_dir>/<key[:2]>/<key>.json`. Entries older than `max_age_seconds`
+    are treated as misses and removed. The directory is scanned once, when the cache is
+    opened; after that an in-memory index (least recently used first) tracks every entry's
+    size and age. When the cache grows past `max_bytes`, expired entries and then the least
+    recently used ones are evicted until it is under `low_water * max_bytes`, so eviction
+    runs once per batch of writes rather than on every put.
+
+    Attributes:
+        cache_dir (str): Directory holding the cache entries.
+        max_bytes (int): Upper bound on the total size of cached entries.
+        max_age_seconds (Optional[float]): Lifetime of an entry, None to keep forever.
+        bypass (bool): When True, lookups always miss but fresh responses are still stored.
+        low_water (float): Fraction of `max_bytes` eviction shrinks the cache to.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that required a model call.
+        evictions (int): Number of eviction passes run.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024,
+                 max_age_seconds: Optional[float] = 30 * 24 * 3600, bypass: bool = False,
+                 low_water: float = 0.9):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.bypass = bypass
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._key_locks = KeyLocks()
+        # key -> (size in bytes, write time), least recently used first.
+        self._index: Dict[str, Tuple[int, float]] = OrderedDict()
+        self._size = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self) -> None:
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for filename in files:
+                if filename.endswith('.json'):
+                    stat = os.stat(os.path.join(root, filename))
+                    entries.append((stat.st_atime, filename[:-len('.json')], stat.st_size, stat.st_mtime))
+        for _, key, size, written in sorted(entries):
+            self._index[key] = (size, written)
+            self._size += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def _is_expired(self, written: float, now: float) -> bool:
+        return self.max_age_seconds is not None and now - written > self.max_age_seconds
+
+    def _forget(self, key: str) -> None:
+        # Caller holds self._lock.
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._size -= entry[0]
+
+    def _remove(self, key: str) -> None:
+        with self._lock:
+            self._forget(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return the cached response text for a key, or None on a miss.
+        """
+        if self.bypass:
+            return None
+        with self._lock:
+            entry = self._index.get(key)
+        if entry is None:
+            return None
+        if self._is_expired(entry[1], time.time()):
+            self._remove(key)
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r') as file:
+                text = json.load(file)['text']
+        except FileNotFoundError:
+            # Removed by another process sharing the directory.
+            with self._lock:
+                self._forget(key)
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Dropping unreadable cache entry %s: %s", path, e)
+            self._remove(key)
+            return None
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+        # The access time orders entries the next time the directory is scanned.
+        try:
+            os.utime(path, (time.time(), entry[1]))
+        except OSError:
+            pass
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        """
+        Store a response text under a key and enforce the size limit.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        written = time.time()
+        with open(tmp_path, 'w') as file:
+            json.dump({'key': key, 'created_at': written, 'text': text}, file)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._forget(key)
+            self._index[key] = (size, written)
+            self._size += size
+            over_limit = self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def get_or_compute(self, key: str, compute_fn: Callable[[], str]) -> str:
+        """
+        Return the cached text for a key, calling `compute_fn` at most once per key on a miss.
+
+        Concurrent callers asking for the same key wait for the first one instead of
+        issuing duplicate model calls.
+        """
+        with self._key_locks.hold(key):
+            text = self.get(key)
+            if text is not None:
+                with self._lock:
+                    self.hits += 1
+                logger.info("Response cache hit for %s", key[:12])
+                return text
+            with self._lock:
+                self.misses += 1
+            text = compute_fn()
+            self.put(key, text)
+            return text
+
+    def evict(self) -> None:
+        """
+        Remove expired entries, then least recently used ones until under `low_water * max_bytes`.
+        """
+        now = time.time()
+        target = self.max_bytes * self.low_water
+        with self._lock:
+            self.evictions += 1
+            victims = [key for key, (_, written) in self._index.items() if self._is_expired(written, now)]
+            for key in victims:
+                self._forget(key)
+            for key in list(self._index):
+                if self._size <= target:
+                    break
+                self._forget(key)
+                victims.append(key)
+        for key in victims:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+        logger.debug("Evicted %s response cache entries", len(victims))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._index),
+                    'size_bytes': self._size, 'evictions': self.evictions}
+
+
+def default_response_cache(bypass: bool = False) -> ResponseCache:
+    """
+    Build a response cache from the settings in config.yml.
+    """
+    max_age_days = config.RESPONSE_CACHE_MAX_AGE_DAYS
+    return ResponseCache(config.RESPONSE_CACHE_DIR,
+                         max_bytes=int(config.RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+                         max_age_seconds=None if max_age_days is None else max_age_days * 24 * 3600,
+                         bypass=bypass)
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the response cache flags shared by the pipeline entry points.
+    """
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--no-cache', action='store_true', help="Do not read or write the response cache")
+    group.add_argument('--refresh-cache', action='store_true',
+                       help="Ignore cached responses but store the fresh ones")
+
+
+def response_cache_from_args(args: argparse.Namespace) -> Optional[ResponseCache]:
+    """
+    Build the response cache selected by the flags from add_cache_arguments.
+    """
+    if args.no_cache:
+        return None
+    return default_response_cache(bypass=args.refresh_cache)
@@ -1,57 +1,250 @@
-import os
+from concurrent.futures import ProcessPoolExecutor
+from src.generate.taxonomy import normalize_code
+from src.generate.aggregate import parse_unit
+from src.generate.jsonl import jsonl_doc_id
+from src.generate.jsonl import iter_jsonl
+from src.generate.jsonl import is_jsonl
+from src.config.logging import logger
+from typing import Any, Dict, List, Optional, Tuple
+from collections import defaultdict, deque
+import argparse
+import math
 import json
+import time
+import os
+
+
+GEN_DIR = './data/generated'
+EXPECTED_DIR = './data/expected'
+MATCH_FILE = './data/matches.jsonl'
+ACCURACY_FILE = './data/accuracy.txt'
+
+# Fields scored on matched pairs, beyond the (code, value) key used for matching.
+FIELDS = ('unit', 'page_number', 'year', 'scope', 'flag')
+
 
 def load_jsonl(file_path):
-    json_list = []
-    with open(file_path, 'r') as file:
-        for line in file:
-            json_obj = json.loads(line)
-            json_list.append(json_obj)
-    return json_list
+    return list(iter_jsonl(file_path))
 
-def compare_json_objects(json1, json2):
+
+def _missing(value: Any) -> bool:
+    return value is None or value == '' or value == 'null' or (isinstance(value, float) and math.isnan(value))
+
+
+def _as_int(value: Any) -> Optional[int]:
+    if _missing(value):
+        return None
     try:
-        code1 = int(json1.get('code', 0))
-        code2 = int(json2.get('code', 0))
-        value1 = int(json1.get('value', 0))
-        value2 = int(json2.get('value', 0))
-        unit1 = str(json1.get('unit', '')).strip()
-        unit2 = str(json2.get('unit', '')).strip()
-        return (code1 == code2 and value1 == value2)
-    except ValueError:
-        # Handle cases where conversion to int fails
-        return False
+        return int(float(str(value).replace(',', '')))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def match_key(record: Dict[str, Any]) -> Optional[Tuple[str, int]]:
+    """
+    Normalized (code, value) key a record is matched on, or None if it cannot be matched.
+
+    Codes are compared as strings ("429", 429 and 429.0 are the same code) and values are
+    compared as truncated integers, so 24428.0 and "24,428" agree.
+    """
+    code = None if _missing(record.get('code')) else normalize_code(record.get('code'))
+    value = _as_int(record.get('value'))
+    if code is None or value is None:
+        return None
+    return code, value
+
+
+def compare_json_objects(json1, json2):
+    key = match_key(json1)
+    return key is not None and key == match_key(json2)
+
+
+def normalize_field(field: str, value: Any) -> Any:
+    """
+    Comparable form of a scored field, or None when the field is not populated.
+    """
+    if _missing(value):
+        return None
+    if field in ('page_number', 'year'):
+        return _as_int(value)
+    text = ' '.join(str(value).split()).lower()
+    if field == 'unit':
+        canonical, scale = parse_unit(text)
+        return (canonical, scale) if canonical is not None else text
+    return text
+
+
+def match_records(generated: List[Dict[str, Any]], expected: List[Dict[str, Any]]) -> List[Tuple[int, int]]:
+    """
+    Pair generated and expected records one-to-one on their match key.
+
+    Generated records are hashed by key once, then each expected record takes the first
+    unused generated record with the same key, so the whole match is O(n + m).
+    Returns (generated index, expected index) pairs in expected order.
+    """
+    candidates = defaultdict(deque)
+    for index, record in enumerate(generated):
+        key = match_key(record)
+        if key is not None:
+            candidates[key].append(index)
+
+    pairs = []
+    for index, record in enumerate(expected):
+        queue = candidates.get(match_key(record))
+        if queue:
+            pairs.append((queue.popleft(), index))
+    return pairs
+
+
+def _field_counts() -> Dict[str, Dict[str, int]]:
+    return {field: {'generated': 0, 'expected': 0, 'correct': 0} for field in FIELDS}
+
 
 def compare_jsonl_files(file1_path, file2_path):
-    json_list1 = load_jsonl(file1_path)
-    json_list2 = load_jsonl(file2_path)
-    
-    matches = []
-    for obj2 in json_list2:
-        for obj1 in json_list1:
-            if compare_json_objects(obj1, obj2):
-                matches.append((obj1, obj2))
-                break
-    return matches, len(json_list2)
-
-def iterate_and_compare(dir1, dir2):
-    match_file_path = 'matches.jsonl'
-    accuracy_file_path = 'accuracy.txt'
-    
+    """
+    Compare a generated file (`file1_path`) against its expected file (`file2_path`).
+
+    Returns the matched (generated, expected) record pairs and the number of expected records.
+    """
+    generated = load_jsonl(file1_path)
+    expected = load_jsonl(file2_path)
+    return [(generated[g], expected[e]) for g, e in match_records(generated, expected)], len(expected)
+
+
+def evaluate_file(generated_path: str, expected_path: str) -> Dict[str, Any]:
+    """
+    Evaluate one generated file against its expected file.
+
+    Per-field counts are taken over matched pairs: `generated`/`expected` count pairs where
+    that side has the field populated, `correct` counts pairs where both agree.
+    """
+    generated = load_jsonl(generated_path)
+    expected = load_jsonl(expected_path)
+    pairs = match_records(generated, expected)
+
+    fields = _field_counts()
+    for g, e in pairs:
+        for field in FIELDS:
+            generated_value = normalize_field(field, generated[g].get(field))
+            expected_value = normalize_field(field, expected[e].get(field))
+            counts = fields[field]
+            counts['generated'] += generated_value is not None
+            counts['expected'] += expected_value is not None
+            counts['correct'] += generated_value is not None and generated_value == expected_value
+
+    return {
+        'filename': os.path.basename(generated_path),
+        'generated': len(generated),
+        'expected': len(expected),
+        'matched': len(pairs),
+        'fields': fields,
+        'matches': [{'generated': generated[g], 'expected': expected[e]} for g, e in pairs],
+    }
+
+
+def _ratio(numerator: int, denominator: int) -> Optional[float]:
+    return numerator / denominator if denominator else None
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine per-file results into overall match rate and per-field precision/recall.
+    """
+    generated = sum(result['generated'] for result in results)
+    expected = sum(result['expected'] for result in results)
+    matched = sum(result['matched'] for result in results)
+    fields = _field_counts()
+    for result in results:
+        for field, counts in result['fields'].items():
+            for name, count in counts.items():
+                fields[field][name] += count
+    return {
+        'files': len(results),
+        'generated': generated,
+        'expected': expected,
+        'matched': matched,
+        'match_rate': _ratio(matched, expected),
+        'precision': _ratio(matched, generated),
+        'fields': {
+            field: {**counts,
+                    'precision': _ratio(counts['correct'], counts['generated']),
+                    'recall': _ratio(counts['correct'], counts['expected'])}
+            for field, counts in fields.items()
+        },
+    }
+
+
+def evaluate(generated_dir: str = GEN_DIR, expected_dir: str = EXPECTED_DIR, max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Evaluate every generated JSONL file (optionally compressed) that has an expected counterpart.
+
+    Files are evaluated in parallel on a process pool and reported in filename order.
+    Returns {'files': [per-file results], 'summary': summarize(...)}.
+    """
+    start = time.perf_counter()
+    jobs = []
+    for filename in sorted(os.listdir(generated_dir)):
+        if not is_jsonl(filename):
+            continue
+        expected_path = os.path.join(expected_dir, f'{jsonl_doc_id(filename)}.jsonl')
+        if os.path.exists(expected_path):
+            jobs.append((os.path.join(generated_dir, filename), expected_path))
+        else:
+            logger.warning("File %s not found in %s", filename, expected_dir)
+
+    if max_workers == 1 or len(jobs) <= 1:
+        results = [evaluate_file(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(evaluate_file, *zip(*jobs)))
+
+    summary = summarize(results)
+    logger.info("Evaluated %s files in %.2fs: %s/%s expected records matched",
+                len(results), time.perf_counter() - start, summary['matched'], summary['expected'])
+    return {'files': results, 'summary': summary}
+
+
+def write_report(report: Dict[str, Any], match_file_path: str = MATCH_FILE, accuracy_file_path: str = ACCURACY_FILE,
+                 summary_file_path: Optional[str] = None):
+    """
+    Write matched pairs as JSONL, per-file accuracy as text and, optionally, the summary as JSON.
+    """
+    for path in (match_file_path, accuracy_file_path, summary_file_path):
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
     with open(match_file_path, 'w') as match_file, open(accuracy_file_path, 'w') as accuracy_file:
-        for filename in os.listdir(dir1):
-            if filename.endswith(".jsonl"):
-                file1_path = os.path.join(dir1, filename)
-                file2_path = os.path.join(dir2, filename)
-                if os.path.exists(file2_path):
-                    matches, total_expected = compare_jsonl_files(file1_path, file2_path)
-                    for generated, expected in matches:
-                        match_file.write(json.dumps({'filename': filename, 'generated': generated, 'expected': expected}) + '\n')
-                    accuracy = len(matches) / total_expected * 100 if total_expected else 0
-                    accuracy_file.write(f"{filename}: {accuracy:.2f}%\n")
-                else:
-                    print(f"File {filename} not found in {dir2}")
-
-dir1 = './data/generated'
-dir2 = './data/expected'
-iterate_and_compare(dir1, dir2)
+        for result in report['files']:
+            for match in result['matches']:
+                match_file.write(json.dumps({'filename': result['filename'], **match}) + '\n')
+            accuracy = result['matched'] / result['expected'] * 100 if result['expected'] else 0
+            accuracy_file.write(f"{result['filename']}: {accuracy:.2f}%\n")
+
+    if summary_file_path:
+        with open(summary_file_path, 'w') as summary_file:
+            json.dump(report['summary'], summary_file, indent=2)
+
+
+def iterate_and_compare(dir1, dir2, match_file_path=MATCH_FILE, accuracy_file_path=ACCURACY_FILE, max_workers=None):
+    report = evaluate(dir1, dir2, max_workers)
+    write_report(report, match_file_path, accuracy_file_path)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate generated metrics against the expected data.")
+    parser.add_argument('--generated', default=GEN_DIR, help="Directory of generated <doc_id>.jsonl files")
+    parser.add_argument('--expected', default=EXPECTED_DIR, help="Directory of expected <doc_id>.jsonl files")
+    parser.add_argument('--matches', default=MATCH_FILE, help="Where to write matched record pairs")
+    parser.add_argument('--accuracy', default=ACCURACY_FILE, help="Where to write per-file accuracy")
+    parser.add_argument('--summary', default=None, help="Optional path for the JSON summary")
+    parser.add_argument('--workers', type=int, default=None, help="Process pool size (1 runs in-process)")
+    args = parser.parse_args()
+
+    report = evaluate(args.generated, args.expected, args.workers)
+    write_report(report, args.matches, args.accuracy, args.summary)
+    print(json.dumps(report['summary'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+from src.generate.scheduler import estimate_tokens
+from src.generate.cache import make_cache_key
+from src.generate.cache import KeyLocks
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Any, Dict, List, Optional
+import threading
+import datetime
+import time
+
+
+class CachedPrefix:
+    """
+    Server-side cached content holding a request prefix (system instruction and/or leading parts).
+
+    Attributes:
+        key (str): Content hash of the model, cached instruction and cached parts.
+        name (str): Resource name returned by the caching service.
+        tokens (int): Estimated tokens stored in the cache.
+        expires_at (float): `time.monotonic()` deadline after which the server drops it.
+        doc_id (Optional[str]): Document owning the cache; None for caches shared by the corpus.
+        uses (int): Requests served from this cache.
+    """
+
+    def __init__(self, key: str, name: str, tokens: int, expires_at: float, doc_id: Optional[str] = None):
+        self.key = key
+        self.name = name
+        self.tokens = tokens
+        self.expires_at = expires_at
+        self.doc_id = doc_id
+        self.uses = 0
+
+
+class VertexCachingService:
+    """
+    Thin wrapper over Vertex AI context caching; the SDK is only imported on first use.
+    """
+
+    def create(self, model_name: str, system_instruction: Optional[List[str]], parts: List[Any], ttl: float) -> str:
+        from vertexai.preview import caching
+        from vertexai.generative_models import Content, Part
+        from src.generate.backends import to_vertex_part
+
+        def to_parts(items: List[Any]) -> List[Any]:
+            return [Part.from_text(item) if isinstance(item, str) else to_vertex_part(item) for item in items]
+
+        cached = caching.CachedContent.create(
+            model_name=model_name,
+            system_instruction=Content(role='system', parts=to_parts(system_instruction)) if system_instruction else None,
+            contents=[Content(role='user', parts=to_parts(parts))] if parts else None,
+            ttl=datetime.timedelta(seconds=ttl))
+        return cached.name
+
+    def update_ttl(self, name: str, ttl: float) -> None:
+        from vertexai.preview import caching
+        caching.CachedContent(cached_content_name=name).update(ttl=datetime.timedelta(seconds=ttl))
+
+    def delete(self, name: str) -> None:
+        from vertexai.preview import caching
+        caching.CachedContent(cached_content_name=name).delete()
+
+    def model(self, name: str, model_name: str) -> Any:
+        from vertexai.preview import caching
+        from vertexai.preview.generative_models import GenerativeModel
+        return GenerativeModel.from_cached_content(cached_content=caching.CachedContent(cached_content_name=name))
+
+
+class ContextCacheManager:
+    """
+    Creates, shares, refreshes and deletes server-side caches of repeated request prefixes.
+
+    A prefix (a system instruction and the leading parts) is cached once per content hash. A
+    prefix holding a document's parts is shared by that document's requests and deleted when
+    the document finishes; one without parts lives until `release()`. Caches are created
+    with `ttl` seconds to live and extended when a request arrives within `ttl / 4` of expiry.
+
+    Prefixes estimated below `min_tokens` (the service minimum) are not cached, and a prefix
+    the service refuses is remembered and sent inline from then on, so callers always have
+    the uncached path to fall back on.
+
+    Attributes:
+        service (Any): Caching service (VertexCachingService or a fake).
+        ttl (float): Lifetime of new caches in seconds.
+        min_tokens (int): Smallest prefix worth caching.
+        created (int): Caches created.
+        hits (int): Requests served from a cache.
+        fallbacks (int): Requests sent uncached because their prefix could not be cached.
+    """
+
+    def __init__(self, service: Any, ttl: float = 600, min_tokens: int = 32768):
+        self.service = service
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.created = 0
+        self.hits = 0
+        self.fallbacks = 0
+        self._entries: Dict[str, CachedPrefix] = {}
+        # Prefixes that could not be cached -> owning document, so they are not retried.
+        self._refused: Dict[str, Optional[str]] = {}
+        self._key_locks = KeyLocks()
+        self._lock = threading.Lock()
+
+    def acquire(self, model_name: str, system_instruction: Optional[List[str]], parts: List[Any],
+                doc_id: Optional[str] = None) -> Optional[CachedPrefix]:
+        """
+        Return a live cache for this prefix, creating or refreshing it as needed, or None to
+        send the request uncached.
+        """
+        key = make_cache_key(model_name, system_instruction, parts, None)
+        # Concurrent requests share a prefix; only one of them creates it.
+        with self._key_locks.hold(key):
+            with self._lock:
+                entry = self._entries.get(key)
+                if key in self._refused:
+                    self.fallbacks += 1
+                    return None
+
+            now = time.monotonic()
+            if entry is not None and entry.expires_at - now < self.ttl / 4:
+                entry = self._refresh(entry, now)
+            if entry is None:
+                entry = self._create(key, model_name, system_instruction, parts, doc_id if parts else None)
+                if entry is None:
+                    with self._lock:
+                        self.fallbacks += 1
+                    return None
+            with self._lock:
+                entry.uses += 1
+                self.hits += 1
+            return entry
+
+    def _create(self, key: str, model_name: str, system_instruction: Optional[List[str]], parts: List[Any],
+                doc_id: Optional[str]) -> Optional[CachedPrefix]:
+        tokens = estimate_tokens(parts, system_instruction)
+        entry = None
+        if tokens < self.min_tokens:
+            logger.debug("Prefix of ~%s tokens is below the %s-token caching minimum", tokens, self.min_tokens)
+        else:
+            try:
+                name = self.service.create(model_name, system_instruction, parts, self.ttl)
+                entry = CachedPrefix(key, name, tokens, time.monotonic() + self.ttl, doc_id)
+                logger.info("Cached ~%s prefix tokens as %s for %s", tokens, name, doc_id or 'the corpus')
+            except Exception as e:
+                logger.warning("Context caching unavailable, sending the prefix inline: %s", e)
+        with self._lock:
+            if entry is None:
+                self._refused[key] = doc_id
+            else:
+                self._entries[key] = entry
+                self.created += 1
+        return entry
+
+    def _refresh(self, entry: CachedPrefix, now: float) -> Optional[CachedPrefix]:
+        if entry.expires_at > now:
+            try:
+                self.service.update_ttl(entry.name, self.ttl)
+                entry.expires_at = now + self.ttl
+                return entry
+            except Exception as e:
+                logger.warning("Could not extend %s, recreating it: %s", entry.name, e)
+        with self._lock:
+            self._entries.pop(entry.key, None)
+        return None
+
+    def release(self, doc_id: Optional[str] = None) -> List[str]:
+        """
+        Delete the caches owned by `doc_id`, or every cache when `doc_id` is None, and return
+        their names.
+        """
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if doc_id is None or entry.doc_id == doc_id]
+            entries = [self._entries.pop(key) for key in keys]
+            refused = [key for key, owner in self._refused.items() if doc_id is None or owner == doc_id]
+            for key in keys + refused:
+                self._refused.pop(key, None)
+        for entry in entries:
+            try:
+                self.service.delete(entry.name)
+            except Exception as e:
+                # The TTL still bounds how long an undeleted cache is billed.
+                logger.warning("Could not delete cached content %s: %s", entry.name, e)
+        return [entry.name for entry in entries]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'created': self.created, 'hits': self.hits, 'fallbacks': self.fallbacks, 'live': len(self._entries)}
+
+
+def create_context_cache(service: Optional[Any] = None) -> Optional[ContextCacheManager]:
+    """
+    Build the context cache manager configured in config.yml, or None when it is disabled.
+    """
+    if not config.CONTEXT_CACHE:
+        return None
+    return ContextCacheManager(service or VertexCachingService(), ttl=config.CONTEXT_CACHE_TTL,
+                               min_tokens=config.CONTEXT_CACHE_MIN_TOKENS)
@@ -0,0 +1,377 @@
+from src.generate.page_index import extract_page_texts
+from src.generate.metric_store import get_metric_store
+from src.generate.manifest import RunManifest
+from src.generate.manifest import hash_file
+from src.generate.jsonl import jsonl_doc_id
+from src.generate.jsonl import jsonl_path
+from src.generate.jsonl import iter_jsonl
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import argparse
+import shutil
+import zlib
+import json
+import re
+import os
+
+
+INDEX_FILE = './data/cache/dedup_index.jsonl'
+
+# 128 permutations in 16 bands of 8 rows: pairs above ~0.7 Jaccard share a band with high
+# probability, pairs below ~0.5 almost never do.
+NUM_PERM = 128
+BANDS = 16
+SHINGLE_WORDS = 5
+_PRIME = 4294967311  # Smallest prime above 2**32, so every 32-bit shingle hash stays distinct.
+_WORDS = re.compile(r'\w+')
+
+
+def _permutations():
+    import numpy as np
+    # Fixed seed: signatures are persisted, so every process must use the same permutations.
+    rng = np.random.default_rng(20240601)
+    a = rng.integers(1, 2 ** 31, NUM_PERM, dtype=np.uint64)
+    b = rng.integers(0, 2 ** 31, NUM_PERM, dtype=np.uint64)
+    return a, b
+
+
+_perm = None
+_perm_lock = threading.Lock()
+
+
+def shingles(page_texts: List[str], size: int = SHINGLE_WORDS) -> List[int]:
+    """
+    32-bit hashes of the distinct `size`-word shingles of a document's normalized text.
+    """
+    words = _WORDS.findall(' '.join(page_texts).lower())
+    if len(words) < size:
+        return [zlib.crc32(' '.join(words).encode('utf-8'))] if words else []
+    return list({zlib.crc32(' '.join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1)})
+
+
+def minhash(shingle_hashes: List[int]) -> List[int]:
+    """
+    MinHash signature of a shingle set: per permutation, the minimum of (a * x + b) mod p.
+    """
+    import numpy as np
+    global _perm
+    with _perm_lock:
+        if _perm is None:
+            _perm = _permutations()
+    a, b = _perm
+    if not shingle_hashes:
+        return [_PRIME] * NUM_PERM
+    x = np.asarray(shingle_hashes, dtype=np.uint64)
+    # a < 2**31 and x < 2**32, so a * x + b fits in 64 bits.
+    return ((np.outer(x, a) + b) % _PRIME).min(axis=0).tolist()
+
+
+def similarity(signature: List[int], other: List[int]) -> float:
+    """
+    Estimated Jaccard similarity of two documents from their signatures.
+    """
+    return sum(1 for x, y in zip(signature, other) if x == y) / NUM_PERM
+
+
+def _bands(signature: List[int]) -> List[str]:
+    rows = NUM_PERM // BANDS
+    return [f'{band}:' + ','.join(map(str, signature[band * rows:(band + 1) * rows])) for band in range(BANDS)]
+
+
+class DedupIndex:
+    """
+    Persistent fingerprint index mapping every PDF to the document whose extraction it reuses.
+
+    A PDF is an exact duplicate when its SHA-256 was seen before, and a near duplicate (a
+    republished report with small edits) when the MinHash signature of its page-text
+    shingles is at least `threshold` similar to a known document's. Lookups are dict hits:
+    by hash, and by LSH band for near duplicates; known files are recognized by size and
+    mtime without re-reading them.
+
+    The index is a JSONL journal like the run manifest: one line per registered document,
+    replayed on load. An entry looks like:
+        {"doc_id": ..., "size": ..., "mtime_ns": ..., "sha256": ..., "signature": [...],
+         "canonical": ..., "similar_to": ..., "similarity": ...}
+
+    Attributes:
+        path (str): Location of the JSONL journal.
+        threshold (float): Minimum estimated Jaccard similarity of a near duplicate.
+        near_duplicates (bool): Reuse the extraction of near duplicates, not just report them.
+        documents (Dict[str, Dict[str, Any]]): Latest entry per document ID.
+    """
+
+    def __init__(self, path: str = INDEX_FILE, threshold: float = 0.9, near_duplicates: bool = False):
+        self.path = path
+        self.threshold = threshold
+        self.near_duplicates = near_duplicates
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self._by_hash: Dict[str, str] = {}
+        self._by_band: Dict[str, List[str]] = {}
+        self._repointed: List[str] = []
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping corrupt dedup index line in %s", self.path)
+                    continue
+                self.documents[entry['doc_id']] = entry
+        for entry in self.documents.values():
+            self._index(entry)
+        self._compact()
+        logger.info("Loaded dedup index with %s documents from %s", len(self.documents), self.path)
+
+    def _compact(self) -> None:
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            for entry in self.documents.values():
+                file.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def _index(self, entry: Dict[str, Any]) -> None:
+        # Caller holds the lock (or is loading). The first document with a hash owns it.
+        owner = self._by_hash.setdefault(entry['sha256'], entry['doc_id'])
+        if owner == entry['doc_id'] and entry.get('signature'):
+            for band in _bands(entry['signature']):
+                self._by_band.setdefault(band, []).append(entry['doc_id'])
+
+    def _unindex(self, entry: Dict[str, Any]) -> None:
+        # Caller holds the lock. Drops a document's previous entry when its file changed.
+        if self._by_hash.get(entry['sha256']) != entry['doc_id']:
+            return
+        del self._by_hash[entry['sha256']]
+        for band in _bands(entry['signature']) if entry.get('signature') else ():
+            self._by_band[band].remove(entry['doc_id'])
+
+    def _record(self, entry: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+
+    def _nearest(self, doc_id: str, signature: List[int]) -> Tuple[Optional[str], float]:
+        best, best_similarity = None, 0.0
+        candidates = {candidate for band in _bands(signature) for candidate in self._by_band.get(band, ())}
+        for candidate in sorted(candidates - {doc_id}):
+            score = similarity(signature, self.documents[candidate]['signature'])
+            if score > best_similarity:
+                best, best_similarity = candidate, score
+        return best, best_similarity
+
+    def _needs_signature(self, entry: Dict[str, Any]) -> bool:
+        # Only the first document with some content is compared by text; copies use its signature.
+        return self.near_duplicates and entry.get('signature') is None and self._by_hash.get(entry['sha256']) == entry['doc_id']
+
+    def fingerprint(self, doc_id: str, pdf_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Hash a PDF that is new or changed since it was registered, and with `near_duplicates`
+        also MinHash its page text; None when it is known and unchanged. Reads the index
+        without changing it, so many files can be fingerprinted concurrently before `add`.
+        """
+        stat = os.stat(pdf_path)
+        with self._lock:
+            entry = self.documents.get(doc_id)
+            unchanged = entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+            if unchanged and not self._needs_signature(entry):
+                return None
+        sha256 = entry['sha256'] if unchanged else hash_file(pdf_path)
+        signature = entry['signature'] if entry is not None and entry['sha256'] == sha256 else None
+        if signature is None and self.near_duplicates:
+            with self._lock:
+                owner = self._by_hash.get(sha256)
+            if owner is None or owner == doc_id:
+                try:
+                    with open(pdf_path, 'rb') as file:
+                        signature = minhash(shingles(extract_page_texts(file.read())))
+                except Exception as e:
+                    logger.warning("Could not fingerprint the text of %s, using its hash only: %s", pdf_path, e)
+                    # Empty rather than None, so the failure is not retried on every run.
+                    signature = []
+        return {'doc_id': doc_id, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256,
+                'signature': signature}
+
+    def add(self, fingerprint: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Index a result of `fingerprint` and return the document's entry.
+        """
+        doc_id, sha256, signature = fingerprint['doc_id'], fingerprint['sha256'], fingerprint['signature']
+        with self._lock:
+            previous = self.documents.get(doc_id)
+            if previous is not None:
+                self._unindex(previous)
+            owner = self._by_hash.get(sha256)
+            entry = {**fingerprint, 'canonical': doc_id, 'similar_to': None, 'similarity': None}
+            if owner is not None:
+                entry['canonical'] = self.documents[owner]['canonical']
+                entry['similar_to'], entry['similarity'] = owner, 1.0
+            elif signature:
+                nearest, score = self._nearest(doc_id, signature)
+                if nearest is not None and score >= self.threshold:
+                    entry['similar_to'], entry['similarity'] = nearest, score
+                    entry['canonical'] = self.documents[nearest]['canonical']
+            self.documents[doc_id] = entry
+            self._index(entry)
+            self._record(entry)
+            if previous is not None and previous['sha256'] != sha256:
+                self._repoint(previous)
+        if entry['similar_to'] is not None:
+            logger.info("%s duplicates %s (similarity %.2f)", doc_id, entry['similar_to'], entry['similarity'])
+        return entry
+
+    def _repoint(self, previous: Dict[str, Any]) -> None:
+        """
+        Caller holds the lock. A document's content changed, so the documents reusing its
+        old extraction must not receive its new one: the first exact copy of the old content
+        takes over as canonical for the other copies (whose output is still right), and near
+        duplicates become their own canonical, collected for `pop_repointed` to be extracted.
+        """
+        doc_id, old_sha = previous['doc_id'], previous['sha256']
+        copies = [entry for entry in self.documents.values() if entry['sha256'] == old_sha and entry['doc_id'] != doc_id]
+        if copies and old_sha not in self._by_hash:
+            copies[0]['signature'] = copies[0].get('signature') or previous.get('signature')
+            self._index(copies[0])
+        new_owner = copies[0]['doc_id'] if copies else None
+        for entry in list(self.documents.values()):
+            if entry['canonical'] != doc_id or entry['doc_id'] == doc_id:
+                continue
+            if entry['doc_id'] == new_owner:
+                entry['canonical'], entry['similar_to'], entry['similarity'] = new_owner, None, None
+            elif entry['sha256'] == old_sha:
+                entry['canonical'], entry['similar_to'], entry['similarity'] = new_owner, new_owner, 1.0
+            else:
+                entry['canonical'], entry['similar_to'], entry['similarity'] = entry['doc_id'], None, None
+                self._repointed.append(entry['doc_id'])
+            self._record(entry)
+            logger.info("%s changed, %s now reuses %s", doc_id, entry['doc_id'], entry['canonical'])
+
+    def pop_repointed(self) -> List[str]:
+        """
+        Near duplicates whose canonical document changed since the last call; their output
+        is a copy of the old content and has to be extracted again.
+        """
+        with self._lock:
+            repointed, self._repointed = self._repointed, []
+        return repointed
+
+    def register(self, doc_id: str, pdf_path: str) -> Dict[str, Any]:
+        """
+        Fingerprint a PDF (unless it is known and unchanged) and return its index entry.
+        `entry['canonical']` is the document whose extraction this one should reuse.
+        """
+        fingerprint = self.fingerprint(doc_id, pdf_path)
+        if fingerprint is None:
+            with self._lock:
+                return self.documents[doc_id]
+        return self.add(fingerprint)
+
+
+def group_documents(doc_ids: List[str], pdf_dir: str, gen_dir: str,
+                    index: Optional[DedupIndex] = None, manifest: Optional[RunManifest] = None) -> Dict[str, List[str]]:
+    """
+    Register a batch of PDFs and group them by content.
+
+    Returns representative -> aliases (other documents reusing its extraction), with one
+    representative per distinct content, in `doc_ids` order. New and changed files are
+    fingerprinted on a thread pool, then indexed in `doc_ids` order. Aliases of a document
+    outside the batch whose output already exists are fanned out right away and not
+    returned; near duplicates outside the batch whose canonical changed are returned for
+    extraction. With a run manifest, aliases fanned out are marked done in it.
+    """
+    index = index if index is not None else get_dedup_index()
+    if index is None:
+        return {doc_id: [] for doc_id in doc_ids}
+    with ThreadPoolExecutor(max_workers=config.MAX_WORKERS, thread_name_prefix="dedup") as executor:
+        fingerprints = list(executor.map(lambda doc_id: index.fingerprint(doc_id, os.path.join(pdf_dir, f'{doc_id}.pdf')),
+                                         doc_ids))
+    for fingerprint in fingerprints:
+        if fingerprint is not None:
+            index.add(fingerprint)
+    batch = set(doc_ids)
+    doc_ids = doc_ids + [doc_id for doc_id in dict.fromkeys(index.pop_repointed()) if doc_id not in batch]
+    batch.update(doc_ids)
+
+    groups: Dict[str, List[str]] = {}
+    representative: Dict[str, str] = {}
+    for doc_id in doc_ids:
+        canonical = index.documents[doc_id]['canonical']
+        if canonical != doc_id and canonical not in batch:
+            output_file = jsonl_path(gen_dir, canonical, config.OUTPUT_COMPRESSION)
+            if os.path.exists(output_file):
+                fan_out(output_file, [doc_id], gen_dir, manifest, pdf_dir)
+                continue
+        if canonical in batch:
+            # Keep the canonical document as the representative if it is in this batch.
+            representative.setdefault(canonical, canonical)
+        key = representative.setdefault(canonical, doc_id)
+        if key == doc_id:
+            groups.setdefault(doc_id, [])
+        else:
+            groups.setdefault(key, []).append(doc_id)
+    if len(groups) < len(doc_ids):
+        logger.info("Deduplicated %s documents to %s distinct extractions", len(doc_ids), len(groups))
+    return groups
+
+
+def fan_out(output_file: str, aliases: List[str], gen_dir: str,
+            manifest: Optional[RunManifest] = None, pdf_dir: Optional[str] = None) -> str:
+    """
+    Copy a document's generated JSONL to each alias, atomically, and add the aliases to the
+    metric store when it is enabled. With a run manifest, each alias (`<pdf_dir>/<alias>.pdf`)
+    is also marked done in it. Returns `output_file`.
+    """
+    metric_store = get_metric_store(gen_dir)
+    for alias in aliases:
+        alias_file = jsonl_path(gen_dir, alias, config.OUTPUT_COMPRESSION)
+        tmp_path = f'{alias_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        shutil.copyfile(output_file, tmp_path)
+        os.replace(tmp_path, alias_file)
+        if metric_store is not None:
+            metric_store.append(alias, iter_jsonl(alias_file))
+        if manifest is not None:
+            manifest.mark_alias(alias, os.path.join(pdf_dir, f'{alias}.pdf'), jsonl_doc_id(output_file), alias_file)
+    if aliases:
+        logger.info("Copied %s to %s", output_file, ', '.join(aliases))
+    return output_file
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def get_dedup_index() -> Optional[DedupIndex]:
+    """
+    Process-wide dedup index from config.yml, or None when `dedup` is disabled.
+    """
+    global _default_index
+    if not config.DEDUP:
+        return None
+    with _default_lock:
+        if _default_index is None:
+            _default_index = DedupIndex(config.DEDUP_INDEX, config.DEDUP_THRESHOLD, config.DEDUP_NEAR_DUPLICATES)
+        return _default_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint PDFs and list exact and near duplicates.")
+    parser.add_argument('pdf_dir', nargs='?', default='./data/pdfs')
+    parser.add_argument('--index', default=INDEX_FILE, help="Dedup index journal")
+    parser.add_argument('--threshold', type=float, default=0.9, help="Near-duplicate similarity")
+    args = parser.parse_args()
+
+    index = DedupIndex(args.index, args.threshold, near_duplicates=True)
+    for filename in sorted(os.listdir(args.pdf_dir)):
+        if filename.endswith('.pdf'):
+            entry = index.register(filename[:-len('.pdf')], os.path.join(args.pdf_dir, filename))
+            print(json.dumps({key: entry[key] for key in ('doc_id', 'sha256', 'canonical', 'similar_to', 'similarity')}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+from src.generate.telemetry import document_context
+from src.generate.telemetry import get_telemetry
+from src.config.logging import logger
+from typing import Any, Callable, List, Optional
+import time
+
+
+class DocumentResult:
+    """
+    Outcome of processing a single document.
+
+    Attributes:
+        doc_id (str): Identifier of the document (PDF file name without extension).
+        output (Any): Value returned by the processing function, None if it failed.
+        error (Optional[Exception]): Exception raised while processing, if any.
+        elapsed (float): Wall-clock seconds spent on the document.
+    """
+
+    def __init__(self, doc_id: str, output: Any = None, error: Optional[Exception] = None, elapsed: float = 0.0):
+        self.doc_id = doc_id
+        self.output = output
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def run_document(doc_id: str, process_fn: Callable[[str], Any]) -> DocumentResult:
+    """
+    Run the processing function for one document, isolating any failure to that document.
+    Telemetry recorded while it runs is attributed to the document.
+    """
+    start = time.perf_counter()
+    with document_context(doc_id):
+        try:
+            with get_telemetry().span('document'):
+                output = process_fn(doc_id)
+            return DocumentResult(doc_id, output=output, elapsed=time.perf_counter() - start)
+        except Exception as e:
+            logger.error("Error processing document %s: %s", doc_id, e)
+            return DocumentResult(doc_id, error=e, elapsed=time.perf_counter() - start)
+
+
+def process_documents(doc_ids: List[str], process_fn: Callable[[str], Any], max_workers: int = 4) -> List[DocumentResult]:
+    """
+    Process many documents concurrently on a bounded thread pool.
+
+    Model calls are network-bound, so threads give real parallelism here. Each document
+    runs its steps sequentially inside a single worker; results are returned in the same
+    order as `doc_ids`, regardless of completion order.
+    """
+    max_workers = max(1, int(max_workers))
+    logger.info("Processing %s documents with %s workers", len(doc_ids), max_workers)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="extract") as executor:
+        futures = [executor.submit(run_document, doc_id, process_fn) for doc_id in doc_ids]
+        results = [future.result() for future in futures]
+    failed = sum(1 for result in results if not result.ok)
+    logger.info("Processed %s documents in %.2fs (%s failed)", len(results), time.perf_counter() - start, failed)
+    return results
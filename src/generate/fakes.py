@@ -0,0 +1,204 @@
+from src.generate.backends import VertexBackend
+from src.generate.backends import ModelRequest
+from src.generate.scheduler import estimate_tokens
+from typing import Any, Callable, Dict, List, Optional
+import threading
+import json
+import time
+
+
+class FakeCandidate:
+    """
+    Minimal stand-in for a response candidate.
+    """
+
+    def __init__(self, finish_reason: str = "STOP"):
+        self.finish_reason = finish_reason
+        self.safety_ratings = []
+
+
+class FakeUsage:
+    """
+    Minimal stand-in for a response's `usage_metadata`.
+    """
+
+    def __init__(self, prompt_token_count: int, cached_content_token_count: int = 0, candidates_token_count: int = 0):
+        self.prompt_token_count = prompt_token_count
+        self.cached_content_token_count = cached_content_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    """
+    Minimal stand-in for a GenerationResponse exposing `text`, `candidates` and `usage_metadata`.
+    """
+
+    def __init__(self, text: str, usage_metadata: Optional[FakeUsage] = None):
+        self.text = text
+        self.candidates = [FakeCandidate()]
+        self.usage_metadata = usage_metadata
+
+
+class FakeGenerativeModel:
+    """
+    Local replacement for `GenerativeModel` that injects latency instead of calling Vertex AI.
+
+    It accepts the same constructor arguments as `GenerativeModel`, so it can be plugged into
+    a VertexBackend, e.g. `FakeVertexBackend(functools.partial(FakeGenerativeModel, latency=0.5))`.
+
+    Attributes:
+        model_name (str): Name the model was created with.
+        system_instruction (Optional[List[str]]): System instruction the model was created with.
+        latency (float): Seconds to sleep in every `generate_content` call.
+        payload (Any): JSON-serializable object returned as the response text.
+        cached_tokens (int): Prefix tokens held by the context cache this model is bound to.
+        calls (int): Number of `generate_content` calls made across all instances.
+        inline_tokens (int): Estimated input tokens sent with requests across all instances.
+    """
+
+    calls = 0
+    inline_tokens = 0
+    _lock = threading.Lock()
+
+    def __init__(self, model_name: str, system_instruction: Optional[List[str]] = None, latency: float = 0.0, payload: Any = None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.latency = latency
+        self.payload = [] if payload is None else payload
+        self.cached_tokens = 0
+
+    def generate_content(self, contents: List[Any], generation_config: Any = None, safety_settings: Any = None) -> FakeResponse:
+        tokens = estimate_tokens(contents, self.system_instruction)
+        with FakeGenerativeModel._lock:
+            FakeGenerativeModel.calls += 1
+            FakeGenerativeModel.inline_tokens += tokens
+        time.sleep(self.latency)
+        return FakeResponse(json.dumps(self.payload), FakeUsage(tokens + self.cached_tokens, self.cached_tokens))
+
+
+class FakeQuotaError(Exception):
+    """
+    Mimics a 429 ResourceExhausted error, including an optional Retry-After hint.
+    """
+
+    code = 429
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class FakeQuota:
+    """
+    Sliding-window request quota shared by throttling fake models.
+
+    Attributes:
+        limit (int): Requests allowed per window.
+        window (float): Window length in seconds.
+        rejected (int): Requests rejected with a quota error.
+    """
+
+    def __init__(self, limit: int, window: float = 60.0):
+        self.limit = limit
+        self.window = window
+        self.rejected = 0
+        self._calls = []
+        self._lock = threading.Lock()
+
+    def admit(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._calls = [t for t in self._calls if now - t < self.window]
+            if len(self._calls) >= self.limit:
+                self.rejected += 1
+                raise FakeQuotaError("429 Quota exceeded", retry_after=self.window - (now - self._calls[0]))
+            self._calls.append(now)
+
+
+class ThrottlingFakeModel(FakeGenerativeModel):
+    """
+    Fake model that rejects calls with `FakeQuotaError` once the shared quota is exhausted.
+    """
+
+    def __init__(self, model_name: str, system_instruction: Optional[List[str]] = None, quota: Optional[FakeQuota] = None, **kwargs):
+        super().__init__(model_name, system_instruction=system_instruction, **kwargs)
+        self.quota = quota
+
+    def generate_content(self, contents: List[Any], generation_config: Any = None, safety_settings: Any = None) -> FakeResponse:
+        if self.quota is not None:
+            self.quota.admit()
+        return super().generate_content(contents, generation_config, safety_settings)
+
+
+class FakeCachingService:
+    """
+    Local stand-in for Vertex AI context caching that counts prefix tokens.
+
+    Plugged into a ContextCacheManager, it shows whether a shared prefix is uploaded once and
+    then referenced: `prefix_tokens` counts tokens stored when caches are created, and models
+    bound to a cache report those tokens as cached on every call.
+
+    Attributes:
+        model_factory (Callable): Builds the models bound to caches.
+        fail (bool): Refuse every cache, like a model without caching support.
+        caches (Dict[str, int]): Live cache name -> prefix tokens.
+        prefix_tokens (int): Tokens uploaded into caches.
+        created (int): Caches created.
+        refreshed (int): TTL extensions.
+        deleted (int): Caches deleted.
+    """
+
+    def __init__(self, model_factory: Callable[..., Any] = FakeGenerativeModel, fail: bool = False):
+        self.model_factory = model_factory
+        self.fail = fail
+        self.caches: Dict[str, int] = {}
+        self.prefix_tokens = 0
+        self.created = 0
+        self.refreshed = 0
+        self.deleted = 0
+        self._lock = threading.Lock()
+
+    def create(self, model_name: str, system_instruction: Optional[List[str]], parts: List[Any], ttl: float) -> str:
+        if self.fail:
+            raise RuntimeError(f"400 Context caching is not supported for {model_name}")
+        tokens = estimate_tokens(parts, system_instruction)
+        with self._lock:
+            self.created += 1
+            self.prefix_tokens += tokens
+            name = f'cachedContents/fake-{self.created}'
+            self.caches[name] = tokens
+        return name
+
+    def update_ttl(self, name: str, ttl: float) -> None:
+        with self._lock:
+            if name not in self.caches:
+                raise KeyError(name)
+            self.refreshed += 1
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            del self.caches[name]
+            self.deleted += 1
+
+    def model(self, name: str, model_name: str) -> Any:
+        model = self.model_factory(model_name)
+        model.cached_tokens = self.caches[name]
+        return model
+
+
+class FakeVertexBackend(VertexBackend):
+    """
+    VertexBackend that hands prompt parts and settings to its models unconverted, so it runs
+    with fake models and caching services without the Vertex AI SDK installed.
+    """
+
+    def to_parts(self, contents: List[Any]) -> List[Any]:
+        return list(contents)
+
+    def call_options(self, request: ModelRequest) -> Dict[str, Any]:
+        return {'generation_config': {'response_schema': request.response_schema, **request.generation_config}}
+
+    def warm(self, model_name: str, system_instructions: List[List[str]]) -> None:
+        for system_instruction in system_instructions:
+            self.model(model_name, system_instruction)
@@ -1,89 +1,226 @@
+from src.generate.taxonomy import NON_RENEWABLE_CODES, RENEWABLE_CODES, normalize_code
+from src.generate.jsonl import jsonl_doc_id
+from src.generate.jsonl import iter_jsonl
+from src.generate.jsonl import is_jsonl
 from src.config.logging import logger
-from typing import Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+import argparse
+import time
 import json
+import sys
+import os
+
+
+GEN_DIR = './data/generated'
+INGREDIENTS_FILE = './data/output/ingredients.txt'
+
+# Low-cardinality text fields; interning makes every record share one string per distinct value.
+_INTERNED_FIELDS = ('unit', 'scope', 'flag', 'consumption_type')
+
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
 
 class EnergyConsumption:
     """
     Represents energy consumption data.
-    
+
+    Records use `__slots__`, so they carry no per-instance dict; codes are normalized
+    strings and repeated text fields are interned.
+
     Attributes:
-        code (int): Unique code for the energy item.
+        code (str): Normalized code of the energy item (see taxonomy.normalize_code).
         item (str): Description of the energy item.
         value (float): Quantity of energy consumed.
         unit (str): Unit of measurement for the energy value.
         page_number (int): Page number in the document where the data is found.
         snippet (str): Text snippet containing the energy data.
+        year (int): Reporting year, when extracted.
+        scope (str): Global, Regional or Country-Specific, when extracted.
+        flag (str): Full or Partial, when extracted.
+        consumption_type (str): Operational or Supply Chain Consumption, when extracted.
     """
-    
-    def __init__(self, code: int, item: str, value: float, unit: str, page_number: int, snippet: str):
-        self.code = code
+
+    __slots__ = ('code', 'item', 'value', 'unit', 'page_number', 'snippet', 'year', 'scope', 'flag', 'consumption_type')
+    energy_type = None
+
+    def __init__(self, code: Any, item: str, value: float, unit: str, page_number: int, snippet: str,
+                 year: Optional[int] = None, scope: Optional[str] = None, flag: Optional[str] = None,
+                 consumption_type: Optional[str] = None):
+        self.code = normalize_code(code)
         self.item = item
         self.value = value
-        self.unit = unit
+        self.unit = _intern(unit)
         self.page_number = page_number
         self.snippet = snippet
+        self.year = year
+        self.scope = _intern(scope)
+        self.flag = _intern(flag)
+        self.consumption_type = _intern(consumption_type)
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], snippets: bool = True) -> 'EnergyConsumption':
+        """
+        Build a record from an extracted JSON object, ignoring fields the model added beyond
+        the ones above (e.g. `flag_reasoning`). `snippets=False` drops the snippet text, which
+        is most of a record's memory.
+        """
+        return cls(record.get('code'), record.get('item'), record.get('value'), record.get('unit'),
+                   record.get('page_number'), record.get('snippet') if snippets else None, record.get('year'),
+                   record.get('scope'), record.get('flag'), record.get('consumption_type'))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def display_details(self) -> str:
+        return f"{self.item} ({self.energy_type}) - {self.value} {self.unit}"
+
 
 class RenewableEnergy(EnergyConsumption):
     """
     Subclass for renewable energy consumption data.
     """
-    
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.energy_type = "Renewable"
 
-    def display_details(self) -> str:
-        return f"{self.item} ({self.energy_type}) - {self.value} {self.unit}"
+    __slots__ = ()
+    energy_type = "Renewable"
+
 
 class NonRenewableEnergy(EnergyConsumption):
     """
     Subclass for non-renewable energy consumption data.
     """
-    
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.energy_type = "Non-Renewable"
 
-    def display_details(self) -> str:
-        return f"{self.item} ({self.energy_type}) - {self.value} {self.unit}"
+    __slots__ = ()
+    energy_type = "Non-Renewable"
+
+
+# Normalized code -> record class; totals, shares and unknown codes use the base class.
+CODE_CLASSES = {
+    **{code: RenewableEnergy for code in RENEWABLE_CODES},
+    **{code: NonRenewableEnergy for code in NON_RENEWABLE_CODES},
+}
+
+
+def to_energy_record(record: Dict[str, Any], snippets: bool = True) -> EnergyConsumption:
+    """
+    Build the record class matching the record's code with one dict lookup.
+    """
+    return CODE_CLASSES.get(normalize_code(record.get('code')), EnergyConsumption).from_record(record, snippets)
+
+
+def _placeholder(cls: type, code: Any, item: str) -> EnergyConsumption:
+    # A fresh record per item: records are mutable, so placeholders must not be shared.
+    return cls(code=code, item=item, value=0, unit='units', page_number=0, snippet='No specific data')
+
 
 class EnergyData:
     """
     Organizes and manages energy data by year with associated metadata.
-    
+
+    `metrics` is either the extracted flat list of records, which is split by code, or a
+    dict of `renewable_energy_consumption` / `non_renewable_energy_consumption` lists, where
+    records with a code outside their category are replaced by a generic placeholder.
+
     Attributes:
         year (int): Year of the energy data.
         metadata (Dict[str, str]): Additional information about the energy data.
         renewable_energy (List[RenewableEnergy]): List of renewable energy instances.
         non_renewable_energy (List[NonRenewableEnergy]): List of non-renewable energy instances.
+        other_energy (List[EnergyConsumption]): Totals, shares and other codes from a flat list.
     """
-    
-    def __init__(self, year: int, metrics: Dict[str, List[Dict]], metadata: Dict[str, str]):
+
+    def __init__(self, year: int, metrics: Union[List[Dict], Dict[str, List[Dict]]], metadata: Dict[str, str]):
         self.year = year
         self.metadata = metadata
-        renewable_codes = [772, 773, 774, 775, 776, 777, 778, 779, 780, 781, 848, 849]
-        non_renewable_codes = [785, 786, 787, 789, 783]
+        self.renewable_energy: List[RenewableEnergy] = []
+        self.non_renewable_energy: List[NonRenewableEnergy] = []
+        self.other_energy: List[EnergyConsumption] = []
 
-        self.renewable_energy = [
-            RenewableEnergy(**item) if item['code'] in renewable_codes else RenewableEnergy(code=item['code'], item='Generic Renewable', value=0, unit='units', page_number=0, snippet='No specific data')
-            for item in metrics['renewable_energy_consumption']
-        ]
+        if isinstance(metrics, dict):
+            self.renewable_energy = [
+                RenewableEnergy.from_record(item) if normalize_code(item['code']) in RENEWABLE_CODES
+                else _placeholder(RenewableEnergy, normalize_code(item['code']), 'Generic Renewable')
+                for item in metrics['renewable_energy_consumption']
+            ]
+            self.non_renewable_energy = [
+                NonRenewableEnergy.from_record(item) if normalize_code(item['code']) in NON_RENEWABLE_CODES
+                else _placeholder(NonRenewableEnergy, normalize_code(item['code']), 'Generic Non-Renewable')
+                for item in metrics['non_renewable_energy_consumption']
+            ]
+        else:
+            for item in metrics:
+                self.add(to_energy_record(item))
 
-        self.non_renewable_energy = [
-            NonRenewableEnergy(**item) if item['code'] in non_renewable_codes else NonRenewableEnergy(code=item['code'], item='Generic Non-Renewable', value=0, unit='units', page_number=0, snippet='No specific data')
-            for item in metrics['non_renewable_energy_consumption']
-        ]
+    def add(self, record: EnergyConsumption) -> None:
+        if isinstance(record, RenewableEnergy):
+            self.renewable_energy.append(record)
+        elif isinstance(record, NonRenewableEnergy):
+            self.non_renewable_energy.append(record)
+        else:
+            self.other_energy.append(record)
 
-def load_energy_data():
+
+def load_energy_data(file_path: str = INGREDIENTS_FILE) -> Optional[EnergyData]:
     """
-    Loads energy data from a JSON file, handling file not found and decode errors.
+    Loads energy data from a JSON file, returning None when it is missing or not valid JSON.
     """
     try:
-        with open('./data/output/ingredients.txt', 'r') as f:
+        with open(file_path, 'r') as f:
             data = json.load(f)
-            logger.info("Data successfully loaded.")
-            print(data)
     except FileNotFoundError:
-        logger.error("Failed to find the specified file.")
-    except json.JSONDecodeNameError:
-        logger.error("Failed to decode JSON from the file.")
+        logger.error("Failed to find %s", file_path)
+        return None
+    except json.JSONDecodeError as e:
+        logger.error("Failed to decode JSON from %s: %s", file_path, e)
+        return None
+    logger.info("Data successfully loaded from %s", file_path)
+    return EnergyData(data.get('year'), data.get('metrics', []), data.get('metadata', {}))
+
+
+def iter_energy_records(file_path: str, snippets: bool = True) -> Iterator[EnergyConsumption]:
+    """
+    Stream the records of one (possibly compressed) JSONL file as compact record objects.
+    """
+    for record in iter_jsonl(file_path):
+        yield to_energy_record(record, snippets)
+
+
+def load_corpus(gen_dir: str = GEN_DIR, snippets: bool = True,
+                doc_ids: Optional[Iterable[str]] = None) -> Dict[str, List[EnergyConsumption]]:
+    """
+    Load every `<doc_id>.jsonl` in a directory into compact records, keyed by document ID.
+
+    Files are streamed one line at a time, so peak memory is the records themselves rather
+    than the parsed JSON.
+    """
+    wanted = set(doc_ids) if doc_ids is not None else None
+    corpus = {}
+    for filename in sorted(os.listdir(gen_dir)):
+        if not is_jsonl(filename):
+            continue
+        doc_id = jsonl_doc_id(filename)
+        if wanted is None or doc_id in wanted:
+            corpus[doc_id] = list(iter_energy_records(os.path.join(gen_dir, filename), snippets))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load extracted metrics into compact energy records.")
+    parser.add_argument('gen_dir', nargs='?', default=GEN_DIR)
+    parser.add_argument('--no-snippets', action='store_true', help="Drop snippet text to save memory")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    corpus = load_corpus(args.gen_dir, snippets=not args.no_snippets)
+    elapsed = time.perf_counter() - start
+    counts = {'Renewable': 0, 'Non-Renewable': 0, None: 0}
+    for records in corpus.values():
+        for record in records:
+            counts[record.energy_type] += 1
+    logger.info("Loaded %s records from %s documents in %.3fs (renewable %s, non-renewable %s, other %s)",
+                sum(counts.values()), len(corpus), elapsed, counts['Renewable'], counts['Non-Renewable'], counts[None])
+
+
+if __name__ == '__main__':
+    main()
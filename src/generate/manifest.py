@@ -0,0 +1,171 @@
+from src.config.logging import logger
+from typing import Any, Dict, Optional
+import threading
+import hashlib
+import json
+import time
+import os
+
+
+def hash_json(data: Any) -> str:
+    """
+    Stable SHA-256 of a JSON-serializable object.
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    SHA-256 of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def combine_hashes(*hashes: str) -> str:
+    return hashlib.sha256('\x1e'.join(hashes).encode('utf-8')).hexdigest()
+
+
+class RunManifest:
+    """
+    Checkpoint journal recording per-document and per-step status for batch runs.
+
+    Every status change is appended as one JSON line, so a crash never loses more than the
+    step in flight and appends stay cheap for large corpora. On load the journal is replayed
+    into the latest state per document and compacted.
+
+    A document entry looks like:
+        {"source": {"size": ..., "mtime_ns": ..., "sha256": ...},
+         "status": "done", "output": {"path": ..., "size": ..., "mtime_ns": ...},
+         "prompts": {"step_1": <prompt version>, ...},
+         "steps": {"step_1": {"status": "done", "input_hash": ..., "output_hash": ...}}}
+
+    Attributes:
+        path (str): Location of the JSONL journal.
+        documents (Dict[str, Dict[str, Any]]): Latest state per document ID.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash; everything before it is still valid.
+                    logger.warning("Skipping corrupt manifest line in %s", self.path)
+                    continue
+                self.documents[event['doc_id']] = event['state']
+        self._compact()
+        logger.info("Loaded run manifest with %s documents from %s", len(self.documents), self.path)
+
+    def _compact(self) -> None:
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            for doc_id, state in self.documents.items():
+                file.write(json.dumps({'doc_id': doc_id, 'state': state}) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def _record(self, doc_id: str) -> None:
+        # Caller holds the lock.
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as file:
+            file.write(json.dumps({'doc_id': doc_id, 'state': self.documents[doc_id]}) + '\n')
+
+    def fingerprint(self, doc_id: str, pdf_path: str) -> str:
+        """
+        Return the SHA-256 of a source PDF, re-reading it only if its size or mtime changed.
+        """
+        stat = os.stat(pdf_path)
+        with self._lock:
+            source = self.documents.get(doc_id, {}).get('source', {})
+        if source.get('size') == stat.st_size and source.get('mtime_ns') == stat.st_mtime_ns:
+            return source['sha256']
+        return hash_file(pdf_path)
+
+    def is_up_to_date(self, doc_id: str, source_hash: str, output_file: str,
+                      prompts: Optional[Dict[str, str]] = None) -> bool:
+        """
+        True if the document finished for this exact input, with these prompt versions (name ->
+        version, when given), and its output file is unchanged.
+        """
+        with self._lock:
+            state = self.documents.get(doc_id)
+        if not state or state.get('status') != 'done' or state['source'].get('sha256') != source_hash:
+            return False
+        if prompts is not None and state.get('prompts') != prompts:
+            return False
+        output = state.get('output', {})
+        if output.get('path') != output_file or not os.path.exists(output_file):
+            return False
+        stat = os.stat(output_file)
+        return output.get('size') == stat.st_size and output.get('mtime_ns') == stat.st_mtime_ns
+
+    def start_document(self, doc_id: str, pdf_path: str, source_hash: str) -> None:
+        """
+        Mark a document as running; completed steps are kept only if the input is unchanged.
+        """
+        stat = os.stat(pdf_path)
+        with self._lock:
+            state = self.documents.get(doc_id, {})
+            steps = state.get('steps', {}) if state.get('source', {}).get('sha256') == source_hash else {}
+            self.documents[doc_id] = {
+                'source': {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': source_hash},
+                'status': 'running',
+                'steps': steps,
+                'updated_at': time.time(),
+            }
+            self._record(doc_id)
+
+    def completed_step(self, doc_id: str, step_name: str, input_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the step entry if that step already completed for the same input hash.
+        """
+        with self._lock:
+            step = self.documents.get(doc_id, {}).get('steps', {}).get(step_name)
+        if step and step.get('status') == 'done' and step.get('input_hash') == input_hash:
+            return step
+        return None
+
+    def mark_step(self, doc_id: str, step_name: str, status: str, input_hash: str,
+                  output_hash: Optional[str] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            state = self.documents[doc_id]
+            state['steps'][step_name] = {'status': status, 'input_hash': input_hash,
+                                         'output_hash': output_hash, 'error': error}
+            state['updated_at'] = time.time()
+            self._record(doc_id)
+
+    def mark_document(self, doc_id: str, status: str, output_file: Optional[str] = None, error: Optional[str] = None,
+                      prompts: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            state = self.documents[doc_id]
+            state['status'] = status
+            state['error'] = error
+            if prompts is not None:
+                state['prompts'] = prompts
+            if output_file is not None:
+                stat = os.stat(output_file)
+                state['output'] = {'path': output_file, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            state['updated_at'] = time.time()
+            self._record(doc_id)
+
+    def mark_alias(self, doc_id: str, pdf_path: str, canonical: str, output_file: str) -> None:
+        """
+        Mark a duplicate done with a copy of its canonical document's output, under the prompt
+        versions the canonical was extracted with, so later runs skip it like any finished document.
+        """
+        self.start_document(doc_id, pdf_path, self.fingerprint(doc_id, pdf_path))
+        with self._lock:
+            prompts = self.documents.get(canonical, {}).get('prompts')
+        self.mark_document(doc_id, 'done', output_file=output_file, prompts=prompts)
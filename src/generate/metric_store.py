@@ -0,0 +1,290 @@
+from src.generate.taxonomy import normalize_code
+from src.generate.jsonl import jsonl_doc_id
+from src.generate.jsonl import iter_jsonl
+from src.generate.jsonl import is_jsonl
+from src.config.logging import logger
+from src.config.setup import config
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional
+import threading
+import argparse
+import shutil
+import uuid
+import json
+import math
+import time
+import os
+
+if TYPE_CHECKING:
+    from src.generate.aggregate import MetricTable
+
+
+STORE_DIR = './data/store'
+
+def _schema():
+    # `year` and `code` are the partition columns; rows missing either go to __HIVE_DEFAULT_PARTITION__.
+    import pyarrow as pa
+    return pa.schema([
+        ('doc_id', pa.string()), ('row', pa.int32()), ('item', pa.string()),
+        ('value', pa.float64()), ('raw_value', pa.string()), ('unit', pa.string()), ('page_number', pa.int32()),
+        ('scope', pa.string()), ('flag', pa.string()), ('consumption_type', pa.string()), ('snippet', pa.string()),
+        ('written_at', pa.int64()), ('year', pa.int32()), ('code', pa.string()),
+    ])
+
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([('year', pa.int32()), ('code', pa.string())]), flavor='hive')
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None or value == '' or value == 'null':
+        return None
+    return str(value)
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        number = float(str(value).replace(',', '')) if isinstance(value, str) else float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def _integer(value: Any) -> Optional[int]:
+    number = _number(value)
+    if number is None or not -2 ** 31 <= number < 2 ** 31:
+        return None
+    return int(number)
+
+
+def to_row(doc_id: str, index: int, record: Dict[str, Any], written_at: int) -> Dict[str, Any]:
+    """
+    Flatten one extracted record into a store row.
+    """
+    return {
+        'doc_id': doc_id, 'row': index, 'item': _text(record.get('item')),
+        'value': _number(record.get('value')), 'raw_value': _text(record.get('value')),
+        'unit': _text(record.get('unit')), 'page_number': _integer(record.get('page_number')),
+        'scope': _text(record.get('scope')), 'flag': _text(record.get('flag')),
+        'consumption_type': _text(record.get('consumption_type')), 'snippet': _text(record.get('snippet')),
+        'written_at': written_at, 'year': _integer(record.get('year')), 'code': normalize_code(record.get('code')),
+    }
+
+
+class MetricStore:
+    """
+    Append-only Parquet store of extracted metrics for the whole corpus.
+
+    Rows are kept under `<root_dir>/year=<year>/code=<code>/part-*.parquet`, so filters on
+    year and code only open the matching files, and reads are memory-mapped. Appends are
+    buffered and written as new part files every `flush_rows` rows (and on `flush()`);
+    existing files are never rewritten except by `compact()`. Re-processing a document
+    appends a newer version of its rows, and queries return only the newest one.
+
+    Attributes:
+        root_dir (str): Dataset directory.
+        flush_rows (int): Buffered rows that trigger a write.
+    """
+
+    def __init__(self, root_dir: str, flush_rows: int = 50_000):
+        self.root_dir = root_dir
+        self.flush_rows = flush_rows
+        self._rows: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def append(self, doc_id: str, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Buffer the records of one document as its newest version and return how many were added.
+        """
+        written_at = time.time_ns()
+        rows = [to_row(doc_id, index, record, written_at) for index, record in enumerate(records)]
+        if not rows:
+            # An empty extraction still supersedes earlier rows of the document.
+            rows = [to_row(doc_id, -1, {}, written_at)]
+        with self._lock:
+            self._rows.extend(rows)
+            pending = len(self._rows) >= self.flush_rows
+        if pending:
+            self.flush()
+        return len(rows)
+
+    def flush(self) -> int:
+        """
+        Write buffered rows as new part files and return how many were written.
+        """
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        with self._lock:
+            rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            table = pa.Table.from_pylist(rows, schema=_schema())
+            ds.write_dataset(table, self.root_dir, format='parquet', partitioning=_partitioning(),
+                             basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+                             existing_data_behavior='overwrite_or_ignore')
+        logger.info("Wrote %s rows to the metric store at %s", len(rows), self.root_dir)
+        return len(rows)
+
+    def _read(self, columns: Optional[List[str]] = None, filters: Optional[List[Any]] = None):
+        import pyarrow.parquet as pq
+        return pq.read_table(self.root_dir, columns=columns, filters=filters or None,
+                             partitioning=_partitioning(), schema=_schema(), memory_map=True)
+
+    def query(self, codes: Optional[Iterable[Any]] = None, years: Optional[Iterable[int]] = None,
+              scopes: Optional[Iterable[str]] = None, doc_ids: Optional[Iterable[str]] = None,
+              columns: Optional[List[str]] = None):
+        """
+        Return the newest rows matching every given filter as a pyarrow Table, ordered by
+        document and original record order.
+
+        Year and code filters prune partitions; the others are pushed down to the row groups.
+        """
+        import pyarrow.compute as pc
+        if not os.path.isdir(self.root_dir):
+            return _schema().empty_table()
+
+        filters = []
+        if codes is not None:
+            filters.append(('code', 'in', [normalize_code(code) for code in codes]))
+        if years is not None:
+            filters.append(('year', 'in', [int(year) for year in years]))
+        doc_ids = None if doc_ids is None else list(doc_ids)
+        for name, values in (('scope', scopes), ('doc_id', doc_ids)):
+            if values is not None:
+                filters.append((name, 'in', list(values)))
+
+        # Versions are resolved over the whole store, not the filtered rows, so a filter can
+        # never resurrect rows an unfiltered query would hide.
+        versions = self._read(['doc_id', 'written_at'], [('doc_id', 'in', list(doc_ids))] if doc_ids is not None else None)
+        newest = versions.group_by('doc_id').aggregate([('written_at', 'max')])
+        table = self._read(None, filters)
+        table = table.join(newest, keys=['doc_id', 'written_at'], right_keys=['doc_id', 'written_at_max'], join_type='inner')
+        table = table.filter(pc.greater_equal(table['row'], 0))
+        table = table.sort_by([('doc_id', 'ascending'), ('row', 'ascending')])
+        if columns is not None:
+            table = table.select(columns)
+        return table
+
+    def records(self, **filters) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Newest records grouped by document, in the shape the pipelines write to JSONL.
+        """
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for row in self.query(**filters).to_pylist():
+            record = {key: row[key] for key in ('code', 'item', 'unit', 'page_number', 'year', 'scope', 'flag')}
+            record['value'] = row['value'] if row['value'] is not None else row['raw_value']
+            grouped.setdefault(row['doc_id'], []).append(record)
+        return grouped
+
+    def to_metric_table(self, **filters) -> 'MetricTable':
+        """
+        Load the newest matching rows as an aggregate.MetricTable without touching any JSONL.
+        """
+        import numpy as np
+        from src.generate.aggregate import MetricTable
+        table = self.query(columns=['doc_id', 'code', 'value', 'unit', 'year', 'scope'], **filters)
+        doc_ids, doc = np.unique(table['doc_id'].to_numpy(zero_copy_only=False).astype(str), return_inverse=True)
+
+        def strings(name: str) -> np.ndarray:
+            return np.array(table[name].fill_null('').to_pylist(), dtype=str)
+
+        return MetricTable(list(doc_ids), doc.astype(np.int32), strings('code'),
+                           table['value'].to_numpy(zero_copy_only=False).astype(np.float64),
+                           strings('unit'), table['year'].to_numpy(zero_copy_only=False).astype(np.float64),
+                           strings('scope'))
+
+    def compact(self) -> int:
+        """
+        Rewrite the store keeping only the newest rows, one file per partition, and return the row count.
+        """
+        import pyarrow.dataset as ds
+        self.flush()
+        table = self._read()
+        newest = table.select(['doc_id', 'written_at']).group_by('doc_id').aggregate([('written_at', 'max')])
+        table = table.join(newest, keys=['doc_id', 'written_at'], right_keys=['doc_id', 'written_at_max'], join_type='inner')
+        tmp_dir = f'{self.root_dir}.{os.getpid()}.compact'
+        ds.write_dataset(table.select(_schema().names), tmp_dir, format='parquet', partitioning=_partitioning(),
+                         basename_template='part-compacted-{i}.parquet')
+        old_dir = f'{self.root_dir}.{os.getpid()}.old'
+        os.replace(self.root_dir, old_dir)
+        os.replace(tmp_dir, self.root_dir)
+        shutil.rmtree(old_dir)
+        logger.info("Compacted the metric store to %s rows", table.num_rows)
+        return table.num_rows
+
+    def ingest_directory(self, directory: str) -> int:
+        """
+        Append every `<doc_id>.jsonl` (optionally compressed) in a directory and return the row count.
+        """
+        total = 0
+        for filename in sorted(os.listdir(directory)):
+            if is_jsonl(filename):
+                total += self.append(jsonl_doc_id(filename), iter_jsonl(os.path.join(directory, filename)))
+        self.flush()
+        return total
+
+
+_stores: Dict[str, MetricStore] = {}
+_stores_lock = threading.Lock()
+
+
+def store_dir(source_dir: str, root_dir: Optional[str] = None) -> str:
+    """
+    Store directory holding the outputs of one source directory, e.g. `data/generated` ->
+    `<metric_store_dir>/generated`, so pipelines never mix their results.
+    """
+    return os.path.join(root_dir or config.METRIC_STORE_DIR, os.path.basename(os.path.normpath(source_dir)))
+
+
+def get_metric_store(source_dir: str) -> Optional[MetricStore]:
+    """
+    Process-wide store for a pipeline output directory, or None when `metric_store` is disabled.
+    """
+    if not config.METRIC_STORE:
+        return None
+    path = store_dir(source_dir)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = MetricStore(path)
+        return _stores[path]
+
+
+def flush_metric_stores() -> None:
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        store.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the Parquet metric store.")
+    parser.add_argument('--store', default=STORE_DIR, help="Root directory of the stores")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest', help="Append a directory of <doc_id>.jsonl files to its store")
+    ingest.add_argument('directory', help="e.g. data/generated or data/expected")
+    query = commands.add_parser('query', help="Print matching rows as JSON lines")
+    query.add_argument('source', help="Store name, e.g. generated, generated_all_in_one or expected")
+    query.add_argument('--code', action='append', help="Metric code (repeatable)")
+    query.add_argument('--year', action='append', type=int, help="Reporting year (repeatable)")
+    query.add_argument('--scope', action='append', help="Scope (repeatable)")
+    query.add_argument('--doc', action='append', help="Document ID (repeatable)")
+    compact = commands.add_parser('compact', help="Rewrite a store keeping only the newest rows")
+    compact.add_argument('source', help="Store name")
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        store = MetricStore(store_dir(args.directory, args.store))
+        logger.info("Ingested %s rows from %s into %s", store.ingest_directory(args.directory), args.directory, store.root_dir)
+        return
+    store = MetricStore(store_dir(args.source, args.store))
+    if args.command == 'compact':
+        store.compact()
+    else:
+        table = store.query(codes=args.code, years=args.year, scopes=args.scope, doc_ids=args.doc)
+        for row in table.to_pylist():
+            print(json.dumps(row))
+
+
+if __name__ == '__main__':
+    main()
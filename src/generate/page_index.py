@@ -0,0 +1,162 @@
+from src.generate.manifest import hash_file
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Dict, List, Optional
+import threading
+import hashlib
+import json
+import re
+import io
+import os
+
+
+DEFAULT_INSTRUCTIONS = './data/templates/system_instructions_step_1.txt'
+
+# Weight of a hit per term kind: a unit next to a number is the strongest signal.
+UNIT_WEIGHT = 2.0
+QUANTITY_WEIGHT = 3.0
+NAME_WEIGHT = 1.0
+CODE_WEIGHT = 1.0
+
+
+def load_terms(instructions_path: str) -> Dict[str, Dict[str, float]]:
+    """
+    Derive scoring terms from a step system-instruction template.
+
+    Units come from the "Units of Measurement" bullets (e.g. `**Energy Units**: GWh, MWh`);
+    names and codes come from the metric bullets (e.g. `**Natural Gas** (Code: 787, ...)`).
+    """
+    with open(instructions_path, 'r') as file:
+        text = file.read()
+
+    units, names, codes = set(), set(), set()
+    for match in re.finditer(r'^- \*\*([^*]+)\*\*:?\s*(.*)$', text, flags=re.MULTILINE):
+        label, rest = match.group(1), match.group(2)
+        if label.endswith('Units'):
+            units.update(unit.strip() for unit in rest.split(',') if unit.strip())
+            continue
+        # "Bioenergy: Biofuels (Biodiesel, Ethanol)" -> bioenergy, biofuels, biodiesel, ethanol
+        for name in re.split(r'[:,()/]', label):
+            name = name.strip().lower()
+            if len(name) > 2:
+                names.add(name)
+        code = re.search(r'Code:\s*([A-Za-z0-9]+)', rest)
+        if code:
+            codes.add(code.group(1))
+    return {'units': {unit: UNIT_WEIGHT for unit in units},
+            'names': {name: NAME_WEIGHT for name in names},
+            'codes': {code: CODE_WEIGHT for code in codes}}
+
+
+class PageScorer:
+    """
+    Scores page texts against the metric vocabulary with a few precompiled regexes.
+
+    Attributes:
+        terms (Dict[str, Dict[str, float]]): Units, names and codes with their weights.
+        version (str): Hash of the terms, stored with cached indexes to detect template changes.
+    """
+
+    def __init__(self, terms: Dict[str, Dict[str, float]]):
+        self.terms = terms
+        self.version = hashlib.sha256(json.dumps(terms, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        units = sorted(terms['units'], key=len, reverse=True)
+        unit_pattern = '|'.join(re.escape(unit) for unit in units) or r'(?!)'
+        self._units = re.compile(rf'\b(?:{unit_pattern})\b', flags=re.IGNORECASE)
+        self._quantities = re.compile(rf'\d[\d,.\s]*\s?(?:{unit_pattern})\b', flags=re.IGNORECASE)
+        names = sorted(terms['names'], key=len, reverse=True)
+        self._names = re.compile(r'\b(?:' + ('|'.join(re.escape(name) for name in names) or r'(?!)') + r')\b', flags=re.IGNORECASE)
+        codes = sorted(terms['codes'], key=len, reverse=True)
+        self._codes = re.compile(r'\b(?:' + ('|'.join(re.escape(code) for code in codes) or r'(?!)') + r')\b')
+
+    def score(self, text: str) -> float:
+        return (UNIT_WEIGHT * len(self._units.findall(text))
+                + QUANTITY_WEIGHT * len(self._quantities.findall(text))
+                + NAME_WEIGHT * len(self._names.findall(text))
+                + CODE_WEIGHT * len(self._codes.findall(text)))
+
+
+def extract_page_texts(pdf_bytes: bytes) -> List[str]:
+    """
+    Extract plain text for every page; pages that fail to parse yield an empty string.
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    texts = []
+    for number, page in enumerate(reader.pages, start=1):
+        try:
+            texts.append(page.extract_text() or '')
+        except Exception as e:
+            logger.warning("Could not extract text from page %s: %s", number, e)
+            texts.append('')
+    return texts
+
+
+def select_pages(scores: List[float], top_k: int, neighbours: int = 1) -> List[int]:
+    """
+    Return the 1-based pages of the `top_k` best-scoring pages plus neighbours, in page order.
+    """
+    ranked = sorted((page for page in range(len(scores)) if scores[page] > 0), key=lambda page: (-scores[page], page))
+    pages = set()
+    for page in ranked[:top_k]:
+        pages.update(range(max(0, page - neighbours), min(len(scores) - 1, page + neighbours) + 1))
+    return [page + 1 for page in sorted(pages)]
+
+
+class PageIndex:
+    """
+    Cached per-document page relevance index.
+
+    Indexes are stored in `<cache_dir>/<pdf sha256>.json` together with the scorer version,
+    so re-runs (and duplicate files) skip PDF parsing entirely.
+
+    Attributes:
+        cache_dir (str): Directory holding cached indexes.
+        scorer (PageScorer): Scorer used for pages that are not cached yet.
+    """
+
+    def __init__(self, cache_dir: str, instructions_path: str):
+        self.cache_dir = cache_dir
+        self.scorer = PageScorer(load_terms(instructions_path))
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def scores(self, pdf_path: str, pdf_bytes: Optional[bytes] = None) -> List[float]:
+        """
+        Return per-page scores for a PDF, computing and caching them on first use.
+        """
+        digest = hash_file(pdf_path)
+        cache_path = os.path.join(self.cache_dir, f'{digest}.json')
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r') as file:
+                entry = json.load(file)
+            if entry.get('version') == self.scorer.version:
+                return entry['scores']
+
+        if pdf_bytes is None:
+            with open(pdf_path, 'rb') as file:
+                pdf_bytes = file.read()
+        scores = [self.scorer.score(text) for text in extract_page_texts(pdf_bytes)]
+        logger.info("Indexed %s pages of %s", len(scores), pdf_path)
+        tmp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'version': self.scorer.version, 'scores': scores}, file)
+        os.replace(tmp_path, cache_path)
+        return scores
+
+    def candidate_pages(self, pdf_path: str, top_k: int, neighbours: int = 1, pdf_bytes: Optional[bytes] = None) -> List[int]:
+        return select_pages(self.scores(pdf_path, pdf_bytes), top_k, neighbours)
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def get_page_index() -> PageIndex:
+    """
+    Process-wide page index built from config.yml and the step 1 template.
+    """
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = PageIndex(config.PAGE_INDEX_DIR, DEFAULT_INSTRUCTIONS)
+        return _default_index
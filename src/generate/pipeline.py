@@ -1,128 +1,328 @@
-from vertexai.generative_models import HarmBlockThreshold
-from vertexai.generative_models import GenerationConfig
-from vertexai.generative_models import GenerativeModel
-from vertexai.generative_models import HarmCategory
-from vertexai.generative_models import Part
+from src.generate.backends import ModelBackend
+from src.generate.backends import ModelRequest
+from src.generate.backends import get_backend
+from src.generate.backends import BlobPart
+from src.generate.backends import UriPart
+from src.generate.engine import process_documents
+from src.generate.engine import DocumentResult
+from src.generate.artifacts import ArtifactStore
+from src.generate.cache import response_cache_from_args
+from src.generate.cache import add_cache_arguments
+from src.generate.cache import ResponseCache
+from src.generate.scheduler import RequestScheduler
+from src.generate.scheduler import estimate_tokens
+from src.generate.scheduler import get_scheduler
+from src.generate.staging import pages_for_metrics
+from src.generate.staging import count_pages
+from src.generate.staging import get_stager
+from src.generate.staging import slice_pdf
+from src.generate.page_index import get_page_index
+from src.generate.page_index import select_pages
+from src.generate.manifest import combine_hashes
+from src.generate.manifest import RunManifest
+from src.generate.manifest import hash_json
+from src.generate.telemetry import current_document
+from src.generate.telemetry import get_telemetry
+from src.generate.telemetry import model_cost
+from src.generate.templates import get_prompt
+from src.generate.validation import SchemaValidator
+from src.generate.jsonl import jsonl_path
+from src.generate.jsonl import write_jsonl
+from src.generate.metric_store import flush_metric_stores
+from src.generate.metric_store import get_metric_store
+from src.generate.dedup import group_documents
+from src.generate.dedup import fan_out
 from src.config.logging import logger
 from src.config.setup import config
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterable, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import argparse
 import json
+import re
 import os
 
 
 DATA_DIR = './data'
+PDF_DIR = os.path.join(DATA_DIR, 'pdfs')
 OUTPUT_DIR = os.path.join(DATA_DIR, 'output')
 GEN_DIR = os.path.join(DATA_DIR, 'generated')
 
+# Prompts a finished document depends on; editing any of them makes it out of date.
+PROMPTS = ('step_1', 'step_2', 'step_3')
 
-def load_file(file_path: str) -> str:
+_WHITESPACE = re.compile(r'\s*')
+
+# Step 1 is shared with batch prediction (see src/generate/batch.py).
+STEP_1_USER_PROMPT = "Identify all energy consumption metrics mentioned in the document. Return each metric with its code and item name."
+
+
+class InvalidRecordsError(ValueError):
     """
-    Load text content from a file.
+    Raised when too large a share of a step's records failed validation for its output to be
+    trusted; the failed records have already been quarantined.
+    """
+
+
+class TruncatedResponseError(ValueError):
+    """
+    Raised when the model stopped at `max_output_tokens`, so the structured output is incomplete.
+
+    Attributes:
+        text (str): The partial response, from which complete leading records can be salvaged.
     """
-    logger.info(f"Loading text file from {file_path}")
-    with open(file_path, 'r') as file:
-        return file.read()
+
+    def __init__(self, message: str, text: str = ''):
+        super().__init__(message)
+        self.text = text
 
 
 def load_binary_file(file_path: str) -> bytes:
     """
     Load binary content from a file.
     """
-    logger.info(f"Loading binary file from {file_path}")
+    logger.debug("Loading binary file from %s", file_path)
     with open(file_path, 'rb') as file:
         return file.read()
 
 
-def save_json(data: Any, file_path: str) -> None:
+def generate_response(backend: ModelBackend,
+                      system_instruction: List[str],
+                      contents: List[Any],
+                      response_schema: Dict[str, Any],
+                      cache: Optional[ResponseCache] = None,
+                      scheduler: Optional[RequestScheduler] = None,
+                      priority: int = 0,
+                      step: Optional[str] = None,
+                      cache_prefix: Optional[int] = None) -> Any:
     """
-    Save JSON data to a file.
+    Generate content using the model backend.
+
+    When a response cache is given, identical requests (same model, system instruction,
+    contents, schema and generation config) are answered from the cache. Every model call
+    goes through the request scheduler, which enforces quotas and retries throttled calls;
+    lower `priority` values are admitted first. `step` labels the request for backends and
+    measurements. `cache_prefix` marks the part of the request other requests share, for
+    backends with context caching (see ModelRequest).
     """
-    logger.info(f"Saving JSON data to {file_path}")
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=4)
-
-
-def create_generation_config() -> GenerationConfig:
+    scheduler = scheduler or get_scheduler()
+    telemetry = get_telemetry()
+    request = ModelRequest(backend.model_id(config.TEXT_GEN_MODEL_NAME), system_instruction, contents, response_schema,
+                           step=step, cache_prefix=cache_prefix)
+    labels = {'step': step, 'model': request.model_name}
+
+    with telemetry.span('model_call', **labels) as span:
+        def on_retry(error: Exception) -> None:
+            span.add('retries')
+            telemetry.count('retries', **labels)
+
+        def call_model() -> str:
+            logger.info("Generating response using the %s backend", backend.name)
+            span.set(cache='miss' if cache is not None else 'off', request_bytes=request.payload_bytes())
+            estimated_tokens = estimate_tokens(contents, system_instruction)
+            response = scheduler.call(lambda: backend.generate(request),
+                                      estimated_tokens=estimated_tokens,
+                                      priority=priority,
+                                      on_retry=on_retry)
+            scheduler.record_usage(estimated_tokens, response.total_tokens)
+            prompt_tokens = response.prompt_tokens if response.prompt_tokens is not None else estimated_tokens
+            completion_tokens = response.completion_tokens or 0
+            cached_tokens = response.cached_tokens or 0
+            span.set(finish_reason=response.finish_reason,
+                     prompt_tokens=prompt_tokens,
+                     completion_tokens=completion_tokens,
+                     cached_tokens=cached_tokens,
+                     response_bytes=len(response.text.encode('utf-8')),
+                     cost_usd=model_cost(prompt_tokens, completion_tokens, cached_tokens))
+            telemetry.count('prompt_tokens', prompt_tokens, **labels)
+            telemetry.count('completion_tokens', completion_tokens, **labels)
+            telemetry.count('cached_tokens', cached_tokens, **labels)
+            telemetry.count('cost_usd', span.attributes['cost_usd'], **labels)
+            if response.finish_reason == 'MAX_TOKENS':
+                raise TruncatedResponseError(f"{step or 'Response'} stopped at the output token limit", response.text)
+            if response.finish_reason != 'STOP':
+                logger.warning("Finish reason %s for %s", response.finish_reason, step)
+            logger.debug("Safety ratings: %s", response.safety_ratings)
+            text = response.text.strip()
+            # Fail before caching so malformed responses are never replayed.
+            json.loads(text)
+            return text
+
+        if cache is None:
+            text = call_model()
+        else:
+            text = cache.get_or_compute(request.key, call_model)
+            if 'cache' not in span.attributes:
+                span.set(cache='hit')
+                telemetry.count('cache_hits', **labels)
+    # The full response can run to hundreds of metrics; only pay for it at DEBUG.
+    logger.debug("Response generated: %s", text)
+    return json.loads(text)
+
+
+def salvage_array(text: str, start: int = 0) -> List[Any]:
     """
-    Create a GenerationConfig instance.
+    Return the complete leading elements of a JSON array cut off part-way, e.g. the records
+    before the one a truncated response stopped in. The array is the first one at or after
+    `start`.
     """
-    logger.info("Creating generation configuration")
-    return GenerationConfig(
-        temperature=0.0, 
-        top_p=0.0, 
-        top_k=1, 
-        candidate_count=1, 
-        max_output_tokens=8192,
-        response_mime_type="application/json"
-    )
-
-
-def create_safety_settings() -> Dict[HarmCategory, HarmBlockThreshold]:
+    decoder = json.JSONDecoder()
+    index = text.find('[', start)
+    if index < 0:
+        return []
+    items = []
+    index = _WHITESPACE.match(text, index + 1).end()
+    while index < len(text) and text[index] != ']':
+        try:
+            item, index = decoder.raw_decode(text, index)
+        except json.JSONDecodeError:
+            break
+        items.append(item)
+        index = _WHITESPACE.match(text, index).end()
+        if text[index:index + 1] != ',':
+            break
+        index = _WHITESPACE.match(text, index + 1).end()
+    return items
+
+
+def extract_complete(step: str, request: Callable[[List[Any]], Any], inputs: List[Any]) -> List[Any]:
     """
-    Create a safety settings dictionary.
+    Ask `request` for the records of `inputs`. If the response is truncated, keep its complete
+    leading records and ask again for the remaining inputs only; a chunk that truncates
+    before its first record is split in half.
     """
-    logger.info("Creating safety settings")
-    return {
-        HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE
-    }
-
-def generate_response(model: GenerativeModel, contents: List[Part], response_schema: Dict[str, Any]) -> Any:
+    telemetry = get_telemetry()
+    outputs: List[Any] = []
+    remaining = inputs
+    while True:
+        try:
+            result = request(remaining)
+        except TruncatedResponseError as e:
+            telemetry.count('truncated_responses', step=step)
+            salvaged = salvage_array(e.text)[:len(remaining)]
+            if salvaged:
+                logger.warning("%s: response truncated after %s of %s records, continuing with the rest",
+                               step, len(salvaged), len(remaining))
+                outputs.extend(salvaged)
+                remaining = remaining[len(salvaged):]
+                if remaining:
+                    continue
+                return outputs
+            if len(remaining) <= 1:
+                raise
+            half = len(remaining) // 2
+            logger.warning("%s: response truncated before its first record, splitting %s records", step, len(remaining))
+            return outputs + extract_complete(step, request, remaining[:half]) + extract_complete(step, request, remaining[half:])
+        if not isinstance(result, list):
+            raise ValueError(f"{step} returned {type(result).__name__}, expected a list of records")
+        return outputs + result
+
+
+def extract_chunked(step: str, request: Callable[[List[Any]], Any], inputs: List[Any],
+                    chunk_size: Optional[int] = None, max_workers: Optional[int] = None) -> List[Any]:
     """
-    Generate content using the generative model.
+    Run `request` over chunks of `chunk_size` inputs in parallel and concatenate the outputs
+    in input order, so the result is the same however the chunks finish.
     """
-    logger.info("Generating response using the generative model")
-    response = model.generate_content(contents, 
-                                      generation_config=GenerationConfig(
-                                          response_mime_type="application/json", 
-                                          response_schema=response_schema
-                                      ),
-                                      safety_settings=create_safety_settings())
-    output_json = json.loads(response.text.strip())
-    logger.info(f"Response generated: {output_json}")
-    logger.info(f"Finish reason: {response.candidates[0].finish_reason}")
-    logger.info(f"Safety ratings: {response.candidates[0].safety_ratings}")
-    return output_json
-
+    chunk_size = chunk_size or config.EXTRACTION_CHUNK_SIZE
+    chunks = [inputs[start:start + chunk_size] for start in range(0, len(inputs), chunk_size)]
+    if len(chunks) <= 1:
+        return extract_complete(step, request, inputs)
+    logger.info("%s: extracting %s records in %s chunks", step, len(inputs), len(chunks))
+    workers = min(max_workers or config.EXTRACTION_CHUNK_WORKERS, len(chunks))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{step}-chunk') as pool:
+        # Each chunk runs in a copy of this context, so its spans keep the document ID.
+        futures = [pool.submit(contextvars.copy_context().run, extract_complete, step, request, chunk) for chunk in chunks]
+        return [record for future in futures for record in future.result()]
+
+
+def quarantine(step: str, records: List[Tuple[int, Any, List[str]]]) -> str:
+    """
+    Write records that failed validation, with their errors, to
+    `<quarantine_dir>/<step>/<doc_id>.jsonl` and return the path.
+    """
+    doc_id = current_document.get() or 'unknown'
+    path = os.path.join(config.QUARANTINE_DIR, step, f'{doc_id}.jsonl')
+    write_jsonl(({'index': index, 'record': record, 'errors': errors} for index, record, errors in records), path)
+    return path
+
+
+def validate_records(step: str,
+                     validator: SchemaValidator,
+                     output: Any,
+                     inputs: Optional[List[Any]] = None,
+                     reask: Optional[Callable[[List[Any]], Any]] = None,
+                     max_invalid: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Normalize a step's records against its schema and drop the ones that stay invalid.
 
-def step_1(model: GenerativeModel, pdf_parts: Part, output_path: str):
+    When the output lines up one-to-one with `inputs`, the inputs of the failed records (and
+    only those) are sent again through `reask`; records still failing after that are
+    quarantined. Repairs, re-asks and quarantined records are counted in telemetry. With
+    `max_invalid`, InvalidRecordsError is raised when more than that fraction of the records
+    was quarantined.
+    """
+    if not isinstance(output, list):
+        raise ValueError(f"{step} returned {type(output).__name__}, expected a list of records")
+    telemetry = get_telemetry()
+    records, failures, repairs = validator.check_items(output)
+    if repairs:
+        telemetry.count('records_repaired', repairs, step=step)
+
+    if failures and reask is not None and inputs is not None and len(inputs) == len(records):
+        indexes = sorted(failures)
+        logger.warning("%s: %s of %s records failed validation, asking again for those", step, len(indexes), len(records))
+        telemetry.count('records_reasked', len(indexes), step=step)
+        retried = reask([inputs[index] for index in indexes])
+        if isinstance(retried, list) and len(retried) == len(indexes):
+            retried, retry_failures, repairs = validator.check_items(retried)
+            telemetry.count('records_repaired', repairs, step=step)
+            for position, index in enumerate(indexes):
+                if position not in retry_failures:
+                    records[index] = retried[position]
+                    del failures[index]
+        else:
+            logger.warning("%s: the re-asked response does not line up with the failed records", step)
+
+    if failures:
+        path = quarantine(step, [(index, records[index], errors) for index, errors in sorted(failures.items())])
+        logger.warning("%s: quarantined %s invalid records to %s (first: %s)", step, len(failures), path,
+                       failures[min(failures)][0])
+        telemetry.count('records_quarantined', len(failures), step=step)
+        if max_invalid is not None and len(failures) > max_invalid * len(records):
+            raise InvalidRecordsError(f"{step}: {len(failures)} of {len(records)} records failed validation")
+        records = [record for index, record in enumerate(records) if index not in failures]
+    return records
+
+
+def step_1(backend: ModelBackend, pdf_parts: List[Any], cache: Optional[ResponseCache] = None) -> List[Dict[str, Any]]:
+    """
+    Identify the energy metrics (code and item) reported in the document.
+    """
     try:
         logger.info("Starting step 1")
-        system_instruction = [load_file(os.path.join(DATA_DIR, 'templates/system_instructions_step_1.txt'))]
-        model = GenerativeModel(config.TEXT_GEN_MODEL_NAME, system_instruction=system_instruction)
-        user_prompt = "Identify all energy consumption metrics mentioned in the document. Return each metric with its code and item name."
-        contents = [pdf_parts, user_prompt]
-
-        response_schema = {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "code": {"type": "string", "pattern": "^[A-Za-z0-9_]{1,20}$"},
-                    "item": {"type": "string", "pattern": "^[A-Za-z0-9 ]{1,50}$"}
-                },
-                "required": ["code", "item"]
-            }
-        }
-
-        output_json = generate_response(model, contents, response_schema)
-        save_json(output_json, output_path)
+        prompt = get_prompt('step_1')
+        contents = [*pdf_parts, STEP_1_USER_PROMPT]
+
+        # Later steps get higher priority so documents already in flight finish first. Step 1
+        # is a single call, so a cache of its instruction and PDF would never be reused.
+        output_json = generate_response(backend, [prompt.system_instruction], contents, prompt.response_schema, cache, priority=2, step='step_1')
+        output_json = validate_records('step_1', prompt.validator, output_json)
         logger.info("Step 1 completed successfully")
+        return output_json
     except Exception as e:
-        logger.error(f"Error in step_1: {e}")
+        logger.error("Error in step_1: %s", e)
+        raise
 
 
-def step_2(model: GenerativeModel, pdf_parts: Part, output_path: str):
+def step_2(backend: ModelBackend, pdf_parts: List[Any], metrics: List[Dict[str, Any]],
+           cache: Optional[ResponseCache] = None) -> List[Dict[str, Any]]:
+    """
+    Extract value, unit, page number and snippet for each metric found in step 1.
+    """
     try:
         logger.info("Starting step 2")
-        system_instruction = [load_file(os.path.join(DATA_DIR, 'templates/system_instructions_step_2.txt'))]
-        model = GenerativeModel(config.TEXT_GEN_MODEL_NAME, system_instruction=system_instruction)
-        metrics = load_binary_file(os.path.join(OUTPUT_DIR, 'out_step_1.txt'))
-        out_step_1 = Part.from_data(data=metrics, mime_type='text/plain')
+        prompt = get_prompt('step_2')
 
         user_prompt = """For each metric listed in the provided text file:
         
@@ -141,38 +341,31 @@ def step_2(model: GenerativeModel, pdf_parts: Part, output_path: str):
         
         Present the information in a structured format for each metric."""
 
-        contents = [pdf_parts, out_step_1, user_prompt]
-
-        response_schema = {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "code": {"type": "string", "pattern": "^[A-Za-z0-9_]{1,20}$"},
-                    "item": {"type": "string", "pattern": "^[A-Za-z0-9 ]{1,50}$"},
-                    "value": {"type": "number"},
-                    "unit": {"type": "string", "pattern": "^[A-Za-z0-9 ]{1,20}$"},
-                    "page_number": {"type": "number"},
-                    "snippet": {"type": "string", "pattern": "^.{1,500}$"}
-                },
-                "required": ["code", "item", "value", "unit", "page_number", "snippet"]
-            }
-        }
-
-        output_json = generate_response(model, contents, response_schema)
-        save_json(output_json, output_path)
+        # Every chunk of the step shares the instruction and the PDF, which are cached together.
+        def request(subset: List[Dict[str, Any]]) -> Any:
+            contents = [*pdf_parts, BlobPart(json.dumps(subset).encode('utf-8'), 'text/plain'), user_prompt]
+            return generate_response(backend, [prompt.system_instruction], contents, prompt.response_schema, cache, priority=1, step='step_2',
+                                     cache_prefix=len(pdf_parts))
+
+        def extract(subset: List[Dict[str, Any]]) -> List[Any]:
+            return extract_chunked('step_2', request, subset)
+
+        output_json = validate_records('step_2', prompt.validator, extract(metrics), metrics, extract)
         logger.info("Step 2 completed successfully")
+        return output_json
     except Exception as e:
-        logger.error(f"Error in step_2: {e}")
+        logger.error("Error in step_2: %s", e)
+        raise
 
 
-def step_3(model: GenerativeModel, pdf_parts: Part, output_path: str):
+def step_3(backend: ModelBackend, pdf_parts: List[Any], metrics: List[Dict[str, Any]],
+           cache: Optional[ResponseCache] = None) -> List[Dict[str, Any]]:
+    """
+    Add year, scope, flag and consumption type to each metric extracted in step 2.
+    """
     try:
         logger.info("Starting step 3")
-        system_instruction = [load_file(os.path.join(DATA_DIR, 'templates/system_instructions_step_3.txt'))]
-        model = GenerativeModel(config.TEXT_GEN_MODEL_NAME, system_instruction=system_instruction)
-        metrics = load_binary_file(os.path.join(OUTPUT_DIR, 'out_step_2.txt'))
-        out_step_2 = Part.from_data(data=metrics, mime_type='text/plain')
+        prompt = get_prompt('step_3')
 
         user_prompt = """For each extracted metric, using the provided PDF:
         
@@ -180,74 +373,280 @@ def step_3(model: GenerativeModel, pdf_parts: Part, output_path: str):
         * Assign a scope (Global, Regional, or Country-Specific) and a flag (Full or Partial) to each value. Provide reasoning for the flag assignment.
         * Classify each value as either 'Operational Consumption' or 'Supply Chain Consumption' based on the context in the document."""
 
-        contents = [pdf_parts, out_step_2, user_prompt]
-
-        response_schema = {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "code": {"type": "string", "pattern": "^[A-Za-z0-9_]{1,20}$"},
-                    "item": {"type": "string", "pattern": "^[A-Za-z0-9 ]{1,50}$"},
-                    "value": {"type": "number"},
-                    "unit": {"type": "string", "pattern": "^[A-Za-z0-9 ]{1,20}$"},
-                    "page_number": {"type": "number"},
-                    "snippet": {"type": "string", "pattern": "^.{1,500}$"},
-                    "year": {"type": "number", "minimum": 1900, "maximum": 2100},
-                    "scope": {"type": "string", "pattern": "^[A-Za-z0-9 ]{1,100}$"},
-                    "flag": {"type": "string", "pattern": "^[A-Za-z ]{1,50}$"},
-                    "flag_reasoning": {"type": "string", "pattern": "^.{1,500}$"},
-                    "consumption_type": {"type": "string", "pattern": "^[A-Za-z ]{1,50}$"}
-                },
-                "required": ["code", "item", "value", "unit", "page_number", "snippet", "year", "scope", "flag", "flag_reasoning", "consumption_type"]
-            }
-        }
-
-        output_json = generate_response(model, contents, response_schema)
-        save_json(output_json, output_path)
+        def request(subset: List[Dict[str, Any]]) -> Any:
+            contents = [*pdf_parts, BlobPart(json.dumps(subset).encode('utf-8'), 'text/plain'), user_prompt]
+            return generate_response(backend, [prompt.system_instruction], contents, prompt.response_schema, cache, priority=0, step='step_3',
+                                     cache_prefix=len(pdf_parts))
+
+        def extract(subset: List[Dict[str, Any]]) -> List[Any]:
+            return extract_chunked('step_3', request, subset)
+
+        output_json = validate_records('step_3', prompt.validator, extract(metrics), metrics, extract)
         logger.info("Step 3 completed successfully")
+        return output_json
     except Exception as e:
-        logger.error(f"Error in step_3: {e}")
+        logger.error("Error in step_3: %s", e)
+        raise
 
 
-def convert_json_to_jsonl(input_file, output_file):
-    # Read the input JSON file
-    with open(input_file, 'r') as f:
-        data = json.load(f)
-        
-     # Ensure the output directory exists
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+def step_4(records: List[Dict[str, Any]], output_file: str) -> None:
+    """
+    Stream the extracted records into the document's JSONL file, replacing it atomically.
+    """
+    count = write_jsonl(records, output_file)
+    logger.info("Conversion complete. %s records saved to %s", count, output_file)
 
-    # Write each item as a separate line in the output JSONL file
-    with open(output_file, 'w') as f:
-        for item in data:
-            json.dump(item, f)
-            f.write('\n')
 
+class PdfDocument:
+    """
+    Lazily loaded PDF input for one document.
+
+    The file is only read (or staged in Cloud Storage when `stage_pdfs` is enabled) once a step
+    actually needs it, and the resulting parts are reused by every step. With `page_index`
+    enabled, only the top-scoring candidate pages (plus neighbours) are sent; with
+    `slice_pages` enabled, step 3 receives only the pages step 2 found values on.
+
+    Attributes:
+        doc_id (str): Identifier of the document.
+        pdf_path (str): Local path of the PDF.
+    """
+
+    def __init__(self, doc_id: str, pdf_path: str):
+        self.doc_id = doc_id
+        self.pdf_path = pdf_path
+        self._bytes = None
+        self._parts = None
+        self._is_excerpt = False
+
+    def data(self) -> bytes:
+        if self._bytes is None:
+            self._bytes = load_binary_file(self.pdf_path)
+        return self._bytes
+
+    def _excerpt(self, pages: List[int], total_pages: int) -> List[Any]:
+        logger.info("Sending pages %s of %s for %s", pages, total_pages, self.doc_id)
+        note = (f"The attached PDF contains only pages {', '.join(str(page) for page in pages)} "
+                f"of the original {total_pages}-page document, in that order.")
+        return [BlobPart(slice_pdf(self.data(), pages), 'application/pdf'), note]
+
+    def _staged(self) -> UriPart:
+        # The page count travels with the URI so quota and context-cache checks can estimate
+        # the tokens of a PDF that is no longer sent inline.
+        uri = get_stager().stage(self.pdf_path)
+        try:
+            pages = count_pages(self.data())
+        except Exception as e:
+            logger.warning("Could not count the pages of %s, estimating from its size: %s", self.doc_id, e)
+            pages = None
+        return UriPart(uri, 'application/pdf', pages=pages, size=os.path.getsize(self.pdf_path))
+
+    def parts(self) -> List[Any]:
+        """
+        Return the content parts representing the document for the extraction steps.
+        """
+        if self._parts is None:
+            if config.PAGE_INDEX:
+                try:
+                    scores = get_page_index().scores(self.pdf_path)
+                    pages = select_pages(scores, config.PAGE_INDEX_TOP_K, config.PAGE_INDEX_NEIGHBOURS)
+                    if pages and len(pages) < len(scores):
+                        self._parts = self._excerpt(pages, len(scores))
+                        self._is_excerpt = True
+                        return self._parts
+                except Exception as e:
+                    # Unreadable or encrypted PDFs are still sent whole; the model may read them.
+                    logger.warning("Could not index %s, sending the full document: %s", self.doc_id, e)
+            if config.STAGE_PDFS:
+                self._parts = [self._staged()]
+            else:
+                self._parts = [BlobPart(self.data(), 'application/pdf')]
+        return self._parts
+
+    def parts_for_metrics(self, metrics: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Return parts holding only the pages referenced by the metrics, or the regular parts.
+        """
+        parts = self.parts()
+        if not config.SLICE_PAGES or self._is_excerpt:
+            return parts
+        try:
+            total_pages = count_pages(self.data())
+            pages = pages_for_metrics(metrics, total_pages, config.SLICE_PAGE_NEIGHBOURS)
+            if not pages or len(pages) >= total_pages:
+                return parts
+            return self._excerpt(pages, total_pages)
+        except Exception as e:
+            logger.warning("Could not slice %s, sending the regular parts: %s", self.doc_id, e)
+            return parts
+
+
+def warm_backend(backend: ModelBackend, prompt_names: List[str]) -> None:
+    """
+    Build the backend's model clients for these prompts before the first document starts,
+    instead of inside the first worker that needs each one.
+    """
+    backend.warm(backend.model_id(config.TEXT_GEN_MODEL_NAME), [[get_prompt(name).system_instruction] for name in prompt_names])
+
+
+def run_step(doc_id: str,
+             step_name: str,
+             run_fn: Callable[[], Any],
+             input_hash: str,
+             store: Optional[ArtifactStore],
+             manifest: Optional[RunManifest]) -> Any:
+    """
+    Run one step, or reuse its stored output if the manifest shows it already completed for
+    the same input. Failures are recorded in the manifest and re-raised, stopping the document.
+    """
+    if manifest is not None and store is not None and manifest.completed_step(doc_id, step_name, input_hash):
+        output = store.load(doc_id, step_name)
+        if output is not None:
+            logger.info("Resuming %s: reusing completed %s", doc_id, step_name)
+            get_telemetry().count('steps_resumed', step=step_name)
+            return output
+
+    if manifest is not None:
+        manifest.mark_step(doc_id, step_name, 'running', input_hash)
+    try:
+        with get_telemetry().span('step', step=step_name):
+            output = run_fn()
+            if output is None:
+                raise RuntimeError(f"{step_name} returned no output for document {doc_id}")
+    except Exception as e:
+        if manifest is not None:
+            manifest.mark_step(doc_id, step_name, 'failed', input_hash, error=str(e))
+        raise
+
+    if store is not None:
+        store.save(doc_id, step_name, output)
+    if manifest is not None:
+        manifest.mark_step(doc_id, step_name, 'done', input_hash, output_hash=hash_json(output))
+    return output
+
+
+def step_input_hash(source_hash: str, prompt_name: str, previous_output: Any = None) -> str:
+    """
+    Hash a step is checkpointed under in the run manifest: the source PDF, the version of
+    the step's prompt and, for later steps, the previous step's output. Prompt versions are
+    part of it, so editing a template re-runs that step (and everything after it) instead of
+    resuming a stale output. Batch ingest records steps under the same hash, so online runs
+    resume from batch results.
+    """
+    hashes = [source_hash, get_prompt(prompt_name).version]
+    if previous_output is not None:
+        hashes.append(hash_json(previous_output))
+    return combine_hashes(*hashes)
+
+
+def prompt_versions(prompt_names: Iterable[str]) -> Dict[str, str]:
+    """
+    Current version of each named prompt, recorded on finished documents in the run manifest
+    so that editing a template makes them out of date.
+    """
+    return {name: get_prompt(name).version for name in prompt_names}
+
+
+def run_steps(doc_id: str,
+              backend: ModelBackend,
+              pdf: 'PdfDocument',
+              source_hash: str,
+              store: Optional[ArtifactStore] = None,
+              cache: Optional[ResponseCache] = None,
+              manifest: Optional[RunManifest] = None) -> List[Dict[str, Any]]:
+    """
+    Run steps 1-3 for one document and return the step 3 records.
+    """
+    input_hash = step_input_hash(source_hash, 'step_1')
+    out_step_1 = run_step(doc_id, 'step_1', lambda: step_1(backend, pdf.parts(), cache), input_hash, store, manifest)
+    input_hash = step_input_hash(source_hash, 'step_2', out_step_1)
+    out_step_2 = run_step(doc_id, 'step_2', lambda: step_2(backend, pdf.parts(), out_step_1, cache), input_hash, store, manifest)
+    input_hash = step_input_hash(source_hash, 'step_3', out_step_2)
+    return run_step(doc_id, 'step_3', lambda: step_3(backend, pdf.parts_for_metrics(out_step_2), out_step_2, cache), input_hash, store, manifest)
+
+
+def process_document(doc_id: str,
+                     backend: Optional[ModelBackend] = None,
+                     store: Optional[ArtifactStore] = None,
+                     cache: Optional[ResponseCache] = None,
+                     manifest: Optional[RunManifest] = None) -> str:
+    """
+    Run steps 1-4 sequentially for one PDF and return the path of the generated JSONL.
+
+    Step outputs are passed in memory. If an artifact store is given, each step output is
+    also persisted under the document ID. With a run manifest, documents whose output is
+    up to date are skipped and interrupted documents resume after their last completed step.
+    """
+    pdf_path = os.path.join(PDF_DIR, f'{doc_id}.pdf')
+    output_file = jsonl_path(GEN_DIR, doc_id, config.OUTPUT_COMPRESSION)
+    source_hash = manifest.fingerprint(doc_id, pdf_path) if manifest is not None else ''
+    prompts = prompt_versions(PROMPTS)
+    if manifest is not None:
+        if manifest.is_up_to_date(doc_id, source_hash, output_file, prompts):
+            logger.info("Skipping %s: output is up to date", doc_id)
+            return output_file
+        manifest.start_document(doc_id, pdf_path, source_hash)
+
+    logger.info("Starting document %s", doc_id)
+    backend = backend or get_backend()
+    pdf = PdfDocument(doc_id, pdf_path)
+
+    try:
+        out_step_3 = run_steps(doc_id, backend, pdf, source_hash, store, cache, manifest)
+        step_4(out_step_3, output_file)
+        metric_store = get_metric_store(GEN_DIR)
+        if metric_store is not None:
+            metric_store.append(doc_id, out_step_3)
+    except Exception as e:
+        if manifest is not None:
+            manifest.mark_document(doc_id, 'failed', error=str(e))
+        raise
+    finally:
+        backend.release(doc_id)
+
+    if manifest is not None:
+        manifest.mark_document(doc_id, 'done', output_file=output_file, prompts=prompts)
+    logger.info("Document %s completed successfully", doc_id)
+    return output_file
+
+
+def list_documents(pdf_dir: str = PDF_DIR) -> List[str]:
+    """
+    List document IDs (PDF file names without extension) in a stable order.
+    """
+    return sorted(filename[:-len('.pdf')] for filename in os.listdir(pdf_dir) if filename.endswith('.pdf'))
 
-def step_4(input_file, output_file):
-    convert_json_to_jsonl(input_file, output_file)
-    print(f"Conversion complete. JSONL file saved as {output_file}")
 
-def main():
+def main(max_workers: Optional[int] = None,
+         backend: Optional[ModelBackend] = None,
+         store: Optional[ArtifactStore] = None,
+         cache: Optional[ResponseCache] = None,
+         manifest: Optional[RunManifest] = None) -> List[DocumentResult]:
     try:
-        for filename in os.listdir('./data/pdfs'):
-            if filename.endswith('.pdf'):
-                # Get the full path to the PDF file
-                full_path = os.path.join('./data/pdfs', filename)
-                print(full_path)
-                logger.info("Starting main process")
-                pdf_bytes = load_binary_file(full_path)
-                pdf_parts = Part.from_data(data=pdf_bytes, mime_type='application/pdf')
-
-                step_1(config.TEXT_GEN_MODEL_NAME, pdf_parts, os.path.join(OUTPUT_DIR, 'out_step_1.txt'))
-                step_2(config.TEXT_GEN_MODEL_NAME, pdf_parts, os.path.join(OUTPUT_DIR, 'out_step_2.txt'))
-                step_3(config.TEXT_GEN_MODEL_NAME, pdf_parts, os.path.join(OUTPUT_DIR, 'out_step_3.txt'))
-                filename = filename.replace('.pdf', '')
-                step_4(os.path.join(OUTPUT_DIR, 'out_step_3.txt'), os.path.join(GEN_DIR, f'{filename}.jsonl'))
-                logger.info("Main process completed successfully")
+        logger.info("Starting main process")
+        doc_ids = list_documents()
+        backend = backend or get_backend()
+        warm_backend(backend, list(PROMPTS))
+        groups = group_documents(doc_ids, PDF_DIR, GEN_DIR, manifest=manifest)
+        results = process_documents(list(groups),
+                                    lambda doc_id: fan_out(process_document(doc_id, backend, store, cache, manifest),
+                                                           groups[doc_id], GEN_DIR, manifest, PDF_DIR),
+                                    max_workers=max_workers or config.MAX_WORKERS)
+        backend.release()
+        flush_metric_stores()
+        if cache is not None:
+            logger.info("Response cache stats: %s", cache.stats())
+        logger.info("Scheduler stats: %s", get_scheduler().stats())
+        get_telemetry().flush()
+        logger.info("Main process completed successfully")
+        return results
     except Exception as e:
-        logger.error(f"Error in main: {e}")
+        logger.error("Error in main: %s", e)
+        return []
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run the multi-step extraction pipeline over data/pdfs.")
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    main(store=ArtifactStore(OUTPUT_DIR),
+         cache=response_cache_from_args(args),
+         manifest=RunManifest(os.path.join(OUTPUT_DIR, 'manifest.jsonl')))
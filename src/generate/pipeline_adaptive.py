@@ -0,0 +1,161 @@
+from src.generate.backends import ModelBackend
+from src.generate.backends import get_backend
+from src.generate.engine import process_documents
+from src.generate.engine import DocumentResult
+from src.generate.artifacts import ArtifactStore
+from src.generate.cache import response_cache_from_args
+from src.generate.cache import add_cache_arguments
+from src.generate.cache import ResponseCache
+from src.generate.manifest import RunManifest
+from src.generate.scheduler import get_scheduler
+from src.generate.telemetry import get_telemetry
+from src.generate.jsonl import jsonl_path
+from src.generate.metric_store import flush_metric_stores
+from src.generate.metric_store import get_metric_store
+from src.generate.dedup import group_documents
+from src.generate.dedup import fan_out
+from src.generate.planner import get_planner
+from src.generate.planner import FUSED
+from src.generate.pipeline import TruncatedResponseError
+from src.generate.pipeline import InvalidRecordsError
+from src.generate.pipeline import PdfDocument
+from src.generate.pipeline import run_steps
+from src.generate.pipeline import run_step
+from src.generate.pipeline import step_input_hash
+from src.generate.pipeline import prompt_versions
+from src.generate.pipeline import step_4
+from src.generate.pipeline import warm_backend
+from src.generate.pipeline_all_in_one import FusedOutputError
+from src.generate.pipeline_all_in_one import step_all_in_one
+from src.config.logging import logger
+from src.config.setup import config
+from typing import List, Dict, Any, Optional
+import argparse
+import json
+import os
+
+
+DATA_DIR = './data'
+PDF_DIR = os.path.join(DATA_DIR, 'pdfs')
+OUTPUT_DIR = os.path.join(DATA_DIR, 'output_adaptive')
+GEN_DIR = os.path.join(DATA_DIR, 'generated_adaptive')
+
+# Either strategy may run, so a finished document depends on every prompt.
+PROMPTS = ('all_in_one', 'step_1', 'step_2', 'step_3')
+
+# Fused-call failures that the multi-step pipeline can recover from; anything else (quota,
+# auth, missing templates) would fail the multi-step calls too, so it is raised instead.
+FALLBACK_ERRORS = (TruncatedResponseError, FusedOutputError, InvalidRecordsError, json.JSONDecodeError)
+
+
+def run_fused(doc_id: str,
+              backend: ModelBackend,
+              pdf: PdfDocument,
+              source_hash: str,
+              store: Optional[ArtifactStore] = None,
+              cache: Optional[ResponseCache] = None,
+              manifest: Optional[RunManifest] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Run the fused step and return its records, or None when its response
+    was truncated or invalid, or more than `planner_fused_max_invalid` of its records failed
+    validation, and the document should go through the multi-step pipeline.
+    """
+    try:
+        output = run_step(doc_id, 'step_all_in_one', lambda: step_all_in_one(backend, pdf.parts(), cache, config.PLANNER_FUSED_MAX_INVALID),
+                          step_input_hash(source_hash, 'all_in_one'), store, manifest)
+    except FALLBACK_ERRORS as e:
+        logger.warning("Fused extraction failed for %s, falling back to multi-step: %s", doc_id, e)
+        get_telemetry().count('plan_fallbacks', reason=type(e).__name__)
+        return None
+    return output['metrics']
+
+
+def process_document(doc_id: str,
+                     backend: Optional[ModelBackend] = None,
+                     store: Optional[ArtifactStore] = None,
+                     cache: Optional[ResponseCache] = None,
+                     manifest: Optional[RunManifest] = None) -> str:
+    """
+    Extract one PDF with the strategy the planner picks for it and write its JSONL.
+
+    Fused documents whose response is truncated or invalid are re-extracted with the
+    multi-step pipeline. The plan, its features and any fallback are recorded on a `plan`
+    telemetry span and in the `documents_planned` / `plan_fallbacks` counters.
+    """
+    pdf_path = os.path.join(PDF_DIR, f'{doc_id}.pdf')
+    output_file = jsonl_path(GEN_DIR, doc_id, config.OUTPUT_COMPRESSION)
+    source_hash = manifest.fingerprint(doc_id, pdf_path) if manifest is not None else ''
+    prompts = prompt_versions(PROMPTS)
+    if manifest is not None:
+        if manifest.is_up_to_date(doc_id, source_hash, output_file, prompts):
+            logger.info("Skipping %s: output is up to date", doc_id)
+            return output_file
+        manifest.start_document(doc_id, pdf_path, source_hash)
+
+    logger.info("Starting document %s", doc_id)
+    backend = backend or get_backend()
+    pdf = PdfDocument(doc_id, pdf_path)
+    telemetry = get_telemetry()
+
+    try:
+        with telemetry.span('plan') as span:
+            plan = get_planner().plan(pdf_path)
+            span.set(strategy=plan.strategy, reason=plan.reason, **plan.features.to_dict())
+        telemetry.count('documents_planned', strategy=plan.strategy, reason=plan.reason)
+        logger.info("Planned %s for %s (%s)", plan.strategy, doc_id, plan.reason)
+
+        fused = run_fused(doc_id, backend, pdf, source_hash, store, cache, manifest) if plan.strategy == FUSED else None
+        if fused is not None:
+            records = fused
+        else:
+            records = run_steps(doc_id, backend, pdf, source_hash, store, cache, manifest)
+        step_4(records, output_file)
+        metric_store = get_metric_store(GEN_DIR)
+        if metric_store is not None:
+            metric_store.append(doc_id, records)
+    except Exception as e:
+        if manifest is not None:
+            manifest.mark_document(doc_id, 'failed', error=str(e))
+        raise
+    finally:
+        backend.release(doc_id)
+
+    if manifest is not None:
+        manifest.mark_document(doc_id, 'done', output_file=output_file, prompts=prompts)
+    logger.info("Document %s completed successfully", doc_id)
+    return output_file
+
+
+def main(max_workers: Optional[int] = None,
+         backend: Optional[ModelBackend] = None,
+         store: Optional[ArtifactStore] = None,
+         cache: Optional[ResponseCache] = None,
+         manifest: Optional[RunManifest] = None) -> List[DocumentResult]:
+    try:
+        doc_ids = sorted(filename[:-len('.pdf')] for filename in os.listdir(PDF_DIR) if filename.endswith('.pdf'))
+        backend = backend or get_backend()
+        warm_backend(backend, list(PROMPTS))
+        groups = group_documents(doc_ids, PDF_DIR, GEN_DIR, manifest=manifest)
+        results = process_documents(list(groups),
+                                    lambda doc_id: fan_out(process_document(doc_id, backend, store, cache, manifest),
+                                                           groups[doc_id], GEN_DIR, manifest, PDF_DIR),
+                                    max_workers=max_workers or config.MAX_WORKERS)
+        backend.release()
+        flush_metric_stores()
+        if cache is not None:
+            logger.info("Response cache stats: %s", cache.stats())
+        logger.info("Scheduler stats: %s", get_scheduler().stats())
+        get_telemetry().flush()
+        return results
+    except Exception as e:
+        logger.error("Error in main: %s", e)
+        return []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the adaptive extraction pipeline over data/pdfs.")
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    main(store=ArtifactStore(OUTPUT_DIR),
+         cache=response_cache_from_args(args),
+         manifest=RunManifest(os.path.join(OUTPUT_DIR, 'manifest.jsonl')))
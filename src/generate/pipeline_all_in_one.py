@@ -1,240 +1,219 @@
-from vertexai.generative_models import HarmBlockThreshold
-from vertexai.generative_models import GenerationConfig
-from vertexai.generative_models import GenerativeModel
-from vertexai.generative_models import HarmCategory
-from vertexai.generative_models import Part
+from src.generate.backends import ModelBackend
+from src.generate.backends import BlobPart
+from src.generate.backends import get_backend
+from src.generate.engine import process_documents
+from src.generate.engine import DocumentResult
+from src.generate.artifacts import ArtifactStore
+from src.generate.cache import response_cache_from_args
+from src.generate.cache import add_cache_arguments
+from src.generate.cache import ResponseCache
+from src.generate.manifest import RunManifest
+from src.generate.scheduler import get_scheduler
+from src.generate.telemetry import get_telemetry
+from src.generate.templates import get_prompt
+from src.generate.jsonl import jsonl_path
+from src.generate.jsonl import write_jsonl
+from src.generate.metric_store import flush_metric_stores
+from src.generate.metric_store import get_metric_store
+from src.generate.dedup import group_documents
+from src.generate.dedup import fan_out
+from src.generate.pipeline import generate_response
+from src.generate.pipeline import PdfDocument
+from src.generate.pipeline import run_step
+from src.generate.pipeline import step_input_hash
+from src.generate.pipeline import prompt_versions
+from src.generate.pipeline import validate_records
+from src.generate.pipeline import salvage_array
+from src.generate.pipeline import TruncatedResponseError
+from src.generate.pipeline import warm_backend
 from src.config.logging import logger
 from src.config.setup import config
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import argparse
 import json
 import os
 
 
 DATA_DIR = './data'
+PDF_DIR = os.path.join(DATA_DIR, 'pdfs')
 OUTPUT_DIR = os.path.join(DATA_DIR, 'output_all_in_one')
 GEN_DIR = os.path.join(DATA_DIR, 'generated_all_in_one')
 
+# Prompts a finished document depends on; editing any of them makes it out of date.
+PROMPTS = ('all_in_one',)
 
-def load_file(file_path: str) -> str:
-    """
-    Load text content from a file.
-    """
-    logger.info(f"Loading text file from {file_path}")
-    with open(file_path, 'r') as file:
-        return file.read()
+USER_PROMPT = "Analyze the following PDF and follow the rules."
+CONTINUE_PROMPT = ("The metrics listed in the attached text file have already been extracted. "
+                   "Return only the metrics that are not in that list, following the same rules.")
 
 
-def load_binary_file(file_path: str) -> bytes:
+class FusedOutputError(ValueError):
     """
-    Load binary content from a file.
+    Raised when the single-call response does not have the expected shape.
     """
-    logger.info(f"Loading binary file from {file_path}")
-    with open(file_path, 'rb') as file:
-        return file.read()
 
 
-def save_json(data: Any, file_path: str) -> None:
+def check_output(output: Any) -> None:
     """
-    Save JSON data to a file.
+    Check that a fused response holds a `metrics` list of records.
     """
-    logger.info(f"Saving JSON data to {file_path}")
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=4)
+    if not isinstance(output, dict):
+        raise FusedOutputError(f"Expected an object, got {type(output).__name__}")
+    metrics = output.get('metrics')
+    if not isinstance(metrics, list) or not all(isinstance(metric, dict) for metric in metrics):
+        raise FusedOutputError("Expected `metrics` to be a list of objects")
 
 
-def create_generation_config() -> GenerationConfig:
-    """
-    Create a GenerationConfig instance.
-    """
-    logger.info("Creating generation configuration")
-    return GenerationConfig(
-        temperature=0.0, 
-        top_p=0.0, 
-        top_k=1, 
-        candidate_count=1, 
-        max_output_tokens=8192,
-        response_mime_type="application/json"
-    )
-
-
-def create_safety_settings() -> Dict[HarmCategory, HarmBlockThreshold]:
+def _metric_key(metric: Dict[str, Any]) -> str:
+    return json.dumps([metric.get(field) for field in ('code', 'value', 'unit', 'page_number', 'year')])
+
+
+def continue_truncated(backend: ModelBackend, pdf_parts: List[Any], error: TruncatedResponseError,
+                       cache: Optional[ResponseCache] = None) -> Dict[str, Any]:
     """
-    Create a safety settings dictionary.
+    Complete a fused response that stopped at the output token limit.
+
+    The complete metrics before the cut are kept, and the model is asked only for the ones
+    it has not returned yet, up to `max_continuations` times. Continuations are appended in
+    order; metrics a continuation repeats are dropped.
     """
-    logger.info("Creating safety settings")
-    return {
-        HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE
-    }
-
-def generate_response(model: GenerativeModel, contents: List[Part], response_schema: Dict[str, Any]) -> Any:
+    prompt = get_prompt('all_in_one')
+    telemetry = get_telemetry()
+    telemetry.count('truncated_responses', step='step_all_in_one')
+    metrics_at = error.text.find('"metrics"')
+    metrics = salvage_array(error.text, metrics_at) if metrics_at >= 0 else []
+    for attempt in range(config.MAX_CONTINUATIONS):
+        logger.warning("Fused response truncated after %s metrics, requesting the rest (%s/%s)",
+                       len(metrics), attempt + 1, config.MAX_CONTINUATIONS)
+        extracted = [{field: metric.get(field) for field in ('code', 'item', 'page_number')} for metric in metrics]
+        contents = [*pdf_parts, USER_PROMPT, BlobPart(json.dumps(extracted).encode('utf-8'), 'text/plain'), CONTINUE_PROMPT]
+        try:
+            tail = generate_response(backend, [prompt.system_instruction], contents, prompt.response_schema, cache,
+                                     step='step_all_in_one', cache_prefix=len(pdf_parts))
+            check_output(tail)
+            new_metrics = tail['metrics']
+        except TruncatedResponseError as e:
+            telemetry.count('truncated_responses', step='step_all_in_one')
+            tail = None
+            new_metrics = salvage_array(e.text, max(e.text.find('"metrics"'), 0))
+        seen = {_metric_key(metric) for metric in metrics}
+        new_metrics = [metric for metric in new_metrics if isinstance(metric, dict) and _metric_key(metric) not in seen]
+        metrics.extend(new_metrics)
+        if tail is not None:
+            return {**tail, 'metrics': metrics}
+        if not new_metrics:
+            break
+    raise TruncatedResponseError(f"Fused response still truncated after {len(metrics)} metrics", error.text)
+
+
+def step_all_in_one(backend: ModelBackend, pdf_parts: List[Any],
+                    cache: Optional[ResponseCache] = None, max_invalid: Optional[float] = None) -> Dict[str, Any]:
     """
-    Generate content using the generative model.
+    Extract every metric with one call. With `max_invalid`, raise InvalidRecordsError when
+    more than that fraction of the metrics fails validation (see validate_records).
     """
-    logger.info("Generating response using the generative model")
-    response = model.generate_content(contents, 
-                                      generation_config=GenerationConfig(
-                                          response_mime_type="application/json", 
-                                          response_schema=response_schema
-                                      ),
-                                      safety_settings=create_safety_settings())
-    output_json = json.loads(response.text.strip())
-    logger.info(f"Response generated: {output_json}")
-    logger.info(f"Finish reason: {response.candidates[0].finish_reason}")
-    logger.info(f"Safety ratings: {response.candidates[0].safety_ratings}")
-    return output_json
-
-
-def step_all_in_one(model: GenerativeModel, pdf_parts: Part, output_path: str):
     try:
         logger.info("Starting processing ...")
-        system_instruction = [load_file(os.path.join(DATA_DIR, 'templates/system_instructions.txt'))]
-        model = GenerativeModel(config.TEXT_GEN_MODEL_NAME, system_instruction=system_instruction)
-        user_prompt = "Analyze the following PDF and follow the rules."
-        contents = [pdf_parts, user_prompt]
-
-        response_schema = response_schema = {
-    "type": "object",
-    "properties": {
-        "year": {
-            "type": "number",
-            "minimum": 1900,
-            "maximum": 2100
-        },
-        "metrics": {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "code": {
-                        "type": "string",
-                        "pattern": "^[A-Za-z0-9_]{1,20}$"
-                    },
-                    "item": {
-                        "type": "string",
-                        "pattern": "^[A-Za-z0-9 ]{1,50}$"
-                    },
-                    "scope": {
-                        "type": "string",
-                        "pattern": "^[A-Za-z0-9 ]{1,100}$"
-                    },
-                    "flag": {
-                        "type": "string",
-                        "pattern": "^[A-Za-z ]{1,50}$"
-                    },
-                    "value": {
-                        "type": "string",
-                        "pattern": "^[A-Za-z0-9 ]{1,50}$"
-                    },
-                    "unit": {
-                        "type": "string",
-                        "pattern": "^[A-Za-z0-9 ]{1,20}$"
-                    },
-                    "page_number": {
-                        "type": "number"
-                    },
-                    "snippet": {
-                        "type": "string",
-                        "pattern": "^.{1,500}$"
-                    },
-                    "relevant_information": {
-                        "type": "string",
-                        "pattern": "^.{1,500}$"
-                    },
-                    "flag_reasoning": {
-                        "type": "string",
-                        "pattern": "^.{1,500}$"
-                    },
-                    "consumption_type": {
-                        "type": "string",
-                        "pattern": "^[A-Za-z ]{1,50}$"
-                    }
-                },
-                "required": ["code", "item", "scope", "flag", "value", "unit", "page_number", "snippet", "flag_reasoning", "consumption_type"]
-            }
-        },
-        "metadata": {
-            "type": "object",
-            "properties": {
-                "data_sources": {
-                    "type": "string",
-                    "pattern": "^.{1,200}$"
-                },
-                "data_collector": {
-                    "type": "string",
-                    "pattern": "^.{1,100}$"
-                },
-                "fiscal_year_end": {
-                    "type": "string",
-                    "pattern": "^(0[1-9]|1[0-2])\/(0[1-9]|[12][0-9]|3[01])\/(19|20)\d\d$"  # Date in MM/DD/YYYY format
-                },
-                "geographical_scope": {
-                    "type": "string",
-                    "pattern": "^[A-Za-z ]{1,50}$"
-                },
-                "country": {
-                    "type": "string",
-                    "pattern": "^[A-Za-z ]{1,50}$"
-                },
-                "organization_name": {
-                    "type": "string",
-                    "pattern": "^[A-Za-z0-9 ]{1,100}$"
-                }
-            },
-            "required": ["data_sources", "data_collector", "fiscal_year_end", "geographical_scope", "country", "organization_name"]
-        }
-    },
-    "required": ["year", "metrics", "metadata"]
-}
-
-        output_json = generate_response(model, contents, response_schema)
-        save_json(output_json, output_path)
+        prompt = get_prompt('all_in_one')
+        contents = [*pdf_parts, USER_PROMPT]
+
+        # The instruction and PDF are cached together, so continuations of a truncated
+        # response reference them instead of sending them again.
+        try:
+            output_json = generate_response(backend, [prompt.system_instruction], contents, prompt.response_schema, cache,
+                                            step='step_all_in_one', cache_prefix=len(pdf_parts))
+        except TruncatedResponseError as e:
+            output_json = continue_truncated(backend, pdf_parts, e, cache)
+        check_output(output_json)
+        output_json['metrics'] = validate_records('step_all_in_one', prompt.validator.at('metrics'), output_json['metrics'],
+                                                 max_invalid=max_invalid)
         logger.info("Step completed successfully")
+        return output_json
     except Exception as e:
-        logger.error(f"Error in step: {e}")
+        logger.error("Error in step: %s", e)
+        raise
 
 
-def convert_json_to_jsonl(input_file, output_file):
-    # Read the input JSON file
-    with open(input_file, 'r') as f:
-        data = json.load(f)
-        
-     # Ensure the output directory exists
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-
-    # Write each item as a separate line in the output JSONL file
-    with open(output_file, 'w') as f:
-        for item in data["metrics"]:
-            json_line = json.dumps(item)
-            f.write(json_line + '\n')
+def step_4(data: Dict[str, Any], output_file: str) -> None:
+    """
+    Stream the extracted metrics into the document's JSONL file, replacing it atomically.
+    """
+    count = write_jsonl(data["metrics"], output_file)
+    logger.info("Conversion complete. %s records saved to %s", count, output_file)
 
 
-def step_4(input_file, output_file):
-    convert_json_to_jsonl(input_file, output_file)
-    print(f"Conversion complete. JSONL file saved as {output_file}")
+def process_document(doc_id: str,
+                     backend: Optional[ModelBackend] = None,
+                     store: Optional[ArtifactStore] = None,
+                     cache: Optional[ResponseCache] = None,
+                     manifest: Optional[RunManifest] = None) -> str:
+    """
+    Run the single extraction step and the JSONL conversion for one PDF.
 
-def main():
-    
+    With a run manifest, documents whose output is up to date are skipped.
+    """
+    pdf_path = os.path.join(PDF_DIR, f'{doc_id}.pdf')
+    output_file = jsonl_path(GEN_DIR, doc_id, config.OUTPUT_COMPRESSION)
+    source_hash = manifest.fingerprint(doc_id, pdf_path) if manifest is not None else ''
+    prompts = prompt_versions(PROMPTS)
+    if manifest is not None:
+        if manifest.is_up_to_date(doc_id, source_hash, output_file, prompts):
+            logger.info("Skipping %s: output is up to date", doc_id)
+            return output_file
+        manifest.start_document(doc_id, pdf_path, source_hash)
+
+    logger.info("Starting document %s", doc_id)
+    backend = backend or get_backend()
+    try:
+        out_step = run_step(doc_id, 'step_all_in_one',
+                             lambda: step_all_in_one(backend, PdfDocument(doc_id, pdf_path).parts(), cache),
+                             step_input_hash(source_hash, 'all_in_one'), store, manifest)
+        step_4(out_step, output_file)
+        metric_store = get_metric_store(GEN_DIR)
+        if metric_store is not None:
+            metric_store.append(doc_id, out_step['metrics'])
+    except Exception as e:
+        if manifest is not None:
+            manifest.mark_document(doc_id, 'failed', error=str(e))
+        raise
+    finally:
+        backend.release(doc_id)
+
+    if manifest is not None:
+        manifest.mark_document(doc_id, 'done', output_file=output_file, prompts=prompts)
+    return output_file
+
+
+def main(max_workers: Optional[int] = None,
+         backend: Optional[ModelBackend] = None,
+         store: Optional[ArtifactStore] = None,
+         cache: Optional[ResponseCache] = None,
+         manifest: Optional[RunManifest] = None) -> List[DocumentResult]:
     try:
-        for filename in os.listdir('./data/pdfs'):
-            if filename.endswith('.pdf'):
-                # Get the full path to the PDF file
-                full_path = os.path.join('./data/pdfs', filename)
-                print(full_path)
-                logger.info("Starting main process")
-                pdf_bytes = load_binary_file(full_path)
-                pdf_parts = Part.from_data(data=pdf_bytes, mime_type='application/pdf')
-
-                step_all_in_one(config.TEXT_GEN_MODEL_NAME, pdf_parts, os.path.join(OUTPUT_DIR, 'out_step.txt'))
-                filename = filename.replace('.pdf', '')
-                step_4(os.path.join(OUTPUT_DIR, 'out_step.txt'), os.path.join(GEN_DIR, f'{filename}.jsonl'))
+        doc_ids = sorted(filename[:-len('.pdf')] for filename in os.listdir(PDF_DIR) if filename.endswith('.pdf'))
+        backend = backend or get_backend()
+        warm_backend(backend, list(PROMPTS))
+        groups = group_documents(doc_ids, PDF_DIR, GEN_DIR, manifest=manifest)
+        results = process_documents(list(groups),
+                                    lambda doc_id: fan_out(process_document(doc_id, backend, store, cache, manifest),
+                                                           groups[doc_id], GEN_DIR, manifest, PDF_DIR),
+                                    max_workers=max_workers or config.MAX_WORKERS)
+        backend.release()
+        flush_metric_stores()
+        if cache is not None:
+            logger.info("Response cache stats: %s", cache.stats())
+        logger.info("Scheduler stats: %s", get_scheduler().stats())
+        get_telemetry().flush()
+        return results
     except Exception as e:
-        logger.error(f"Error in main: {e}")
+        logger.error("Error in main: %s", e)
+        return []
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the all-in-one extraction pipeline over data/pdfs.")
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    main(store=ArtifactStore(OUTPUT_DIR),
+         cache=response_cache_from_args(args),
+         manifest=RunManifest(os.path.join(OUTPUT_DIR, 'manifest.jsonl')))
@@ -0,0 +1,131 @@
+from src.generate.page_index import get_page_index
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Any, Dict, Optional
+import threading
+import os
+
+
+FUSED = 'all_in_one'
+MULTI_STEP = 'multi_step'
+STRATEGIES = (FUSED, MULTI_STEP)
+
+
+class DocumentFeatures:
+    """
+    Cheap per-document features the planner decides on; nothing here calls the model.
+
+    Attributes:
+        size_bytes (int): PDF file size.
+        pages (Optional[int]): Page count, None when the PDF could not be parsed.
+        hit_pages (Optional[int]): Pages the page index scores above zero, a proxy for how
+            many metrics (and so how much output) the document will produce.
+    """
+
+    def __init__(self, size_bytes: int, pages: Optional[int] = None, hit_pages: Optional[int] = None):
+        self.size_bytes = size_bytes
+        self.pages = pages
+        self.hit_pages = hit_pages
+
+    @property
+    def hit_density(self) -> Optional[float]:
+        if not self.pages or self.hit_pages is None:
+            return None
+        return self.hit_pages / self.pages
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'size_bytes': self.size_bytes, 'pages': self.pages, 'hit_pages': self.hit_pages,
+                'hit_density': self.hit_density}
+
+    @classmethod
+    def from_pdf(cls, pdf_path: str) -> 'DocumentFeatures':
+        """
+        Measure a PDF using the cached page index, which is built once per file content.
+        """
+        size_bytes = os.path.getsize(pdf_path)
+        try:
+            scores = get_page_index().scores(pdf_path)
+        except Exception as e:
+            logger.warning("Could not index %s, planning on file size only: %s", pdf_path, e)
+            return cls(size_bytes)
+        return cls(size_bytes, len(scores), sum(1 for score in scores if score > 0))
+
+
+class Plan:
+    """
+    Strategy chosen for one document and why.
+
+    Attributes:
+        strategy (str): FUSED or MULTI_STEP.
+        reason (str): Short label of the deciding rule, e.g. `pages` or `within_limits`.
+        features (DocumentFeatures): Features the decision was made on.
+    """
+
+    def __init__(self, strategy: str, reason: str, features: DocumentFeatures):
+        self.strategy = strategy
+        self.reason = reason
+        self.features = features
+
+
+class StepPlanner:
+    """
+    Chooses between the single fused call and the three-step pipeline for each document.
+
+    The fused call sends the PDF once and is cheaper and faster, but its whole output has to
+    fit in one response. Documents that are long, large or dense with metric-bearing pages
+    go to the multi-step pipeline, whose outputs are split across three calls; everything
+    else is fused. The caller still falls back to multi-step when a fused call truncates or
+    returns an invalid response.
+
+    Attributes:
+        strategy (str): `auto` to decide per document, or a fixed FUSED / MULTI_STEP.
+        max_pages (int): Longest document sent fused.
+        max_bytes (int): Largest PDF sent fused.
+        max_hit_pages (int): Most metric-bearing pages in a fused document.
+    """
+
+    def __init__(self, strategy: str = 'auto', max_pages: int = 80, max_bytes: int = 20 * 1024 * 1024,
+                 max_hit_pages: int = 15):
+        if strategy not in ('auto', *STRATEGIES):
+            raise ValueError(f"Unknown planner strategy {strategy}, expected auto, {FUSED} or {MULTI_STEP}")
+        self.strategy = strategy
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.max_hit_pages = max_hit_pages
+
+    def decide(self, features: DocumentFeatures) -> Plan:
+        if self.strategy != 'auto':
+            return Plan(self.strategy, 'configured', features)
+        if features.size_bytes > self.max_bytes:
+            return Plan(MULTI_STEP, 'size', features)
+        if features.pages is None:
+            return Plan(MULTI_STEP, 'unparsed', features)
+        if features.pages > self.max_pages:
+            return Plan(MULTI_STEP, 'pages', features)
+        if features.hit_pages > self.max_hit_pages:
+            return Plan(MULTI_STEP, 'metric_density', features)
+        return Plan(FUSED, 'within_limits', features)
+
+    def plan(self, pdf_path: str) -> Plan:
+        if self.strategy != 'auto':
+            # Forced strategies skip feature extraction entirely.
+            return Plan(self.strategy, 'configured', DocumentFeatures(os.path.getsize(pdf_path)))
+        return self.decide(DocumentFeatures.from_pdf(pdf_path))
+
+
+_default_planner = None
+_default_lock = threading.Lock()
+
+
+def get_planner() -> StepPlanner:
+    """
+    Process-wide planner built from config.yml.
+    """
+    global _default_planner
+    with _default_lock:
+        if _default_planner is None:
+            _default_planner = StepPlanner(config.PLANNER_STRATEGY,
+                                           max_pages=config.PLANNER_FUSED_MAX_PAGES,
+                                           max_bytes=int(config.PLANNER_FUSED_MAX_MB * 1024 * 1024),
+                                           max_hit_pages=config.PLANNER_FUSED_MAX_HIT_PAGES)
+        return _default_planner
@@ -0,0 +1,238 @@
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Any, Callable, List, Optional
+import threading
+import itertools
+import random
+import heapq
+import time
+
+
+# HTTP status codes worth retrying: quota exhaustion and transient server errors.
+RETRYABLE_CODES = {429, 500, 503, 504}
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    True for quota (429 / ResourceExhausted) and transient server errors.
+    """
+    code = getattr(error, 'code', None)
+    if callable(code):
+        # gRPC errors expose code() returning a StatusCode enum.
+        code = getattr(code(), 'name', None)
+        return code in ('RESOURCE_EXHAUSTED', 'UNAVAILABLE', 'DEADLINE_EXCEEDED')
+    return code in RETRYABLE_CODES
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Seconds the server asked us to wait, if the error carries a Retry-After hint.
+    """
+    value = getattr(error, 'retry_after', None)
+    if value is None:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        value = headers.get('Retry-After') if hasattr(headers, 'get') else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(contents: List[Any], system_instruction: Optional[List[Any]] = None) -> int:
+    """
+    Rough prompt token estimate used for budgeting before the real count is known.
+
+    Text is counted at ~4 characters per token; PDFs at 258 tokens per page, with the page
+    count read from the PDF bytes when possible. Parts referencing a file (UriPart) are
+    estimated from the page count or byte size recorded when the file was staged.
+    """
+    total = 0
+    for item in list(contents) + list(system_instruction or []):
+        if isinstance(item, str):
+            total += len(item) // 4 + 1
+            continue
+        # SDK parts wrap their bytes in `inline_data`; local BlobParts hold them directly.
+        blob = getattr(item, 'inline_data', None) or item
+        data = getattr(blob, 'data', None)
+        mime_type = getattr(blob, 'mime_type', '')
+        if data and mime_type == 'application/pdf':
+            pages = data.count(b'/Type /Page') - data.count(b'/Type /Pages')
+            total += 258 * (pages if pages > 0 else max(1, len(data) // 50000))
+        elif data:
+            total += len(data) // 4 + 1
+        elif getattr(item, 'pages', None):
+            total += 258 * item.pages
+        elif getattr(item, 'size', None) and mime_type == 'application/pdf':
+            total += 258 * max(1, item.size // 50000)
+        elif getattr(item, 'size', None):
+            total += item.size // 4 + 1
+        else:
+            total += 258
+    return total
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `rate_per_minute`.
+
+    Attributes:
+        capacity (float): Maximum number of tokens the bucket can hold (one minute of quota).
+        tokens (float): Currently available tokens; may go negative after usage corrections.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self._rate = rate_per_minute / 60.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until `amount` tokens are available (0 if they are available now).
+        """
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self._rate
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float) -> None:
+        """
+        Charge (positive) or refund (negative) tokens once the real usage is known.
+        """
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RequestScheduler:
+    """
+    Central gate for model calls enforcing requests-per-minute and tokens-per-minute quotas.
+
+    Callers wait in a priority queue (lower value runs first, FIFO within a priority) until
+    both buckets can admit them. Retryable failures are retried with jittered exponential
+    backoff, honouring Retry-After hints; a quota error also pauses every other caller so the
+    whole process backs off together instead of hammering the endpoint.
+
+    Attributes:
+        requests (TokenBucket): Requests-per-minute bucket.
+        tokens (TokenBucket): Tokens-per-minute bucket.
+        max_retries (int): Retries per call before the error is raised.
+        base_delay (float): First backoff delay in seconds.
+        max_delay (float): Cap on a single backoff delay in seconds.
+        retries (int): Total retries performed.
+        throttled (int): Total retryable errors seen.
+    """
+
+    def __init__(self, requests_per_minute: float = 60, tokens_per_minute: float = 4_000_000,
+                 max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.throttled = 0
+        self._paused_until = 0.0
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    def _acquire(self, estimated_tokens: int, priority: int) -> None:
+        ticket = (priority, next(self._counter))
+        with self._condition:
+            heapq.heappush(self._queue, ticket)
+            while True:
+                if self._queue[0] == ticket:
+                    now = time.monotonic()
+                    wait = max(self._paused_until - now,
+                               self.requests.wait_time(1, now),
+                               self.tokens.wait_time(estimated_tokens, now))
+                    if wait <= 0:
+                        self.requests.consume(1)
+                        self.tokens.consume(estimated_tokens)
+                        heapq.heappop(self._queue)
+                        self._condition.notify_all()
+                        return
+                    self._condition.wait(timeout=wait)
+                else:
+                    self._condition.wait()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        hinted = retry_after(error)
+        if hinted is not None:
+            return hinted
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        # Full jitter spreads retries from concurrent workers apart.
+        return random.uniform(0, delay)
+
+    def call(self, fn: Callable[[], Any], estimated_tokens: int = 0, priority: int = 0,
+             on_retry: Optional[Callable[[Exception], None]] = None) -> Any:
+        """
+        Run `fn` once admitted by the quotas, retrying retryable errors.
+
+        `on_retry` is called with the error before each retry.
+        """
+        attempt = 0
+        while True:
+            self._acquire(estimated_tokens, priority)
+            try:
+                return fn()
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                with self._condition:
+                    self.throttled += 1
+                    self.retries += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    self._condition.notify_all()
+                logger.warning("Retryable model error (%s); retry %s/%s in %.1fs", e, attempt + 1, self.max_retries, delay)
+                if on_retry is not None:
+                    on_retry(e)
+                attempt += 1
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """
+        Correct the token bucket with the real token count reported by the model.
+        """
+        if actual_tokens is None:
+            return
+        with self._condition:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {'retries': self.retries, 'throttled': self.throttled, 'waiting': len(self._queue)}
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """
+    Process-wide scheduler built from config.yml, shared by every model call.
+    """
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler(requests_per_minute=config.REQUESTS_PER_MINUTE,
+                                                  tokens_per_minute=config.TOKENS_PER_MINUTE,
+                                                  max_retries=config.MAX_RETRIES)
+        return _default_scheduler
+
+
+def set_scheduler(scheduler: RequestScheduler) -> None:
+    """
+    Replace the process-wide scheduler, e.g. with different quotas for a benchmark run.
+    """
+    global _default_scheduler
+    with _default_lock:
+        _default_scheduler = scheduler
@@ -0,0 +1,426 @@
+from src.generate import pipeline
+from src.generate import pipeline_adaptive
+from src.generate import pipeline_all_in_one
+from src.generate.backends import ModelBackend
+from src.generate.backends import get_backend
+from src.generate.engine import run_document
+from src.generate.engine import DocumentResult
+from src.generate.artifacts import ArtifactStore
+from src.generate.cache import response_cache_from_args
+from src.generate.cache import add_cache_arguments
+from src.generate.cache import ResponseCache
+from src.generate.manifest import RunManifest
+from src.generate.manifest import hash_file
+from src.generate.jsonl import jsonl_path
+from src.generate.metric_store import flush_metric_stores
+from src.generate.dedup import get_dedup_index
+from src.generate.dedup import fan_out
+from src.generate.scheduler import get_scheduler
+from src.generate.telemetry import get_telemetry
+from src.config.logging import logger
+from src.config.setup import config
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+import threading
+import argparse
+import sqlite3
+import signal
+import time
+import os
+
+
+PIPELINES = {'multi_step': pipeline, 'all_in_one': pipeline_all_in_one, 'adaptive': pipeline_adaptive}
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SUPERSEDED = 'superseded'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    doc_id TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    canonical TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    output_file TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (doc_id, sha256)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, not_before, created_at);
+"""
+
+
+class JobQueue:
+    """
+    Durable job table in SQLite: one row per (document, content hash).
+
+    A PDF is queued once per distinct content, so a file that was processed is never picked
+    up again, while a changed file (new hash) gets a new job and supersedes any of its
+    older jobs still pending. Jobs move pending -> running -> done, or back to pending with
+    exponential backoff until `max_attempts` failures, then failed. Jobs left running by a
+    crashed service are returned to pending when the next one starts.
+
+    Attributes:
+        path (str): SQLite database file.
+        max_attempts (int): Tries before a job is marked failed.
+        retry_delay (float): Backoff before the first retry, doubled on each further one.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3, retry_delay: float = 30.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # One connection shared by the scanner and the workers' completion callbacks.
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def _execute(self, sql: str, parameters: Tuple = ()) -> sqlite3.Cursor:
+        with self._lock, self._connection:
+            return self._connection.execute(sql, parameters)
+
+    def recover(self) -> int:
+        """
+        Return jobs interrupted by a crash or kill to pending; returns how many there were.
+        """
+        count = self._execute('UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?',
+                              (PENDING, time.time(), RUNNING)).rowcount
+        if count:
+            logger.info("Requeued %s jobs interrupted in a previous run", count)
+        return count
+
+    def sources(self) -> Dict[str, Tuple[int, int]]:
+        """
+        (size, mtime_ns) of the newest queued content of every document, so unchanged files
+        are recognized after a restart without hashing them.
+        """
+        rows = self._execute('SELECT doc_id, size, mtime_ns FROM jobs ORDER BY created_at').fetchall()
+        return {doc_id: (size, mtime_ns) for doc_id, size, mtime_ns in rows}
+
+    def enqueue(self, doc_id: str, sha256: str, size: int, mtime_ns: int, canonical: Optional[str] = None) -> bool:
+        """
+        Queue a document's content unless it was queued before. Returns True for a new job.
+        """
+        now = time.time()
+        with self._lock:
+            with self._connection:
+                cursor = self._connection.execute(
+                    'INSERT OR IGNORE INTO jobs (doc_id, sha256, size, mtime_ns, canonical, status, created_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (doc_id, sha256, size, mtime_ns, canonical or doc_id, PENDING, now, now))
+                if cursor.rowcount == 0:
+                    # Known content (e.g. a file touched or restored); only its stat changed.
+                    self._connection.execute('UPDATE jobs SET size = ?, mtime_ns = ? WHERE doc_id = ? AND sha256 = ?',
+                                             (size, mtime_ns, doc_id, sha256))
+                    return False
+                self._connection.execute(
+                    'UPDATE jobs SET status = ?, updated_at = ? WHERE doc_id = ? AND sha256 != ? AND status = ?',
+                    (SUPERSEDED, now, doc_id, sha256, PENDING))
+        return True
+
+    def requeue(self, doc_id: str, canonical: str) -> bool:
+        """
+        Reopen a document's newest job, e.g. a duplicate whose canonical document changed,
+        pointing it at its new canonical. Returns True when a job was reopened.
+        """
+        return self._execute(
+            'UPDATE jobs SET status = ?, attempts = 0, not_before = 0, canonical = ?, updated_at = ? '
+            'WHERE doc_id = ? AND status != ? AND created_at = (SELECT MAX(created_at) FROM jobs WHERE doc_id = ?)',
+            (PENDING, canonical, time.time(), doc_id, RUNNING, doc_id)).rowcount > 0
+
+    def claim(self, limit: int) -> List[Tuple[str, str]]:
+        """
+        Mark up to `limit` due jobs running, oldest first, and return their (doc_id, sha256).
+
+        Duplicates wait while their canonical document still has a pending or running job,
+        so they can reuse its output instead of being extracted again.
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        with self._lock:
+            with self._connection:
+                rows = self._connection.execute(
+                    'SELECT doc_id, sha256 FROM jobs WHERE status = ? AND not_before <= ? AND (canonical = doc_id OR '
+                    'canonical NOT IN (SELECT doc_id FROM jobs WHERE status IN (?, ?))) ORDER BY created_at LIMIT ?',
+                    (PENDING, now, PENDING, RUNNING, limit)).fetchall()
+                self._connection.executemany(
+                    'UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE doc_id = ? AND sha256 = ?',
+                    [(RUNNING, now, doc_id, sha256) for doc_id, sha256 in rows])
+        return rows
+
+    def complete(self, doc_id: str, sha256: str, output_file: Optional[str]) -> None:
+        self._execute('UPDATE jobs SET status = ?, output_file = ?, error = NULL, updated_at = ? '
+                      'WHERE doc_id = ? AND sha256 = ?', (DONE, output_file, time.time(), doc_id, sha256))
+
+    def fail(self, doc_id: str, sha256: str, error: str) -> str:
+        """
+        Record a failed attempt; the job is retried after a backoff until it runs out of
+        attempts. Returns the job's new status.
+        """
+        now = time.time()
+        with self._lock:
+            with self._connection:
+                (attempts,) = self._connection.execute('SELECT attempts FROM jobs WHERE doc_id = ? AND sha256 = ?',
+                                                       (doc_id, sha256)).fetchone()
+                status = FAILED if attempts >= self.max_attempts else PENDING
+                self._connection.execute(
+                    'UPDATE jobs SET status = ?, error = ?, not_before = ?, updated_at = ? WHERE doc_id = ? AND sha256 = ?',
+                    (status, error, now + self.retry_delay * 2 ** (attempts - 1), now, doc_id, sha256))
+        return status
+
+    def pending(self) -> int:
+        return self._execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (PENDING,)).fetchone()[0]
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self._execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class IngestionService:
+    """
+    Long-running extraction service: watches a PDF directory and feeds new or changed files
+    through a pipeline on a bounded pool of workers.
+
+    Each poll lists the directory and stats every PDF; only files whose size or mtime
+    changed are hashed (and registered with the dedup index when it is enabled) and queued.
+    Files modified less than `settle_seconds` ago are left for the next poll, since they
+    may still be being copied in. The job table is the queue, so nothing is lost on a
+    restart, and it provides the backpressure: at most `max_workers` jobs run at once, and
+    the scan stops queueing new files while `max_pending` jobs are waiting.
+
+    `stop()` (SIGINT / SIGTERM when run from the command line) stops the service from
+    claiming new jobs; the documents in progress are finished before `run` returns.
+
+    Attributes:
+        pipeline_name (str): multi_step, all_in_one or adaptive.
+        pdf_dir (str): Directory watched for `<doc_id>.pdf` files, the pipeline's PDF_DIR.
+        queue (JobQueue): Job table.
+        max_workers (int): Documents processed concurrently.
+        max_pending (int): Queued jobs above which new files wait on disk.
+        poll_interval (float): Seconds between directory scans.
+        settle_seconds (float): Minimum age of a file's last modification before it is queued.
+        telemetry_interval (float): Seconds between telemetry flushes to the exporters.
+    """
+
+    def __init__(self,
+                 pipeline_name: str,
+                 queue: JobQueue,
+                 backend: Optional[ModelBackend] = None,
+                 store: Optional[ArtifactStore] = None,
+                 cache: Optional[ResponseCache] = None,
+                 manifest: Optional[RunManifest] = None,
+                 max_workers: int = 4,
+                 max_pending: int = 100,
+                 poll_interval: float = 5.0,
+                 settle_seconds: float = 2.0,
+                 telemetry_interval: float = 60.0):
+        self.pipeline_name = pipeline_name
+        self.module = PIPELINES[pipeline_name]
+        self.pdf_dir = self.module.PDF_DIR
+        self.queue = queue
+        self.backend = backend
+        self.store = store
+        self.cache = cache
+        self.manifest = manifest
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.telemetry_interval = telemetry_interval
+        self._sources: Dict[str, Tuple[int, int]] = {}
+        # Files seen by the last scan that were modified too recently to queue.
+        self._settling = 0
+        self._running: Dict[Future, Tuple[str, str]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stopping = threading.Event()
+        # Set by the scan timer, finished jobs and stop(), so the loop never sleeps on work.
+        self._wake = threading.Event()
+
+    def stop(self) -> None:
+        if not self._stopping.is_set():
+            logger.info("Stopping: finishing %s documents in progress", len(self._running))
+        self._stopping.set()
+        self._wake.set()
+
+    def scan(self) -> int:
+        """
+        Queue new and changed PDFs, handing each new job to an idle worker right away, so
+        a long scan (hashing a large backlog) does not hold up extraction. Returns the
+        number of new jobs.
+        """
+        dedup_index = get_dedup_index()
+        now_ns = time.time_ns()
+        queued = 0
+        self._settling = 0
+        with os.scandir(self.pdf_dir) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                if not entry.name.endswith('.pdf'):
+                    continue
+                doc_id = entry.name[:-len('.pdf')]
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    source = (stat.st_size, stat.st_mtime_ns)
+                    if self._sources.get(doc_id) == source:
+                        continue
+                    if now_ns - stat.st_mtime_ns < self.settle_seconds * 1e9:
+                        self._settling += 1
+                        continue
+                    if self._stopping.is_set():
+                        break
+                    if self.queue.pending() >= self.max_pending:
+                        logger.info("Backpressure: %s jobs pending, leaving new files for a later scan", self.max_pending)
+                        break
+                    if dedup_index is not None:
+                        fingerprint = dedup_index.register(doc_id, entry.path)
+                        sha256, canonical = fingerprint['sha256'], fingerprint['canonical']
+                    else:
+                        sha256, canonical = hash_file(entry.path), doc_id
+                    if self.queue.enqueue(doc_id, sha256, *source, canonical=canonical):
+                        logger.info("Queued %s", doc_id)
+                        queued += 1
+                        self.dispatch()
+                except Exception as e:
+                    # Removed, unreadable or half-written: left unrecorded, so the next scan retries it.
+                    logger.warning("Could not queue %s, retrying on the next scan: %s", entry.path, e)
+                    get_telemetry().count('scan_errors')
+                    continue
+                self._sources[doc_id] = source
+        if dedup_index is not None:
+            # Near duplicates of a file that changed need an extraction of their own.
+            for doc_id in dedup_index.pop_repointed():
+                if self.queue.requeue(doc_id, dedup_index.documents[doc_id]['canonical']):
+                    logger.info("Requeued %s, the document it duplicated changed", doc_id)
+                    queued += 1
+                    self.dispatch()
+        if queued:
+            get_telemetry().count('jobs_queued', queued)
+        return queued
+
+    def process(self, doc_id: str) -> str:
+        """
+        Extract one document, or copy its canonical document's output when it is a duplicate
+        whose original was already extracted.
+        """
+        dedup_index = get_dedup_index()
+        if dedup_index is not None:
+            canonical = dedup_index.documents.get(doc_id, {}).get('canonical', doc_id)
+            canonical_file = jsonl_path(self.module.GEN_DIR, canonical, config.OUTPUT_COMPRESSION)
+            if canonical != doc_id and os.path.exists(canonical_file):
+                fan_out(canonical_file, [doc_id], self.module.GEN_DIR, self.manifest, self.pdf_dir)
+                return jsonl_path(self.module.GEN_DIR, doc_id, config.OUTPUT_COMPRESSION)
+        return self.module.process_document(doc_id, self.backend, self.store, self.cache, self.manifest)
+
+    def dispatch(self) -> None:
+        """
+        Claim due jobs for the idle workers.
+        """
+        if self._executor is None or self._stopping.is_set():
+            return
+        for doc_id, sha256 in self.queue.claim(self.max_workers - len(self._running)):
+            future = self._executor.submit(run_document, doc_id, self.process)
+            self._running[future] = (doc_id, sha256)
+            # Runs immediately if the document already finished.
+            future.add_done_callback(self._finished)
+
+    def _finished(self, future: Future) -> None:
+        doc_id, sha256 = self._running.pop(future)
+        result: DocumentResult = future.result()
+        if result.ok:
+            self.queue.complete(doc_id, sha256, result.output)
+            get_telemetry().count('jobs_finished', status=DONE)
+        else:
+            status = self.queue.fail(doc_id, sha256, str(result.error))
+            get_telemetry().count('jobs_finished', status=status)
+            if status == FAILED:
+                logger.error("Giving up on %s after %s attempts", doc_id, self.queue.max_attempts)
+        self._wake.set()
+
+    def run(self, once: bool = False) -> Dict[str, int]:
+        """
+        Scan and process until stopped, or with `once` until every file present at the
+        start (and queued jobs that are due) has been processed, waiting for files that are
+        still being written. Returns the job counts.
+        """
+        self.backend = self.backend or get_backend()
+        self.module.warm_backend(self.backend, list(self.module.PROMPTS))
+        self.queue.recover()
+        self._sources = self.queue.sources()
+        logger.info("Watching %s with %s workers (%s pipeline)", self.pdf_dir, self.max_workers, self.pipeline_name)
+        next_scan = 0.0
+        next_flush = time.monotonic() + self.telemetry_interval
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="extract") as self._executor:
+            while not self._stopping.is_set():
+                self._wake.clear()
+                # With `once`, an idle service rescans immediately: files left behind by
+                # backpressure are queued now, and a scan finding nothing ends the run. Files
+                # still settling are waited for on the regular poll.
+                scanned = time.monotonic() >= next_scan or (once and not self._running and not self._settling)
+                queued = self.scan() if scanned else 0
+                if scanned:
+                    next_scan = time.monotonic() + self.poll_interval
+                self.dispatch()
+                if once and scanned and not queued and not self._running and not self._settling:
+                    break
+                if time.monotonic() >= next_flush:
+                    # Exported metrics stay current while the service runs for days.
+                    get_telemetry().flush()
+                    next_flush = time.monotonic() + self.telemetry_interval
+                self._wake.wait(max(0.0, min(next_scan, next_flush) - time.monotonic()))
+            # Leaving the executor waits for the documents in progress.
+        self._executor = None
+        self.backend.release()
+        flush_metric_stores()
+        if self.cache is not None:
+            logger.info("Response cache stats: %s", self.cache.stats())
+        logger.info("Scheduler stats: %s", get_scheduler().stats())
+        get_telemetry().flush()
+        counts = self.queue.counts()
+        logger.info("Ingestion service stopped, jobs: %s", counts)
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch the PDF directory and extract new or changed files.")
+    parser.add_argument('--pipeline', choices=sorted(PIPELINES), default=config.SERVICE_PIPELINE)
+    parser.add_argument('--workers', type=int, default=config.MAX_WORKERS)
+    parser.add_argument('--once', action='store_true', help="Process what is there and exit")
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+
+    module = PIPELINES[args.pipeline]
+    queue = JobQueue(config.SERVICE_DB, config.SERVICE_MAX_ATTEMPTS, config.SERVICE_RETRY_DELAY)
+    service = IngestionService(args.pipeline, queue,
+                               store=ArtifactStore(module.OUTPUT_DIR),
+                               cache=response_cache_from_args(args),
+                               manifest=RunManifest(os.path.join(module.OUTPUT_DIR, 'manifest.jsonl')),
+                               max_workers=args.workers,
+                               max_pending=config.SERVICE_MAX_PENDING,
+                               poll_interval=config.SERVICE_POLL_INTERVAL,
+                               settle_seconds=config.SERVICE_SETTLE_SECONDS,
+                               telemetry_interval=config.SERVICE_TELEMETRY_INTERVAL)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: service.stop())
+    try:
+        service.run(once=args.once)
+    finally:
+        queue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+from src.generate.manifest import hash_file
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Any, Dict, Iterable, List, Optional
+import threading
+import io
+
+
+class PdfStager:
+    """
+    Uploads each PDF to Cloud Storage once and hands out its `gs://` URI.
+
+    Objects are named by the SHA-256 of their bytes, so a changed file gets a new URI (keeping
+    response-cache keys honest) and byte-identical PDFs share one upload.
+
+    Attributes:
+        bucket (str): Bucket the PDFs are staged in.
+        prefix (str): Object prefix for staged PDFs.
+        uploads (int): Number of PDFs actually uploaded by this stager.
+    """
+
+    def __init__(self, bucket: Optional[str] = None, prefix: str = 'staged'):
+        self.bucket = bucket or config.BUCKET
+        self.prefix = prefix
+        self.uploads = 0
+        self._client = None
+        self._staged: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self):
+        with self._lock:
+            if self._client is None:
+                from google.cloud import storage
+                self._client = storage.Client(project=config.PROJECT_ID)
+            return self._client.bucket(self.bucket)
+
+    def stage(self, pdf_path: str) -> str:
+        """
+        Make sure the PDF exists in the bucket and return its URI.
+        """
+        digest = hash_file(pdf_path)
+        with self._lock:
+            if digest in self._staged:
+                return self._staged[digest]
+        blob_name = f'{self.prefix}/{digest}.pdf'
+        blob = self._bucket().blob(blob_name)
+        if not blob.exists():
+            logger.info("Uploading %s to gs://%s/%s", pdf_path, self.bucket, blob_name)
+            blob.upload_from_filename(pdf_path, content_type='application/pdf')
+            with self._lock:
+                self.uploads += 1
+        uri = f'gs://{self.bucket}/{blob_name}'
+        with self._lock:
+            self._staged[digest] = uri
+        return uri
+
+
+_default_stager = None
+_default_lock = threading.Lock()
+
+
+def get_stager() -> PdfStager:
+    """
+    Process-wide stager, so each PDF is uploaded at most once per run.
+    """
+    global _default_stager
+    with _default_lock:
+        if _default_stager is None:
+            _default_stager = PdfStager(prefix=config.STAGING_PREFIX)
+        return _default_stager
+
+
+def count_pages(pdf_bytes: bytes) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+
+def pages_for_metrics(metrics: Iterable[Dict[str, Any]], total_pages: int, neighbours: int = 1) -> List[int]:
+    """
+    Collect the 1-based pages referenced by `page_number` in the metrics, plus `neighbours`
+    pages on each side to absorb printed-label vs physical page offsets.
+    """
+    pages = set()
+    for metric in metrics:
+        try:
+            page = int(float(metric.get('page_number')))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= page <= total_pages:
+            pages.update(range(max(1, page - neighbours), min(total_pages, page + neighbours) + 1))
+    return sorted(pages)
+
+
+def slice_pdf(pdf_bytes: bytes, pages: List[int]) -> bytes:
+    """
+    Build a new PDF containing only the given 1-based pages, in order.
+    """
+    from pypdf import PdfReader, PdfWriter
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    writer = PdfWriter()
+    for page in pages:
+        writer.add_page(reader.pages[page - 1])
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
@@ -0,0 +1,49 @@
+from typing import Any, Optional
+
+
+# Energy metric codes, as listed in data/templates/system_instructions_step_1.txt. Codes are
+# kept as strings because the model returns "429" / "RE001" while the expected data stores
+# numeric codes as integers; use normalize_code() before looking anything up.
+TOTAL_ENERGY = '429'
+TOTAL_RENEWABLE = '432'
+TOTAL_NON_RENEWABLE = '711'
+SHARE_NON_RENEWABLE = '817'
+SHARE_RENEWABLE = '819'
+TOTAL_ELECTRICITY = '1701'
+RENEWABLE_ELECTRICITY = '1702'
+
+TOTAL_CODES = frozenset({TOTAL_ENERGY, TOTAL_RENEWABLE, TOTAL_NON_RENEWABLE})
+SHARE_CODES = frozenset({SHARE_NON_RENEWABLE, SHARE_RENEWABLE})
+ELECTRICITY_CODES = frozenset({TOTAL_ELECTRICITY, RENEWABLE_ELECTRICITY})
+
+# Components summed into TREC when code 432 is not reported directly.
+RENEWABLE_CODES = frozenset({
+    '772', '773', '774', '775', '776', '777', '778', '779', '780', '781', '848', '849',
+    'RE001', 'RE002', 'RE003', 'RE004', 'RE005', 'RE015',
+})
+
+# Components summed into TNREC when code 711 is not reported directly.
+NON_RENEWABLE_CODES = frozenset({'783', '785', '786', '787', '789', 'NRE005', 'TBD'})
+
+# Fuel families used to pick a heating value for volume and mass units.
+LIQUID_FUEL_CODES = frozenset({'789', 'NRE005', 'RE001'})
+GAS_FUEL_CODES = frozenset({'787'})
+BIOGAS_CODES = frozenset({'779', '780', '781'})
+COAL_CODES = frozenset({'783'})
+SOLID_BIOMASS_CODES = frozenset({'RE002', 'RE003'})
+
+KNOWN_CODES = TOTAL_CODES | SHARE_CODES | ELECTRICITY_CODES | RENEWABLE_CODES | NON_RENEWABLE_CODES
+
+
+def normalize_code(code: Any) -> Optional[str]:
+    """
+    Return a code as a canonical string: 429, 429.0 and "429" all become "429".
+    """
+    if code is None:
+        return None
+    if isinstance(code, float) and code.is_integer():
+        code = int(code)
+    code = str(code).strip()
+    if code.endswith('.0') and code[:-2].isdigit():
+        code = code[:-2]
+    return code or None
@@ -0,0 +1,481 @@
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import itertools
+import threading
+import atexit
+import bisect
+import queue
+import uuid
+import json
+import time
+import os
+
+
+# Attributes that become metric labels; everything else (doc_id, tokens, ...) stays on spans
+# only, which keeps Prometheus series bounded.
+METRIC_LABELS = ('step', 'model', 'status', 'strategy', 'reason')
+
+# Histogram buckets in seconds for exported latency metrics.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+current_document: ContextVar[Optional[str]] = ContextVar('current_document', default=None)
+
+
+@contextmanager
+def document_context(doc_id: str) -> Iterator[None]:
+    """
+    Attribute every span and metric recorded inside the block to `doc_id`.
+    """
+    token = current_document.set(doc_id)
+    try:
+        yield
+    finally:
+        current_document.reset(token)
+
+
+class Span:
+    """
+    A timed unit of work (document, step or model call).
+
+    Attributes:
+        name (str): Span kind, e.g. "document", "step" or "model_call".
+        attributes (Dict[str, Any]): Labels and measurements attached to the span.
+        start (float): Wall-clock start time (epoch seconds).
+        duration (Optional[float]): Seconds the span lasted, set when it ends.
+        status (str): "ok" or "error".
+    """
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.status = 'ok'
+        self._started = time.perf_counter()
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def add(self, name: str, value: float = 1) -> None:
+        self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'type': 'span', 'name': self.name, 'start': self.start, 'duration': self.duration,
+                'status': self.status, **self.attributes}
+
+
+class Histogram:
+    """
+    Observation counts per `LATENCY_BUCKETS` bucket, so memory stays constant however long
+    the process runs. Not thread-safe; the owner holds a lock.
+
+    Attributes:
+        counts (List[int]): Observations per bucket, the last one above every bound.
+        count (int): Number of observations.
+        sum (float): Sum of the observations.
+        max (Optional[float]): Largest observation.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def copy(self) -> 'Histogram':
+        histogram = Histogram()
+        histogram.counts, histogram.count, histogram.sum, histogram.max = list(self.counts), self.count, self.sum, self.max
+        return histogram
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile by interpolating within its bucket, like Prometheus'
+        histogram_quantile; bounded by the largest observation.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+                upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / count)
+            seen += count
+        return self.max
+
+
+class MetricRegistry:
+    """
+    Thread-safe counters and histograms keyed by name and label values.
+    """
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items() if key in METRIC_LABELS and value is not None))
+
+    def count(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self.histograms.setdefault(key, Histogram()).observe(value)
+
+    def total(self, name: str) -> float:
+        """
+        Sum of a counter over all label values.
+        """
+        with self._lock:
+            return sum(value for (counter, _), value in self.counters.items() if counter == name)
+
+
+class Exporter:
+    """
+    Receives finished spans as they end and the full metric registry on flush.
+    """
+
+    def export_span(self, span: Span, run_id: str) -> None:
+        pass
+
+    def flush(self, registry: MetricRegistry, summary: Dict[str, Any], run_id: str) -> None:
+        pass
+
+
+class JsonlExporter(Exporter):
+    """
+    Appends one JSON line per span, and the run summary on flush, to `path`.
+
+    Spans are only copied on the request path; a background thread serializes them and
+    appends whatever has queued up in one write, like the log listener in
+    src/config/logging.py. `flush` returns once everything queued before it is on disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._registered = False
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def _put(self, item: Any) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='telemetry-writer', daemon=True)
+                self._thread.start()
+                if not self._registered:
+                    # Write out what is still queued when the interpreter exits.
+                    atexit.register(self.close)
+                    self._registered = True
+        self._queue.put(item)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [item for item in batch if isinstance(item, dict)]
+            if records:
+                try:
+                    with open(self.path, 'a') as file:
+                        file.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+                except OSError as e:
+                    logger.warning("Could not write %s telemetry records to %s: %s", len(records), self.path, e)
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if any(item is None for item in batch):
+                return
+
+    def export_span(self, span: Span, run_id: str) -> None:
+        self._put({'run_id': run_id, **span.to_dict()})
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every record queued so far is written; False if `timeout` ran out first.
+        """
+        written = threading.Event()
+        self._put(written)
+        return written.wait(timeout)
+
+    def flush(self, registry: MetricRegistry, summary: Dict[str, Any], run_id: str) -> None:
+        self._put({'run_id': run_id, 'type': 'summary', **summary})
+        self.wait()
+
+    def close(self) -> None:
+        """
+        Write what is queued and stop the writer thread.
+        """
+        with self._lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+
+def _prometheus_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = [f'{key}="{value}"' for key, value in labels + extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class PrometheusExporter(Exporter):
+    """
+    Writes counters and histograms in the Prometheus text format on flush, e.g. for the node
+    exporter's textfile collector. The file is replaced atomically.
+    """
+
+    def __init__(self, path: str, prefix: str = 'extract'):
+        self.path = path
+        self.prefix = prefix
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def flush(self, registry: MetricRegistry, summary: Dict[str, Any], run_id: str) -> None:
+        lines = []
+        with registry._lock:
+            counters = dict(registry.counters)
+            histograms = {key: histogram.copy() for key, histogram in registry.histograms.items()}
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f'# TYPE {self.prefix}_{name}_total counter')
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{self.prefix}_{name}_total{_prometheus_labels(labels)} {value}')
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f'# TYPE {self.prefix}_{name} histogram')
+            for (metric, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                for bound, cumulative in zip(LATENCY_BUCKETS, itertools.accumulate(histogram.counts)):
+                    lines.append(f'{self.prefix}_{name}_bucket{_prometheus_labels(labels, (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{self.prefix}_{name}_bucket{_prometheus_labels(labels, (("le", "+Inf"),))} {histogram.count}')
+                lines.append(f'{self.prefix}_{name}_sum{_prometheus_labels(labels)} {histogram.sum}')
+                lines.append(f'{self.prefix}_{name}_count{_prometheus_labels(labels)} {histogram.count}')
+
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
+
+
+class OpenTelemetryExporter(Exporter):
+    """
+    Forwards spans and latency histograms to the OpenTelemetry API.
+
+    Only the API is used; providers and exporters are configured by the application (or the
+    OTEL_* environment variables), so without an SDK this is a no-op.
+    """
+
+    def __init__(self, service_name: str = 'document-extractor'):
+        from opentelemetry import metrics, trace
+        self._tracer = trace.get_tracer(service_name)
+        self._meter = metrics.get_meter(service_name)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, name: str):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = self._meter.create_histogram(f'{name}_seconds', unit='s')
+            return self._histograms[name]
+
+    def export_span(self, span: Span, run_id: str) -> None:
+        attributes = {key: value for key, value in span.attributes.items() if isinstance(value, (str, bool, int, float))}
+        start_ns = int(span.start * 1e9)
+        otel_span = self._tracer.start_span(span.name, start_time=start_ns, attributes={'run_id': run_id, **attributes})
+        if span.status == 'error':
+            from opentelemetry.trace import Status, StatusCode
+            otel_span.set_status(Status(StatusCode.ERROR))
+        otel_span.end(end_time=start_ns + int((span.duration or 0) * 1e9))
+        self._histogram(span.name).record(span.duration or 0,
+                                          {key: str(value) for key, value in span.attributes.items() if key in METRIC_LABELS})
+
+
+class Telemetry:
+    """
+    Collects spans, counters and histograms for one pipeline run and fans them out to exporters.
+
+    Spans record their duration as the `<name>_seconds` histogram, labelled by step, model
+    and status; per-document detail is kept on the spans themselves. Finished spans are
+    handed to the exporters and folded into the run summary's totals, not kept, so a
+    long-running service uses constant memory.
+
+    Attributes:
+        run_id (str): Identifier attached to every exported record.
+        registry (MetricRegistry): Counters and histograms.
+        exporters (List[Exporter]): Destinations for spans and metrics.
+    """
+
+    def __init__(self, exporters: Optional[List[Exporter]] = None):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.registry = MetricRegistry()
+        self.exporters = exporters or []
+        self._steps: Dict[str, Dict[str, Any]] = {}
+        self._documents = {'documents': 0, 'failed_documents': 0, 'latency': Histogram()}
+        self._strategies: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        doc_id = current_document.get()
+        if doc_id is not None:
+            attributes.setdefault('doc_id', doc_id)
+        span = Span(name, attributes)
+        try:
+            yield span
+        except BaseException:
+            span.status = 'error'
+            raise
+        finally:
+            span.duration = time.perf_counter() - span._started
+            self.registry.observe(f'{name}_seconds', span.duration, **{**span.attributes, 'status': span.status})
+            with self._lock:
+                self._aggregate(span)
+            for exporter in self.exporters:
+                try:
+                    exporter.export_span(span, self.run_id)
+                except Exception as e:
+                    logger.warning("Telemetry exporter %s failed: %s", type(exporter).__name__, e)
+
+    def _aggregate(self, span: Span) -> None:
+        # Caller holds the lock. Adds a finished span to the totals reported by `summary`.
+        attributes = span.attributes
+        if span.name == 'model_call' and attributes.get('step') is not None:
+            step = self._steps.setdefault(attributes['step'], {
+                'calls': 0, 'errors': 0, 'cache_hits': 0, 'retries': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                'cached_tokens': 0, 'request_bytes': 0, 'cost_usd': 0.0, 'latency': Histogram()})
+            step['calls'] += 1
+            step['errors'] += span.status == 'error'
+            for key in ('retries', 'prompt_tokens', 'completion_tokens', 'cached_tokens', 'request_bytes', 'cost_usd'):
+                step[key] += attributes.get(key, 0)
+            if attributes.get('cache') == 'hit':
+                step['cache_hits'] += 1
+            else:
+                step['latency'].observe(span.duration)
+        elif span.name == 'document':
+            self._documents['documents'] += 1
+            self._documents['failed_documents'] += span.status == 'error'
+            self._documents['latency'].observe(span.duration)
+        elif span.name == 'plan' and span.status == 'ok':
+            self._strategies[attributes['strategy']] = self._strategies.get(attributes['strategy'], 0) + 1
+
+    def count(self, name: str, value: float = 1, **labels: Any) -> None:
+        self.registry.count(name, value, **labels)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Per-step and per-run totals of the spans finished so far. Latency percentiles are
+        estimated from histogram buckets.
+        """
+
+        def latency(histogram: Histogram) -> Dict[str, Optional[float]]:
+            return {'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95), 'p99': histogram.quantile(0.99),
+                    'max': histogram.max}
+
+        with self._lock:
+            steps = {step: {**{key: value for key, value in totals.items() if key != 'latency'},
+                            'cost_usd': round(totals['cost_usd'], 6),
+                            'latency_s': latency(totals['latency'])}
+                     for step, totals in sorted(self._steps.items())}
+            summary = {
+                'documents': self._documents['documents'],
+                'failed_documents': self._documents['failed_documents'],
+                'document_latency_s': latency(self._documents['latency']),
+                'steps': steps,
+                'cost_usd': round(sum(step['cost_usd'] for step in steps.values()), 6),
+                'tokens': sum(step['prompt_tokens'] + step['completion_tokens'] for step in steps.values()),
+            }
+            if self._strategies:
+                summary['plans'] = {'strategies': dict(self._strategies),
+                                    'fallbacks': int(self.registry.total('plan_fallbacks'))}
+        return summary
+
+    def flush(self) -> Dict[str, Any]:
+        """
+        Hand the registry and run summary to every exporter, log the summary and return it.
+        Can be called repeatedly, e.g. periodically by a long-running service.
+        """
+        summary = self.summary()
+        for exporter in self.exporters:
+            try:
+                exporter.flush(self.registry, summary, self.run_id)
+            except Exception as e:
+                logger.warning("Telemetry exporter %s failed: %s", type(exporter).__name__, e)
+        logger.info("Run summary %s: %s", self.run_id, json.dumps(summary))
+        return summary
+
+
+def model_cost(prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """
+    Estimated USD cost of a call from the per-1k-token prices in config.yml.
+
+    `cached_tokens` are the part of `prompt_tokens` served from a context cache, billed at
+    the cached-token price instead of the prompt price.
+    """
+    return ((prompt_tokens - cached_tokens) * config.PROMPT_COST_PER_1K_TOKENS
+            + cached_tokens * config.CACHED_COST_PER_1K_TOKENS
+            + completion_tokens * config.COMPLETION_COST_PER_1K_TOKENS) / 1000
+
+
+def create_exporters(names: List[str], directory: str) -> List[Exporter]:
+    """
+    Build exporters by name: `jsonl`, `prometheus` or `otel`. Unavailable exporters are skipped.
+    """
+    exporters = []
+    for name in names:
+        if name == 'jsonl':
+            exporters.append(JsonlExporter(os.path.join(directory, 'telemetry.jsonl')))
+        elif name == 'prometheus':
+            exporters.append(PrometheusExporter(os.path.join(directory, 'metrics.prom')))
+        elif name == 'otel':
+            try:
+                exporters.append(OpenTelemetryExporter())
+            except ImportError:
+                logger.warning("opentelemetry is not installed; the otel telemetry exporter is disabled")
+        else:
+            raise ValueError(f"Unknown telemetry exporter {name}, expected jsonl, prometheus or otel")
+    return exporters
+
+
+_default_telemetry = None
+_default_lock = threading.Lock()
+
+
+def get_telemetry() -> Telemetry:
+    """
+    Process-wide telemetry with the exporters configured in config.yml.
+    """
+    global _default_telemetry
+    with _default_lock:
+        if _default_telemetry is None:
+            _default_telemetry = Telemetry(create_exporters(config.TELEMETRY_EXPORTERS, config.TELEMETRY_DIR))
+        return _default_telemetry
+
+
+def set_telemetry(telemetry: Telemetry) -> None:
+    """
+    Replace the process-wide telemetry, e.g. to collect a separate run in a benchmark.
+    """
+    global _default_telemetry
+    with _default_lock:
+        _default_telemetry = telemetry
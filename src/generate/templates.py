@@ -0,0 +1,210 @@
+from src.generate.manifest import combine_hashes
+from src.generate.manifest import hash_json
+from src.generate.validation import SchemaValidator
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+import argparse
+import hashlib
+import json
+import time
+import re
+import os
+
+
+TEMPLATE_DIR = './data/templates'
+
+# Prompt name -> (system instruction file, response schema file), relative to the template dir.
+PROMPTS = {
+    'step_1': ('system_instructions_step_1.txt', 'response_schemas/step_1.json'),
+    'step_2': ('system_instructions_step_2.txt', 'response_schemas/step_2.json'),
+    'step_3': ('system_instructions_step_3.txt', 'response_schemas/step_3.json'),
+    'all_in_one': ('system_instructions.txt', 'response_schemas/all_in_one.json'),
+}
+
+# Types accepted by the structured-output API.
+SCHEMA_TYPES = {'object', 'array', 'string', 'number', 'integer', 'boolean'}
+
+
+class TemplateError(ValueError):
+    """
+    Raised when a system instruction or response schema is missing or invalid.
+    """
+
+
+def validate_schema(schema: Any, path: str = '$') -> None:
+    """
+    Check that a response schema only uses what structured output supports.
+
+    Raises TemplateError naming the offending location, e.g. `$.items.properties.code`.
+    """
+    if not isinstance(schema, dict):
+        raise TemplateError(f"{path}: schema must be an object")
+    schema_type = schema.get('type')
+    if schema_type not in SCHEMA_TYPES:
+        raise TemplateError(f"{path}: unsupported type {schema_type!r}")
+    if 'pattern' in schema:
+        try:
+            re.compile(schema['pattern'])
+        except (re.error, TypeError) as e:
+            raise TemplateError(f"{path}: invalid pattern {schema['pattern']!r}: {e}")
+    for bound in ('minimum', 'maximum'):
+        if bound in schema and not isinstance(schema[bound], (int, float)):
+            raise TemplateError(f"{path}: {bound} must be a number")
+
+    if schema_type == 'array':
+        if 'items' not in schema:
+            raise TemplateError(f"{path}: array schema needs items")
+        validate_schema(schema['items'], f'{path}.items')
+    elif schema_type == 'object':
+        properties = schema.get('properties', {})
+        if not isinstance(properties, dict):
+            raise TemplateError(f"{path}: properties must be an object")
+        for name, prop in properties.items():
+            validate_schema(prop, f'{path}.properties.{name}')
+        missing = [name for name in schema.get('required', []) if name not in properties]
+        if missing:
+            raise TemplateError(f"{path}: required fields {missing} are not defined in properties")
+
+
+class Prompt:
+    """
+    One validated (system instruction, response schema) pair.
+
+    Attributes:
+        name (str): Registry name, e.g. `step_2`.
+        system_instruction (str): System instruction text.
+        response_schema (Dict[str, Any]): Response schema.
+        version (str): Content hash of both; changes whenever either file's content does.
+        validator (SchemaValidator): The response schema compiled for checking outputs.
+        stamps (Tuple): (mtime_ns, size) of the source files when they were loaded.
+    """
+
+    def __init__(self, name: str, system_instruction: str, response_schema: Dict[str, Any], stamps: Tuple = ()):
+        self.name = name
+        self.system_instruction = system_instruction
+        self.response_schema = response_schema
+        self.version = combine_hashes(hashlib.sha256(system_instruction.encode('utf-8')).hexdigest(),
+                                      hash_json(response_schema))
+        self.validator = SchemaValidator(response_schema)
+        self.stamps = stamps
+
+
+class TemplateRegistry:
+    """
+    Loads each prompt once and serves it from memory to every document and thread.
+
+    Source files are re-checked at most every `reload_interval` seconds (never when None);
+    a changed file is re-read and re-validated, and an invalid edit keeps the previous
+    version in service rather than failing in-flight documents.
+
+    Attributes:
+        template_dir (str): Directory the prompt files are resolved against.
+        prompts (Dict[str, Tuple[str, str]]): Prompt name -> (instruction file, schema file).
+        reload_interval (Optional[float]): Seconds between file change checks.
+    """
+
+    def __init__(self, template_dir: str = TEMPLATE_DIR, prompts: Optional[Dict[str, Tuple[str, str]]] = None,
+                 reload_interval: Optional[float] = 1.0):
+        self.template_dir = template_dir
+        self.prompts = dict(PROMPTS if prompts is None else prompts)
+        self.reload_interval = reload_interval
+        self._loaded: Dict[str, Prompt] = {}
+        self._checked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _paths(self, name: str) -> List[str]:
+        if name not in self.prompts:
+            raise TemplateError(f"Unknown prompt {name}, expected one of {sorted(self.prompts)}")
+        return [os.path.join(self.template_dir, file_name) for file_name in self.prompts[name]]
+
+    def _stamps(self, name: str) -> Tuple:
+        stamps = []
+        for path in self._paths(name):
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                raise TemplateError(f"Prompt {name}: cannot read {path}: {e}")
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamps)
+
+    def _load(self, name: str, stamps: Tuple) -> Prompt:
+        instructions_path, schema_path = self._paths(name)
+        with open(instructions_path, 'r', encoding='utf-8') as file:
+            system_instruction = file.read()
+        if not system_instruction.strip():
+            raise TemplateError(f"Prompt {name}: {instructions_path} is empty")
+        try:
+            with open(schema_path, 'r', encoding='utf-8') as file:
+                response_schema = json.load(file)
+        except json.JSONDecodeError as e:
+            raise TemplateError(f"Prompt {name}: {schema_path} is not valid JSON: {e}")
+        validate_schema(response_schema)
+        return Prompt(name, system_instruction, response_schema, stamps)
+
+    def get(self, name: str) -> Prompt:
+        """
+        Return the current version of a prompt, loading or reloading it if needed.
+        """
+        prompt = self._loaded.get(name)
+        now = time.monotonic()
+        if prompt is not None and (self.reload_interval is None or now - self._checked[name] < self.reload_interval):
+            return prompt
+
+        with self._lock:
+            prompt = self._loaded.get(name)
+            if prompt is not None and now - self._checked[name] < (self.reload_interval or 0):
+                return prompt
+            self._checked[name] = now
+            try:
+                stamps = self._stamps(name)
+                if prompt is not None and stamps == prompt.stamps:
+                    return prompt
+                loaded = self._load(name, stamps)
+            except TemplateError as e:
+                if prompt is None:
+                    raise
+                logger.error("Keeping version %s of prompt %s: %s", prompt.version[:12], name, e)
+                return prompt
+            self._loaded[name] = loaded
+            logger.info("Loaded prompt %s version %s", name, loaded.version[:12])
+            return loaded
+
+    def load_all(self) -> Dict[str, Prompt]:
+        """
+        Load and validate every registered prompt, raising on the first invalid one.
+        """
+        return {name: self.get(name) for name in self.prompts}
+
+
+_default_registry = None
+_default_lock = threading.Lock()
+
+
+def get_registry() -> TemplateRegistry:
+    """
+    Process-wide template registry shared by both pipelines and batch prediction.
+    """
+    global _default_registry
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = TemplateRegistry(reload_interval=config.TEMPLATE_RELOAD_INTERVAL)
+        return _default_registry
+
+
+def get_prompt(name: str) -> Prompt:
+    return get_registry().get(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the prompt templates and print their versions.")
+    parser.add_argument('--templates', default=TEMPLATE_DIR, help="Template directory")
+    args = parser.parse_args()
+
+    for name, prompt in TemplateRegistry(args.templates).load_all().items():
+        print(f"{name}: {prompt.version[:12]}")
+
+
+if __name__ == '__main__':
+    main()
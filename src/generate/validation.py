@@ -0,0 +1,254 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import math
+import re
+
+
+# Strings the model uses for "not reported"; they become real nulls.
+NULL_STRINGS = frozenset({'', 'null', 'none', 'n/a', 'nan'})
+
+# Fields a record is meaningless without; every other field may be null ("not reported").
+NON_NULL_FIELDS = frozenset({'code'})
+
+# Fields whose characters carry meaning (a decimal point, a sign, "%" or "³"); a value that
+# violates the pattern is only whitespace-normalized, never rewritten, and otherwise fails.
+VERBATIM_FIELDS = frozenset({'value', 'unit'})
+
+# `^<class or .>{min,max}$`, the shape of every pattern in the response schemas.
+_BOUNDED_PATTERN = re.compile(r'^\^(\[[^\]^][^\]]*\]|\.)\{(\d+),(\d+)\}\$$')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class Report:
+    """
+    Problems found while checking one value.
+
+    Attributes:
+        errors (List[str]): Violations that could not be repaired, as `<path>: <message>`.
+        repairs (int): Values changed to satisfy the schema (whitespace collapsed, text
+            shortened, missing fields filled with null).
+    """
+
+    def __init__(self):
+        self.errors: List[str] = []
+        self.repairs = 0
+
+
+Checker = Callable[[Any, Report], Any]
+
+
+def _number_text(value: Any) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _pattern_repair(pattern: str, verbatim: bool = False) -> Optional[Callable[[str], Optional[str]]]:
+    """
+    Build a repair for a bounded pattern. Only whitespace and length are repaired: free text
+    (`.` or a class allowing spaces) has its whitespace collapsed and is cut to the maximum
+    length; verbatim fields (see VERBATIM_FIELDS) and identifiers (classes without spaces) are
+    only stripped. Characters are never replaced, since that turns "24428.5" into "24428 5" or
+    a code into a different code. Other patterns have no repair.
+    """
+    match = _BOUNDED_PATTERN.match(pattern)
+    if match is None:
+        return None
+    char_class, minimum, maximum = match.group(1), int(match.group(2)), int(match.group(3))
+    if char_class != '.' and ' ' not in char_class:
+        return lambda value: value.strip()
+    if verbatim:
+        return lambda value: _WHITESPACE.sub(' ', value).strip()
+
+    def repair(value: str) -> Optional[str]:
+        value = _WHITESPACE.sub(' ', value).strip()[:maximum].rstrip()
+        return value if len(value) >= minimum else None
+
+    return repair
+
+
+def _compile_string(schema: Dict[str, Any], path: str) -> Checker:
+    pattern = re.compile(schema['pattern']) if 'pattern' in schema else None
+    verbatim = path.rsplit('.', 1)[-1] in VERBATIM_FIELDS
+    repair = _pattern_repair(schema['pattern'], verbatim) if pattern is not None else None
+
+    def check(value: Any, report: Report) -> Any:
+        if value is None:
+            return None
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = _number_text(value)
+        elif not isinstance(value, str):
+            report.errors.append(f"{path}: expected a string, got {type(value).__name__}")
+            return value
+        if value.strip().lower() in NULL_STRINGS:
+            return None
+        if pattern is not None and pattern.search(value) is None:
+            repaired = repair(value) if repair is not None else None
+            if repaired is None or pattern.search(repaired) is None:
+                report.errors.append(f"{path}: {value[:40]!r} does not match {pattern.pattern}")
+                return value
+            report.repairs += 1
+            value = repaired
+        return value
+
+    return check
+
+
+def _compile_number(schema: Dict[str, Any], path: str) -> Checker:
+    integer = schema['type'] == 'integer'
+    minimum = schema.get('minimum')
+    maximum = schema.get('maximum')
+
+    def check(value: Any, report: Report) -> Any:
+        if value is None:
+            return None
+        if isinstance(value, str):
+            text = value.strip().replace(',', '')
+            if text.lower() in NULL_STRINGS:
+                return None
+            try:
+                value = float(text)
+            except ValueError:
+                report.errors.append(f"{path}: {value[:40]!r} is not a number")
+                return value
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            report.errors.append(f"{path}: expected a number, got {type(value).__name__}")
+            return value
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                report.errors.append(f"{path}: {value} is not finite")
+                return value
+            # 76.0 -> 76, so page numbers, years and whole values compare as integers.
+            if value.is_integer():
+                value = int(value)
+            elif integer:
+                report.errors.append(f"{path}: {value} is not an integer")
+                return value
+        if minimum is not None and value < minimum:
+            report.errors.append(f"{path}: {value} is below {minimum}")
+        elif maximum is not None and value > maximum:
+            report.errors.append(f"{path}: {value} is above {maximum}")
+        return value
+
+    return check
+
+
+def _compile_boolean(schema: Dict[str, Any], path: str) -> Checker:
+    def check(value: Any, report: Report) -> Any:
+        if value is None or isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+            return value.strip().lower() == 'true'
+        if isinstance(value, str) and value.strip().lower() in NULL_STRINGS:
+            return None
+        report.errors.append(f"{path}: expected a boolean, got {value!r}")
+        return value
+
+    return check
+
+
+def _compile_object(schema: Dict[str, Any], path: str) -> Checker:
+    properties = {name: compile_checker(prop, f'{path}.{name}') for name, prop in schema.get('properties', {}).items()}
+    required = tuple(schema.get('required', ()))
+
+    def check(value: Any, report: Report) -> Any:
+        if not isinstance(value, dict):
+            report.errors.append(f"{path}: expected an object, got {type(value).__name__}")
+            return value
+        # Fields outside the schema are kept as they are.
+        normalized = dict(value)
+        for name, checker in properties.items():
+            if name in value:
+                normalized[name] = checker(value[name], report)
+        for name in required:
+            if name not in normalized:
+                normalized[name] = None
+                report.repairs += 1
+            if normalized[name] is None and name in NON_NULL_FIELDS:
+                report.errors.append(f"{path}.{name}: missing")
+        return normalized
+
+    return check
+
+
+def _compile_array(schema: Dict[str, Any], path: str) -> Checker:
+    item = compile_checker(schema['items'], f'{path}[]')
+
+    def check(value: Any, report: Report) -> Any:
+        if not isinstance(value, list):
+            report.errors.append(f"{path}: expected an array, got {type(value).__name__}")
+            return value
+        return [item(element, report) for element in value]
+
+    return check
+
+
+_COMPILERS = {
+    'string': _compile_string,
+    'number': _compile_number,
+    'integer': _compile_number,
+    'boolean': _compile_boolean,
+    'object': _compile_object,
+    'array': _compile_array,
+}
+
+
+def compile_checker(schema: Dict[str, Any], path: str = '$') -> Checker:
+    """
+    Compile a response schema (as accepted by templates.validate_schema) into a checker
+    function; patterns are compiled here, once, rather than per value.
+    """
+    return _COMPILERS[schema['type']](schema, path)
+
+
+class SchemaValidator:
+    """
+    Compiled response schema that normalizes model output in one pass.
+
+    Numbers returned as text ("1,234", "76.0") become numbers and whole floats become ints;
+    numbers returned for string fields become canonical text (787 and 787.0 -> "787"); the
+    strings "null", "None" and "" become null. Free text violating a bounded pattern is
+    repaired (whitespace collapsed, cut to length; characters are never changed) and
+    missing required fields are filled with null. Anything else is reported as an error.
+
+    Attributes:
+        schema (Dict[str, Any]): Response schema.
+    """
+
+    def __init__(self, schema: Dict[str, Any]):
+        self.schema = schema
+        self._check = compile_checker(schema)
+        self._item_check = compile_checker(schema['items'], '$[]') if schema['type'] == 'array' else None
+        self._properties: Dict[str, 'SchemaValidator'] = {}
+
+    def check(self, value: Any) -> Tuple[Any, Report]:
+        """
+        Return the normalized value and the report of everything that had to be changed or failed.
+        """
+        report = Report()
+        return self._check(value, report), report
+
+    def at(self, name: str) -> 'SchemaValidator':
+        """
+        Validator for one property of an object schema, e.g. the `metrics` array; compiled once.
+        """
+        if name not in self._properties:
+            self._properties[name] = SchemaValidator(self.schema['properties'][name])
+        return self._properties[name]
+
+    def check_items(self, items: List[Any]) -> Tuple[List[Any], Dict[int, List[str]], int]:
+        """
+        Check each element of an array output on its own.
+
+        Returns the normalized elements, the errors of each failed element by index, and the
+        number of repairs made.
+        """
+        if self._item_check is None:
+            raise TypeError("check_items needs an array schema")
+        normalized, failures, repairs = [], {}, 0
+        for index, item in enumerate(items):
+            report = Report()
+            normalized.append(self._item_check(item, report))
+            repairs += report.repairs
+            if report.errors:
+                failures[index] = report.errors
+        return normalized, failures, repairs
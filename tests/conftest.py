@@ -0,0 +1,69 @@
+import shutil
+
+import pytest
+
+from src.config.setup import config
+from src.generate import pipeline
+from src.generate import dedup
+from src.generate import pipeline_adaptive
+from src.generate import pipeline_all_in_one
+from src.generate import scheduler
+from src.generate import telemetry
+from src.generate import templates
+
+
+class Workspace:
+    """
+    Temporary corpus, template copy and output directories the pipelines are pointed at.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.pdf_dir = root / 'pdfs'
+        self.template_dir = root / 'templates'
+        self.pdf_dir.mkdir()
+
+    def add_pdf(self, doc_id, text=None):
+        # Only the bytes matter: with page indexing and slicing off the PDF is sent as-is.
+        path = self.pdf_dir / f'{doc_id}.pdf'
+        path.write_bytes(b'%PDF-1.4\n' + (text or f'Sustainability report {doc_id}').encode() + b'\n%%EOF\n')
+        return str(path)
+
+    def edit_template(self, file_name, extra):
+        path = self.template_dir / file_name
+        path.write_text(path.read_text() + extra)
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """
+    Run the pipelines offline against a temporary workspace with fresh telemetry and scheduler.
+    """
+    space = Workspace(tmp_path)
+    shutil.copytree('./data/templates', space.template_dir)
+    monkeypatch.setattr(templates, '_default_registry', templates.TemplateRegistry(str(space.template_dir), reload_interval=0))
+    for module in (pipeline, pipeline_all_in_one, pipeline_adaptive):
+        name = module.__name__.rsplit('.', 1)[-1]
+        monkeypatch.setattr(module, 'PDF_DIR', str(space.pdf_dir))
+        monkeypatch.setattr(module, 'OUTPUT_DIR', str(tmp_path / 'output' / name))
+        monkeypatch.setattr(module, 'GEN_DIR', str(tmp_path / 'generated' / name))
+    settings = {'STAGE_PDFS': False, 'PAGE_INDEX': False, 'SLICE_PAGES': False, 'METRIC_STORE': False,
+                'DEDUP': False, 'CONTEXT_CACHE': False, 'OUTPUT_COMPRESSION': 'none',
+                'QUARANTINE_DIR': str(tmp_path / 'quarantine'), 'METRIC_STORE_DIR': str(tmp_path / 'store')}
+    for name, value in settings.items():
+        monkeypatch.setattr(config, name, value)
+    monkeypatch.setattr(telemetry, '_default_telemetry', telemetry.Telemetry())
+    monkeypatch.setattr(scheduler, '_default_scheduler', scheduler.RequestScheduler(1_000_000, 1_000_000_000, base_delay=0.001))
+    return space
+
+
+@pytest.fixture
+def dedup_index(workspace, tmp_path, monkeypatch):
+    """
+    Enable exact-duplicate detection with a fresh index journal and return the index.
+    """
+    monkeypatch.setattr(config, 'DEDUP', True)
+    monkeypatch.setattr(config, 'DEDUP_INDEX', str(tmp_path / 'dedup_index.jsonl'))
+    monkeypatch.setattr(config, 'DEDUP_NEAR_DUPLICATES', False)
+    monkeypatch.setattr(dedup, '_default_index', None)
+    return dedup.get_dedup_index()
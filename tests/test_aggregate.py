@@ -0,0 +1,97 @@
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from src.generate.aggregate import MetricTable
+from src.generate.aggregate import aggregate
+from src.generate.aggregate import parse_unit
+from src.generate.aggregate import to_gwh
+from src.generate.aggregate import to_records
+
+
+def metric(code, value, unit):
+    return {'code': code, 'value': value, 'unit': unit, 'year': 2023}
+
+
+def table(*docs):
+    return MetricTable.from_records((f'doc-{i}', records) for i, records in enumerate(docs))
+
+
+def test_units_are_parsed_with_their_scale():
+    assert parse_unit('Thousands of MWh') == ('mwh', 1e3)
+    assert parse_unit("GJ ('000)") == ('gj', 1e3)
+    assert parse_unit('  Cubic   Metres ') == ('m3', 1.0)
+    assert parse_unit('m³') == ('m3', 1.0)
+    assert parse_unit('kiloliters') == ('l', 1e3)
+    assert parse_unit('percent') == ('%', 1.0)
+    assert parse_unit('furlongs')[0] is None and math.isnan(parse_unit(None)[1])
+
+
+def test_energy_and_fuel_quantities_are_converted_to_gwh():
+    rows = table([
+        metric('429', '1,000', 'MWh'),
+        metric('429', 3600, 'GJ'),
+        metric('429', 2, 'TJ'),
+        metric('429', 5e6, 'kWh'),
+        metric('789', 1000, 'liters'),
+        metric('787', 1e6, 'm3'),
+        metric('783', 10, 'tonnes'),
+        metric('RE002', 10, 'tonnes'),
+        metric('772', 1000, 'liters'),
+        metric('429', 7, 'furlongs'),
+        metric('429', None, 'MWh'),
+    ])
+
+    gwh = to_gwh(rows)
+
+    assert gwh[:8] == pytest.approx([1.0, 1.0, 0.555556, 5.0, 1.1166e-2, 10.55, 6.667e-2, 4.167e-2], rel=1e-5)
+    # No heating value for wind in liters, an unknown unit, or a missing value.
+    assert np.isnan(gwh[8:]).all()
+
+
+def test_reported_totals_take_precedence_over_their_components():
+    results = aggregate(table([
+        metric('429', 100, 'GWh'),
+        metric('432', 30, 'GWh'),
+        metric('RE004', 5000, 'MWh'),
+        metric('787', 1e6, 'm3'),
+    ]))
+
+    assert results['tec'][0] == 100
+    assert results['trec'][0] == 30
+    # 711 is summed from its components since it was not reported.
+    assert results['tnrec'][0] == pytest.approx(10.55)
+
+
+def test_missing_totals_are_derived():
+    results = aggregate(table(
+        [metric('RE004', 5000, 'MWh'), metric('772', 2, 'GWh'), metric('787', 1e6, 'm3')],
+        [metric('429', 100, 'GWh'), metric('432', 30, 'GWh')],
+        [metric('1701', 10, 'GWh')],
+    ))
+
+    assert results['trec'] == pytest.approx([7.0, 30.0, math.nan], nan_ok=True)
+    assert results['tnrec'] == pytest.approx([10.55, 70.0, math.nan], nan_ok=True)
+    assert results['tec'] == pytest.approx([17.55, 100.0, math.nan], nan_ok=True)
+
+
+def test_shares_use_valid_reported_percentages_only():
+    results = aggregate(table(
+        [metric('429', 100, 'GWh'), metric('432', 30, 'GWh'), metric('819', 40, '%'), metric('817', 55, 'percentage')],
+        [metric('429', 100, 'GWh'), metric('432', 30, 'GWh'), metric('819', 40, 'GWh'), metric('817', 140, '%')],
+    ))
+
+    assert results['renewable_share'] == pytest.approx([0.4, 0.3])
+    assert results['non_renewable_share'] == pytest.approx([0.55, 0.7])
+
+
+def test_records_report_missing_results_as_none():
+    rows = table([metric('429', 100, 'GWh')], [])
+
+    records = to_records(rows.doc_ids, aggregate(rows))
+
+    assert records[0] == {'doc_id': 'doc-0', 'tec': 100.0, 'trec': None, 'tnrec': None,
+                          'renewable_share': None, 'non_renewable_share': None}
+    assert records[1]['doc_id'] == 'doc-1' and records[1]['tec'] is None
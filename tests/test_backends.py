@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from src.generate.backends import BlobPart
+from src.generate.backends import ModelRequest
+from src.generate.backends import ReplayBackend
+from src.generate.backends import ReplayMissError
+from src.generate.backends import SyntheticBackend
+from src.generate.backends import SyntheticBackendError
+from src.generate.scheduler import is_retryable
+from src.generate.validation import SchemaValidator
+
+
+def load_schema(name):
+    with open(f'./data/templates/response_schemas/{name}.json', 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def make_request(name='step_3', text='Extract the metrics.', model_name='gemini-1.5-pro-001'):
+    return ModelRequest(model_name, ['You extract energy metrics.'],
+                        [BlobPart(b'%PDF-1.4 fake', 'application/pdf'), text], load_schema(name))
+
+
+@pytest.mark.parametrize('name', ['step_1', 'step_2', 'step_3', 'all_in_one'])
+def test_synthetic_output_follows_the_response_schema(name):
+    backend = SyntheticBackend(items=4)
+    output = json.loads(backend.generate(make_request(name)).text)
+
+    validator = SchemaValidator(load_schema(name))
+    if name == 'all_in_one':
+        assert len(output['metrics']) == 4
+        output = output['metrics']
+        validator = validator.at('metrics')
+    _, failures, _ = validator.check_items(output)
+    assert failures == {}
+
+
+def test_synthetic_output_is_deterministic_per_request():
+    first, second = SyntheticBackend(seed=1), SyntheticBackend(seed=1)
+    request = make_request()
+
+    assert first.generate(request).text == second.generate(make_request()).text
+    assert first.generate(request).text != first.generate(make_request(text='Other prompt.')).text
+    assert first.calls == 3
+
+
+def test_synthetic_failures_are_retryable():
+    backend = SyntheticBackend(error_rate=1.0)
+    with pytest.raises(SyntheticBackendError) as raised:
+        backend.generate(make_request())
+    assert is_retryable(raised.value)
+    assert backend.failures == 1
+
+
+def test_replay_records_misses_and_answers_them_offline(tmp_path):
+    path = str(tmp_path / 'replay.jsonl')
+    inner = SyntheticBackend()
+    recorder = ReplayBackend(path, inner=inner)
+    recorded = [recorder.generate(make_request(text=f'Prompt {i}.')).text for i in range(3)]
+    recorder.generate(make_request(text='Prompt 0.'))
+
+    assert inner.calls == 3
+    assert recorder.hits == 1
+
+    replay = ReplayBackend(path)
+    assert [replay.generate(make_request(text=f'Prompt {i}.')).text for i in range(3)] == recorded
+    assert replay.hits == 3
+
+
+def test_replay_miss_without_inner_backend_raises(tmp_path):
+    replay = ReplayBackend(str(tmp_path / 'missing.jsonl'))
+    with pytest.raises(ReplayMissError):
+        replay.generate(make_request())
+
+
+def test_replay_uses_the_model_id_of_the_recording(tmp_path):
+    path = str(tmp_path / 'replay.jsonl')
+    inner = SyntheticBackend()
+    request = make_request(model_name=inner.model_id('gemini-1.5-pro-001'))
+    ReplayBackend(path, inner=inner).generate(request)
+
+    assert ReplayBackend(path).model_id('gemini-1.5-pro-001') == 'synthetic/gemini-1.5-pro-001'
@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+from src.generate.artifacts import ArtifactStore
+from src.generate.batch import build_batch_requests
+from src.generate.batch import ingest_batch_predictions
+from src.generate.batch import iter_predictions
+from src.generate.manifest import hash_file
+from src.generate.staging import PdfStager
+
+
+STEP_1_OUTPUT = {
+    'doc-a': [{'code': '787', 'item': 'Total energy consumption'}],
+    'doc-b': [{'code': '819', 'item': 'Renewable share'}, {'code': 787.0, 'item': 'Total energy'}],
+}
+
+
+class FakeBlob:
+    def __init__(self, objects, name):
+        self.objects = objects
+        self.name = name
+
+    def exists(self):
+        return self.name in self.objects
+
+    def upload_from_filename(self, path, content_type=None):
+        with open(path, 'rb') as file:
+            self.objects[self.name] = file.read()
+
+
+class FakeStorageClient:
+    """
+    Cloud Storage client keeping uploaded objects in memory.
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def bucket(self, name):
+        return self
+
+    def blob(self, name):
+        return FakeBlob(self.objects, name)
+
+
+def fake_stager():
+    stager = PdfStager('bucket', 'staged')
+    stager._client = FakeStorageClient()
+    return stager
+
+
+def predict(requests_file, predictions_file, outputs, failed=()):
+    """
+    Answer a request file the way a batch job does: each line echoes its request and adds
+    either a response or a status.
+    """
+    with open(requests_file) as source, open(predictions_file, 'w') as target:
+        for line in source:
+            record = json.loads(line)
+            doc_id = record['request']['labels']['doc_id']
+            if doc_id in failed:
+                record['status'] = 'INTERNAL: model error'
+            else:
+                text = json.dumps(outputs[doc_id])
+                record['response'] = {'candidates': [{'content': {'parts': [{'text': text}]}}]}
+            target.write(json.dumps(record) + '\n')
+
+
+def test_requests_reference_staged_pdfs_with_the_step_schema(workspace, tmp_path):
+    requests_file = tmp_path / 'requests.jsonl'
+    paths = [workspace.add_pdf('doc-a'), workspace.add_pdf('doc-b'), workspace.add_pdf('doc-c', 'Sustainability report doc-a')]
+    stager = fake_stager()
+
+    assert build_batch_requests(['doc-a', 'doc-b', 'doc-c'], str(requests_file), stager=stager) == 3
+
+    records = [json.loads(line) for line in requests_file.read_text().splitlines()]
+    assert [record['request']['labels'] for record in records] == [{'doc_id': doc_id} for doc_id in ('doc-a', 'doc-b', 'doc-c')]
+    parts = records[1]['request']['contents'][0]['parts']
+    assert parts[0]['fileData'] == {'fileUri': f'gs://bucket/staged/{hash_file(paths[1])}.pdf', 'mimeType': 'application/pdf'}
+    # Every referenced PDF was uploaded, and byte-identical ones only once.
+    assert sorted(stager._client.objects) == sorted({f'staged/{hash_file(path)}.pdf' for path in paths})
+    assert stager.uploads == 2
+    schema = records[1]['request']['generationConfig']['responseSchema']
+    assert schema['type'] == 'ARRAY'
+    assert schema['items']['properties']['code']['type'] == 'STRING'
+
+
+def test_document_ids_must_be_valid_labels(workspace, tmp_path):
+    workspace.add_pdf('Doc A')
+
+    with pytest.raises(ValueError, match='label'):
+        build_batch_requests(['Doc A'], str(tmp_path / 'requests.jsonl'), stager=fake_stager())
+
+
+def test_predictions_round_trip_into_step_artifacts(workspace, tmp_path):
+    requests_file, predictions_file = tmp_path / 'requests.jsonl', tmp_path / 'predictions.jsonl'
+    for doc_id in ('doc-a', 'doc-b', 'doc-c'):
+        workspace.add_pdf(doc_id)
+    build_batch_requests(['doc-a', 'doc-b', 'doc-c'], str(requests_file), stager=fake_stager())
+    predict(requests_file, predictions_file, STEP_1_OUTPUT, failed={'doc-c'})
+
+    assert [(doc_id, error is None) for doc_id, _, error in iter_predictions(str(predictions_file))] == [
+        ('doc-a', True), ('doc-b', True), ('doc-c', False)]
+
+    store = ArtifactStore(str(tmp_path / 'output'))
+    counts = ingest_batch_predictions(str(predictions_file), 'step_1', store=store)
+
+    assert counts == {'ingested': 2, 'failed': 1}
+    assert store.load('doc-a', 'step_1') == STEP_1_OUTPUT['doc-a']
+    # Validation normalizes the prediction the way the online step does.
+    assert store.load('doc-b', 'step_1')[1] == {'code': '787', 'item': 'Total energy'}
+    assert store.load('doc-c', 'step_1') is None
+
+
+def test_unparseable_predictions_are_counted_as_failed(workspace, tmp_path):
+    requests_file, predictions_file = tmp_path / 'requests.jsonl', tmp_path / 'predictions.jsonl'
+    workspace.add_pdf('doc-a')
+    build_batch_requests(['doc-a'], str(requests_file), stager=fake_stager())
+    predict(requests_file, predictions_file, {'doc-a': {'not': 'a list'}})
+
+    store = ArtifactStore(str(tmp_path / 'output'))
+    assert ingest_batch_predictions(str(predictions_file), 'step_1', store=store) == {'ingested': 0, 'failed': 1}
+    assert store.load('doc-a', 'step_1') is None
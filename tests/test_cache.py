@@ -0,0 +1,112 @@
+import argparse
+import os
+import threading
+import time
+
+import pytest
+
+from src.generate import cache as cache_module
+from src.generate.cache import add_cache_arguments
+from src.generate.cache import response_cache_from_args
+from src.generate.cache import make_cache_key
+from src.generate.cache import ResponseCache
+
+
+def entry_files(cache_dir):
+    return sorted(name[:-len('.json')] for _, _, files in os.walk(cache_dir) for name in files if name.endswith('.json'))
+
+
+def test_key_depends_on_every_request_field():
+    base = make_cache_key('model', ['instruction'], ['prompt'], {'type': 'array'}, {'temperature': 0})
+    assert base == make_cache_key('model', ['instruction'], ['prompt'], {'type': 'array'}, {'temperature': 0})
+    assert base != make_cache_key('model', ['instruction'], ['prompt 2'], {'type': 'array'}, {'temperature': 0})
+    assert base != make_cache_key('model', ['instruction', 'prompt'], [], {'type': 'array'}, {'temperature': 0})
+
+
+def test_hits_survive_reopening_the_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    calls = []
+    assert cache.get_or_compute('aa01', lambda: calls.append(1) or '[1]') == '[1]'
+    assert cache.get_or_compute('aa01', lambda: calls.append(1) or '[2]') == '[1]'
+
+    reopened = ResponseCache(str(tmp_path))
+    assert reopened.get('aa01') == '[1]'
+    assert reopened.stats()['entries'] == 1
+    assert calls == [1]
+
+
+def test_concurrent_misses_compute_once(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'text'
+
+    threads = [threading.Thread(target=cache.get_or_compute, args=('bb01', compute)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert cache.stats()['hits'] == 4
+
+
+def test_eviction_drops_least_recently_used_entries_down_to_the_low_water_mark(tmp_path):
+    cache = ResponseCache(str(tmp_path), low_water=0.5)
+    for i in range(10):
+        cache.put(f'k{i:02d}', 'x' * 10)
+    cache.max_bytes = cache.stats()['size_bytes'] + 5
+    cache.get('k00')
+
+    cache.put('k10', 'x' * 10)
+
+    kept = entry_files(tmp_path)
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['size_bytes'] <= cache.max_bytes * cache.low_water
+    assert 'k00' in kept and 'k10' in kept
+    assert 'k01' not in kept
+    assert kept == sorted(cache._index)
+
+
+def test_puts_under_the_limit_do_not_scan_the_directory(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), max_bytes=1024 * 1024)
+
+    def no_walk(*args, **kwargs):
+        raise AssertionError("the cache directory was scanned")
+
+    monkeypatch.setattr(cache_module.os, 'walk', no_walk)
+    for i in range(20):
+        cache.put(f'c{i:02d}', 'text')
+    assert cache.stats()['entries'] == 20
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_age_seconds=60)
+    cache.put('dd01', 'old')
+    cache._index['dd01'] = (cache._index['dd01'][0], time.time() - 120)
+
+    assert cache.get('dd01') is None
+    assert entry_files(tmp_path) == []
+    assert cache.stats()['size_bytes'] == 0
+
+
+def test_bypass_misses_but_stores_fresh_responses(tmp_path):
+    ResponseCache(str(tmp_path)).put('ee01', 'old')
+    cache = ResponseCache(str(tmp_path), bypass=True)
+
+    assert cache.get_or_compute('ee01', lambda: 'new') == 'new'
+    assert ResponseCache(str(tmp_path)).get('ee01') == 'new'
+
+
+@pytest.mark.parametrize('flags, expected', [([], False), (['--refresh-cache'], True), (['--no-cache'], None)])
+def test_cache_flags(tmp_path, monkeypatch, flags, expected):
+    monkeypatch.setattr(cache_module, 'default_response_cache', lambda bypass=False: ResponseCache(str(tmp_path), bypass=bypass))
+    parser = argparse.ArgumentParser()
+    add_cache_arguments(parser)
+
+    cache = response_cache_from_args(parser.parse_args(flags))
+
+    assert (None if cache is None else cache.bypass) == expected
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from src.generate.compare import evaluate
+from src.generate.compare import evaluate_file
+from src.generate.compare import match_key
+from src.generate.compare import match_records
+
+
+def write(directory, doc_id, records):
+    directory.mkdir(exist_ok=True)
+    path = directory / f'{doc_id}.jsonl'
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    return str(path)
+
+
+def test_codes_and_values_are_normalized_for_matching():
+    assert match_key({'code': 429.0, 'value': '24,428.7'}) == ('429', 24428)
+    assert match_key({'code': '429', 'value': 24428}) == ('429', 24428)
+    assert match_key({'code': None, 'value': 1}) is None
+    assert match_key({'code': '429', 'value': 'null'}) is None
+
+
+def test_records_are_matched_one_to_one():
+    generated = [{'code': '429', 'value': 10}, {'code': '432', 'value': 5}, {'code': '429', 'value': 10},
+                 {'code': '711', 'value': 'n/a'}]
+    expected = [{'code': 432, 'value': 5.0}, {'code': 429, 'value': 10}, {'code': 429, 'value': 10},
+                {'code': 429, 'value': 10}]
+
+    # Ties go to the first unused generated record; the third expected 429 has none left.
+    assert match_records(generated, expected) == [(1, 0), (0, 1), (2, 2)]
+
+
+def test_unmatched_records_on_either_side_are_left_out():
+    generated = [{'code': '429', 'value': 10}, {'code': '999', 'value': 1}]
+    expected = [{'code': '432', 'value': 3}, {'code': '429', 'value': 10}]
+
+    assert match_records(generated, expected) == [(0, 1)]
+    assert match_records([], expected) == []
+    assert match_records(generated, []) == []
+
+
+def test_fields_are_scored_on_matched_pairs(tmp_path):
+    generated = write(tmp_path / 'generated', 'doc-a', [
+        {'code': '429', 'value': 10, 'unit': 'MWh', 'year': '2023', 'scope': 'Global ', 'page_number': 4},
+        {'code': '432', 'value': 5, 'unit': 'Thousands of kWh', 'year': 2022, 'scope': None},
+        {'code': '999', 'value': 1},
+    ])
+    expected = write(tmp_path / 'expected', 'doc-a', [
+        {'code': 429, 'value': 10, 'unit': 'megawatt hours', 'year': 2023, 'scope': 'global', 'page_number': 5},
+        {'code': 432, 'value': 5, 'unit': 'MWh', 'year': 2023, 'scope': 'Global'},
+        {'code': 711, 'value': 2},
+    ])
+
+    result = evaluate_file(generated, expected)
+
+    assert (result['generated'], result['expected'], result['matched']) == (3, 3, 2)
+    assert result['fields']['unit'] == {'generated': 2, 'expected': 2, 'correct': 1}
+    assert result['fields']['year'] == {'generated': 2, 'expected': 2, 'correct': 1}
+    assert result['fields']['scope'] == {'generated': 1, 'expected': 2, 'correct': 1}
+    assert result['fields']['page_number'] == {'generated': 1, 'expected': 1, 'correct': 0}
+
+
+def test_evaluate_summarizes_files_with_an_expected_counterpart(tmp_path):
+    write(tmp_path / 'generated', 'doc-a', [{'code': '429', 'value': 10}, {'code': '432', 'value': 3}])
+    write(tmp_path / 'generated', 'doc-b', [{'code': '429', 'value': 7}])
+    write(tmp_path / 'expected', 'doc-a', [{'code': 429, 'value': 10}])
+
+    report = evaluate(str(tmp_path / 'generated'), str(tmp_path / 'expected'), max_workers=1)
+
+    assert [result['filename'] for result in report['files']] == ['doc-a.jsonl']
+    summary = report['summary']
+    assert (summary['matched'], summary['match_rate'], summary['precision']) == (1, 1.0, 0.5)
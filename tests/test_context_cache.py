@@ -0,0 +1,78 @@
+from src.generate.backends import BlobPart
+from src.generate.backends import UriPart
+from src.generate.context_cache import ContextCacheManager
+from src.generate.fakes import FakeCachingService
+
+
+MODEL = 'gemini-1.5-pro-001'
+INSTRUCTION = ['You extract energy metrics.']
+
+
+def pdf(doc_id, pages=200):
+    return [UriPart(f'gs://bucket/staged/{doc_id}.pdf', 'application/pdf', pages=pages)]
+
+
+def test_a_document_prefix_is_created_once_and_shared_by_its_steps():
+    service = FakeCachingService()
+    manager = ContextCacheManager(service, ttl=600, min_tokens=1000)
+
+    entries = [manager.acquire(MODEL, INSTRUCTION, pdf('doc-a'), 'doc-a') for _ in range(3)]
+
+    assert len({entry.name for entry in entries}) == 1
+    assert entries[0].uses == 3
+    assert service.created == 1
+    assert manager.stats() == {'created': 1, 'hits': 3, 'fallbacks': 0, 'live': 1}
+
+
+def test_prefixes_below_the_minimum_are_sent_inline():
+    service = FakeCachingService()
+    manager = ContextCacheManager(service, min_tokens=1000)
+
+    assert manager.acquire(MODEL, INSTRUCTION, pdf('doc-a', pages=2), 'doc-a') is None
+    assert manager.acquire(MODEL, INSTRUCTION, [BlobPart(b'short', 'text/plain')], 'doc-a') is None
+    assert service.created == 0
+    assert manager.stats()['fallbacks'] == 2
+
+
+def test_a_refused_prefix_is_not_retried():
+    service = FakeCachingService(fail=True)
+    manager = ContextCacheManager(service, min_tokens=1000)
+
+    assert [manager.acquire(MODEL, INSTRUCTION, pdf('doc-a'), 'doc-a') for _ in range(3)] == [None] * 3
+    assert service.created == 0
+    assert manager.stats() == {'created': 0, 'hits': 0, 'fallbacks': 3, 'live': 0}
+
+
+def test_release_deletes_only_the_documents_caches():
+    service = FakeCachingService()
+    manager = ContextCacheManager(service, min_tokens=1000)
+    first = manager.acquire(MODEL, INSTRUCTION, pdf('doc-a'), 'doc-a')
+    second = manager.acquire(MODEL, INSTRUCTION, pdf('doc-b'), 'doc-b')
+
+    assert manager.release('doc-a') == [first.name]
+    assert list(service.caches) == [second.name]
+    assert manager.release() == [second.name]
+    assert service.deleted == 2
+    assert manager.stats()['live'] == 0
+
+
+def test_caches_near_expiry_are_extended():
+    service = FakeCachingService()
+    manager = ContextCacheManager(service, ttl=600, min_tokens=1000)
+    entry = manager.acquire(MODEL, INSTRUCTION, pdf('doc-a'), 'doc-a')
+    entry.expires_at -= 500
+
+    assert manager.acquire(MODEL, INSTRUCTION, pdf('doc-a'), 'doc-a') is entry
+    assert service.refreshed == 1
+    assert service.created == 1
+
+
+def test_models_bound_to_a_cache_report_the_prefix_as_cached():
+    service = FakeCachingService()
+    manager = ContextCacheManager(service, min_tokens=1000)
+    entry = manager.acquire(MODEL, INSTRUCTION, pdf('doc-a'), 'doc-a')
+
+    response = service.model(entry.name, MODEL).generate_content(['Extract the metrics.'])
+
+    assert response.usage_metadata.cached_content_token_count == entry.tokens
+    assert service.prefix_tokens == entry.tokens >= 200 * 258
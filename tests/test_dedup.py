@@ -0,0 +1,123 @@
+import os
+import random
+
+import pytest
+
+from src.generate.dedup import DedupIndex
+from src.generate.dedup import fan_out
+from src.generate.dedup import group_documents
+from src.generate.dedup import minhash
+from src.generate.dedup import shingles
+from src.generate.jsonl import jsonl_path
+from src.generate.manifest import RunManifest
+
+
+def report(seed, words=300):
+    rng = random.Random(seed)
+    vocabulary = [f'word{i}' for i in range(500)]
+    return [rng.choice(vocabulary) for _ in range(words)]
+
+
+def fingerprint(doc_id, sha256, words):
+    return {'doc_id': doc_id, 'size': len(words), 'mtime_ns': 0, 'sha256': sha256,
+            'signature': minhash(shingles([' '.join(words)]))}
+
+
+def write_output(gen_dir, doc_id, text='{"code": "429"}\n'):
+    os.makedirs(gen_dir, exist_ok=True)
+    path = jsonl_path(gen_dir, doc_id, 'none')
+    with open(path, 'w') as file:
+        file.write(text)
+    return path
+
+
+def test_exact_copies_are_grouped_under_the_first_document(workspace, dedup_index):
+    workspace.add_pdf('doc-a')
+    workspace.add_pdf('doc-b')
+    workspace.add_pdf('doc-c', 'Sustainability report doc-a')
+    workspace.add_pdf('doc-d', 'Sustainability report doc-a')
+
+    groups = group_documents(['doc-a', 'doc-b', 'doc-c', 'doc-d'], str(workspace.pdf_dir), str(workspace.root / 'generated'))
+
+    assert groups == {'doc-a': ['doc-c', 'doc-d'], 'doc-b': []}
+    assert dedup_index.documents['doc-d']['similar_to'] == 'doc-a'
+
+
+def test_the_index_survives_a_restart(workspace, dedup_index):
+    workspace.add_pdf('doc-a')
+    workspace.add_pdf('doc-b', 'Sustainability report doc-a')
+    group_documents(['doc-a', 'doc-b'], str(workspace.pdf_dir), str(workspace.root / 'generated'))
+
+    reloaded = DedupIndex(dedup_index.path)
+
+    assert reloaded.documents == dedup_index.documents
+    # Known, unchanged files are recognized from their size and mtime alone.
+    assert reloaded.fingerprint('doc-b', str(workspace.pdf_dir / 'doc-b.pdf')) is None
+
+
+def test_near_duplicates_are_found_through_their_bands(tmp_path):
+    pytest.importorskip('numpy')
+    index = DedupIndex(str(tmp_path / 'index.jsonl'), threshold=0.8, near_duplicates=True)
+    original = report(0)
+    edited = original[:150] + ['restated'] + original[151:]
+
+    index.add(fingerprint('doc-a', 'sha-a', original))
+    near = index.add(fingerprint('doc-b', 'sha-b', edited))
+    other = index.add(fingerprint('doc-c', 'sha-c', report(1)))
+
+    assert near['canonical'] == 'doc-a' and 0.8 <= near['similarity'] < 1
+    assert other['canonical'] == 'doc-c' and other['similar_to'] is None
+
+
+def test_changing_a_canonical_document_repoints_its_duplicates(tmp_path):
+    pytest.importorskip('numpy')
+    index = DedupIndex(str(tmp_path / 'index.jsonl'), threshold=0.8, near_duplicates=True)
+    original = report(0)
+    index.add(fingerprint('doc-a', 'sha-a', original))
+    index.add(fingerprint('doc-b', 'sha-a', original))
+    index.add(fingerprint('doc-c', 'sha-a', original))
+    index.add(fingerprint('doc-d', 'sha-d', original[:150] + ['restated'] + original[151:]))
+
+    index.add(fingerprint('doc-a', 'sha-a2', report(1)))
+
+    canonicals = {doc_id: entry['canonical'] for doc_id, entry in index.documents.items()}
+    # The first remaining copy takes over; the near duplicate needs an extraction of its own.
+    assert canonicals == {'doc-a': 'doc-a', 'doc-b': 'doc-b', 'doc-c': 'doc-b', 'doc-d': 'doc-d'}
+    assert index.pop_repointed() == ['doc-d']
+    assert index.pop_repointed() == []
+    assert DedupIndex(index.path).documents['doc-c']['canonical'] == 'doc-b'
+
+
+def test_fan_out_copies_the_output_and_marks_aliases_done(workspace, tmp_path):
+    gen_dir = str(tmp_path / 'generated')
+    pdf_paths = {doc_id: workspace.add_pdf(doc_id, 'Sustainability report') for doc_id in ('doc-a', 'doc-b', 'doc-c')}
+    manifest = RunManifest(str(tmp_path / 'manifest.jsonl'))
+    manifest.start_document('doc-a', pdf_paths['doc-a'], manifest.fingerprint('doc-a', pdf_paths['doc-a']))
+    output_file = write_output(gen_dir, 'doc-a')
+    prompts = {'all_in_one': 'v1'}
+    manifest.mark_document('doc-a', 'done', output_file=output_file, prompts=prompts)
+
+    assert fan_out(output_file, ['doc-b', 'doc-c'], gen_dir, manifest, str(workspace.pdf_dir)) == output_file
+
+    reloaded = RunManifest(manifest.path)
+    for alias in ('doc-b', 'doc-c'):
+        alias_file = jsonl_path(gen_dir, alias, 'none')
+        with open(alias_file) as file:
+            assert file.read() == '{"code": "429"}\n'
+        assert reloaded.is_up_to_date(alias, reloaded.fingerprint(alias, pdf_paths[alias]), alias_file, prompts)
+        assert not reloaded.is_up_to_date(alias, reloaded.fingerprint(alias, pdf_paths[alias]), alias_file, {'all_in_one': 'v2'})
+
+
+def test_aliases_of_an_extracted_document_outside_the_batch_are_fanned_out(workspace, dedup_index, tmp_path):
+    gen_dir = str(tmp_path / 'generated')
+    workspace.add_pdf('doc-a')
+    workspace.add_pdf('doc-b', 'Sustainability report doc-a')
+    manifest = RunManifest(str(tmp_path / 'manifest.jsonl'))
+    group_documents(['doc-a'], str(workspace.pdf_dir), gen_dir)
+    write_output(gen_dir, 'doc-a')
+
+    groups = group_documents(['doc-b'], str(workspace.pdf_dir), gen_dir, manifest=manifest)
+
+    assert groups == {}
+    assert os.path.exists(jsonl_path(gen_dir, 'doc-b', 'none'))
+    assert manifest.documents['doc-b']['status'] == 'done'
@@ -0,0 +1,101 @@
+import functools
+import threading
+import random
+import json
+import time
+
+from src.generate import pipeline
+from src.generate.backends import BlobPart
+from src.generate.backends import synthesize
+from src.generate.engine import process_documents
+from src.generate.fakes import FakeVertexBackend
+from src.generate.fakes import FakeGenerativeModel
+
+
+class ConcurrencyTrackingModel(FakeGenerativeModel):
+    """
+    Fake model with injected latency that answers with output conforming to the request's
+    response schema and records the peak number of calls in flight.
+    """
+
+    active = 0
+    peak = 0
+
+    def generate_content(self, contents, generation_config=None, safety_settings=None):
+        with FakeGenerativeModel._lock:
+            ConcurrencyTrackingModel.active += 1
+            ConcurrencyTrackingModel.peak = max(ConcurrencyTrackingModel.peak, ConcurrencyTrackingModel.active)
+        try:
+            response = super().generate_content(contents, generation_config, safety_settings)
+        finally:
+            with FakeGenerativeModel._lock:
+                ConcurrencyTrackingModel.active -= 1
+        # One record per metric in the attached list, as steps 2 and 3 expect.
+        listed = [json.loads(part.data) for part in contents if isinstance(part, BlobPart) and part.mime_type == 'text/plain']
+        response.text = json.dumps(synthesize(generation_config['response_schema'], random.Random(0), len(listed[0]) if listed else 3))
+        return response
+
+
+def test_results_follow_input_order_not_completion_order():
+    doc_ids = [f'doc-{i}' for i in range(12)]
+    delays = {doc_id: random.Random(i).uniform(0.0, 0.02) for i, doc_id in enumerate(doc_ids)}
+
+    def process(doc_id):
+        time.sleep(delays[doc_id])
+        return doc_id.upper()
+
+    results = process_documents(doc_ids, process, max_workers=4)
+
+    assert [result.doc_id for result in results] == doc_ids
+    assert [result.output for result in results] == [doc_id.upper() for doc_id in doc_ids]
+    assert all(result.ok and result.elapsed >= 0 for result in results)
+
+
+def test_a_failing_document_does_not_affect_the_others():
+    def process(doc_id):
+        if doc_id == 'bad':
+            raise ValueError('unreadable PDF')
+        return len(doc_id)
+
+    results = process_documents(['a', 'bad', 'ccc'], process, max_workers=2)
+
+    assert [result.ok for result in results] == [True, False, True]
+    assert [result.output for result in results] == [1, None, 3]
+    assert isinstance(results[1].error, ValueError)
+
+
+def test_worker_count_is_bounded():
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def process(doc_id):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+
+    process_documents([str(i) for i in range(10)], process, max_workers=3)
+
+    assert 1 < peak[0] <= 3
+
+
+def test_pipeline_documents_run_concurrently_in_order_and_fail_in_isolation(workspace, monkeypatch):
+    doc_ids = [f'doc-{i}' for i in range(8)]
+    for doc_id in doc_ids:
+        workspace.add_pdf(doc_id)
+    doc_ids.insert(3, 'missing')
+    monkeypatch.setattr(ConcurrencyTrackingModel, 'peak', 0)
+    backend = FakeVertexBackend(functools.partial(ConcurrencyTrackingModel, latency=0.01))
+
+    results = process_documents(doc_ids, lambda doc_id: pipeline.process_document(doc_id, backend), max_workers=3)
+
+    assert [result.doc_id for result in results] == doc_ids
+    assert [result.ok for result in results] == [doc_id != 'missing' for doc_id in doc_ids]
+    assert isinstance(results[3].error, FileNotFoundError)
+    for result in results[:3] + results[4:]:
+        with open(result.output) as file:
+            assert len(file.readlines()) == 3
+        assert result.output.endswith(f'{result.doc_id}.jsonl')
+    assert 1 < ConcurrencyTrackingModel.peak <= 3
@@ -0,0 +1,44 @@
+import json
+
+from src.generate.load_ingredients import EnergyData
+from src.generate.load_ingredients import NonRenewableEnergy
+from src.generate.load_ingredients import RenewableEnergy
+from src.generate.load_ingredients import load_corpus
+
+
+def record(code, value=1.0, unit='GJ'):
+    return {'code': code, 'item': f'Item {code}', 'value': value, 'unit': unit, 'page_number': 3, 'snippet': 'text'}
+
+
+def test_flat_metrics_are_split_by_code():
+    data = EnergyData(2022, [record('772'), record(787.0), record('817', unit='%')], {})
+
+    assert [r.code for r in data.renewable_energy] == ['772']
+    assert [r.code for r in data.non_renewable_energy] == ['787']
+    assert [r.code for r in data.other_energy] == ['817']
+    assert isinstance(data.renewable_energy[0], RenewableEnergy)
+
+
+def test_placeholders_are_not_shared_between_records():
+    metrics = {'renewable_energy_consumption': [record('999')], 'non_renewable_energy_consumption': [record('998')]}
+    first = EnergyData(2021, metrics, {})
+    second = EnergyData(2022, metrics, {})
+
+    placeholder = first.renewable_energy[0]
+    assert placeholder.item == 'Generic Renewable' and placeholder.value == 0
+    assert placeholder is not second.renewable_energy[0]
+
+    placeholder.value = 42
+    assert second.renewable_energy[0].value == 0
+    assert isinstance(first.non_renewable_energy[0], NonRenewableEnergy)
+
+
+def test_load_corpus_streams_jsonl_files(tmp_path):
+    (tmp_path / 'doc-a.jsonl').write_text('\n'.join(json.dumps(r) for r in [record('772'), record('787')]) + '\n')
+    (tmp_path / 'notes.txt').write_text('ignored')
+
+    corpus = load_corpus(str(tmp_path), snippets=False)
+
+    assert list(corpus) == ['doc-a']
+    assert [r.code for r in corpus['doc-a']] == ['772', '787']
+    assert corpus['doc-a'][0].snippet is None
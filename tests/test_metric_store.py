@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from src.generate.metric_store import MetricStore
+
+
+def record(code, value, year=2023, scope='Global', unit='MWh'):
+    return {'code': code, 'item': f'Metric {code}', 'value': value, 'unit': unit, 'page_number': 4,
+            'year': year, 'scope': scope, 'flag': 'Full'}
+
+
+def part_files(root_dir):
+    return sorted(os.path.relpath(os.path.join(path, name), root_dir)
+                  for path, _, files in os.walk(root_dir) for name in files if name.endswith('.parquet'))
+
+
+def test_appends_are_buffered_until_flushed(tmp_path):
+    store = MetricStore(str(tmp_path / 'store'))
+
+    assert store.append('doc-a', [record('429', '1,200'), record(711.0, 300)]) == 2
+    assert store.query().num_rows == 0
+    assert store.flush() == 2
+    assert store.flush() == 0
+
+    rows = store.query().to_pylist()
+    assert [(row['code'], row['value'], row['raw_value']) for row in rows] == [('429', 1200.0, '1,200'), ('711', 300.0, '300')]
+    assert part_files(store.root_dir)[0].startswith(os.path.join('year=2023', 'code=429'))
+
+
+def test_reaching_flush_rows_writes_a_part_file(tmp_path):
+    store = MetricStore(str(tmp_path / 'store'), flush_rows=3)
+
+    store.append('doc-a', [record('429', 1), record('711', 2)])
+    assert part_files(store.root_dir) == []
+    store.append('doc-b', [record('429', 3)])
+
+    assert store.query().num_rows == 3
+
+
+def test_queries_filter_by_code_year_scope_and_document(tmp_path):
+    store = MetricStore(str(tmp_path / 'store'))
+    store.append('doc-a', [record('429', 1, 2022), record('711', 2, 2023, scope='Regional')])
+    store.append('doc-b', [record('429', 3, 2023), record(None, 4, None)])
+    store.flush()
+
+    def values(**filters):
+        return store.query(columns=['value'], **filters)['value'].to_pylist()
+
+    assert values(codes=[429]) == [1, 3]
+    assert values(years=[2023]) == [2, 3]
+    assert values(scopes=['Regional']) == [2]
+    assert values(doc_ids=['doc-b']) == [3, 4]
+    assert values(codes=['429'], years=[2023]) == [3]
+    assert values(codes=['999']) == []
+
+
+def test_queries_return_only_the_newest_version_of_a_document(tmp_path):
+    store = MetricStore(str(tmp_path / 'store'))
+    store.append('doc-a', [record('429', 1), record('711', 2)])
+    store.append('doc-b', [record('429', 5)])
+    store.flush()
+    store.append('doc-a', [record('432', 3)])
+    store.append('doc-b', [])
+    store.flush()
+
+    assert store.records() == {'doc-a': [record('432', 3)]}
+    # Filtering on the superseded code must not bring the old version back.
+    assert store.query(codes=['429']).num_rows == 0
+
+
+def test_compact_keeps_only_the_newest_rows(tmp_path):
+    store = MetricStore(str(tmp_path / 'store'))
+    store.append('doc-a', [record('429', 1)])
+    store.flush()
+    store.append('doc-a', [record('429', 2), record('711', 3)])
+    store.append('doc-b', [record('429', 4)])
+
+    assert store.compact() == 3
+    rows = store.query().to_pylist()
+    assert [row['value'] for row in rows] == [2, 3, 4]
+    assert part_files(store.root_dir) == [os.path.join('year=2023', 'code=429', 'part-compacted-0.parquet'),
+                                          os.path.join('year=2023', 'code=711', 'part-compacted-0.parquet')]
+
+    assert store.compact() == 3
+    assert store.query().to_pylist() == rows
+
+
+def test_metric_table_reads_the_newest_rows(tmp_path):
+    pytest.importorskip('numpy')
+    store = MetricStore(str(tmp_path / 'store'))
+    store.append('doc-b', [record('429', 4, unit=None)])
+    store.append('doc-a', [record('429', 1), record('711', 2)])
+    store.flush()
+
+    table = store.to_metric_table(codes=['429'])
+
+    assert table.doc_ids == ['doc-a', 'doc-b']
+    assert list(table.doc) == [0, 1]
+    assert list(table.value) == [1.0, 4.0]
+    assert list(table.unit) == ['MWh', '']
@@ -0,0 +1,156 @@
+import functools
+import random
+import json
+import os
+
+from src.generate import pipeline
+from src.generate import pipeline_all_in_one
+from src.generate.artifacts import ArtifactStore
+from src.config.setup import config
+from src.generate.backends import SyntheticBackend
+from src.generate.backends import BlobPart
+from src.generate.backends import synthesize
+from src.generate.context_cache import ContextCacheManager
+from src.generate.fakes import FakeVertexBackend
+from src.generate.fakes import FakeGenerativeModel
+from src.generate.fakes import FakeCachingService
+from src.generate.fakes import FakeCandidate
+from src.generate.manifest import RunManifest
+from src.generate.scheduler import estimate_tokens
+from src.generate.telemetry import document_context
+from src.generate.templates import get_prompt
+
+
+def run(module, doc_id, backend, manifest):
+    return module.process_document(doc_id, backend, ArtifactStore(module.OUTPUT_DIR), None, manifest)
+
+
+class ScriptedModel(FakeGenerativeModel):
+    """
+    Fake model that records what it is sent and answers with the next scripted (text, finish
+    reason) reply, or with output synthesized from the response schema once the script is done.
+    """
+
+    def __init__(self, model_name, system_instruction=None, script=None, sent=None):
+        super().__init__(model_name, system_instruction=system_instruction)
+        self.script = script
+        self.sent = sent
+
+    def generate_content(self, contents, generation_config=None, safety_settings=None):
+        response = super().generate_content(contents, generation_config, safety_settings)
+        self.sent.append((self.system_instruction, list(contents)))
+        if self.script:
+            text, finish_reason = self.script.pop(0)
+            response.candidates = [FakeCandidate(finish_reason)]
+        else:
+            # One record per metric in the attached list, as steps 2 and 3 expect.
+            listed = [json.loads(part.data) for part in contents if isinstance(part, BlobPart) and part.mime_type == 'text/plain']
+            items = len(listed[0]) if listed else 3
+            text = json.dumps(synthesize(generation_config['response_schema'], random.Random(len(self.sent)), items))
+        response.text = text
+        return response
+
+
+def caching_backend(script=None):
+    """
+    Return a fake Vertex backend with context caching, its caching service and the list of
+    (system instruction, contents) pairs its models are sent.
+    """
+    sent = []
+    factory = functools.partial(ScriptedModel, script=script if script is not None else [], sent=sent)
+    service = FakeCachingService(factory)
+    return FakeVertexBackend(factory, context_cache=ContextCacheManager(service, min_tokens=1)), service, sent
+
+
+def test_multi_step_writes_step_3_records(workspace):
+    workspace.add_pdf('doc-a')
+    backend = SyntheticBackend(items=3)
+
+    output_file = pipeline.process_document('doc-a', backend)
+
+    with open(output_file) as file:
+        records = [json.loads(line) for line in file]
+    assert records and all('code' in record and 'value' in record for record in records)
+
+
+def test_finished_documents_are_skipped(workspace):
+    workspace.add_pdf('doc-a')
+    backend = SyntheticBackend(items=3)
+    manifest = RunManifest(os.path.join(pipeline.OUTPUT_DIR, 'manifest.jsonl'))
+
+    run(pipeline, 'doc-a', backend, manifest)
+    calls = backend.calls
+    run(pipeline, 'doc-a', backend, RunManifest(manifest.path))
+
+    assert backend.calls == calls
+
+
+def test_editing_a_template_re_extracts_finished_documents(workspace):
+    workspace.add_pdf('doc-a')
+    backend = SyntheticBackend(items=3)
+    manifest = RunManifest(os.path.join(pipeline.OUTPUT_DIR, 'manifest.jsonl'))
+    run(pipeline, 'doc-a', backend, manifest)
+    calls = backend.calls
+
+    workspace.edit_template('system_instructions_step_3.txt', '\nAlso report the fiscal year.\n')
+    run(pipeline, 'doc-a', backend, RunManifest(manifest.path))
+
+    # Steps 1 and 2 resume from their artifacts; only step 3, whose prompt changed, runs again.
+    steps = RunManifest(manifest.path).documents['doc-a']
+    assert backend.calls > calls
+    assert steps['status'] == 'done'
+    assert steps['prompts'] == pipeline.prompt_versions(pipeline.PROMPTS)
+
+
+def test_editing_the_all_in_one_template_re_extracts_finished_documents(workspace):
+    workspace.add_pdf('doc-a')
+    backend = SyntheticBackend(items=3)
+    manifest = RunManifest(os.path.join(pipeline_all_in_one.OUTPUT_DIR, 'manifest.jsonl'))
+    run(pipeline_all_in_one, 'doc-a', backend, manifest)
+    run(pipeline_all_in_one, 'doc-a', backend, RunManifest(manifest.path))
+    assert backend.calls == 1
+
+    workspace.edit_template('system_instructions.txt', '\nReport values in GJ where possible.\n')
+    run(pipeline_all_in_one, 'doc-a', backend, RunManifest(manifest.path))
+
+    assert backend.calls == 2
+
+
+def test_all_in_one_bills_the_instruction_and_pdf_once(workspace):
+    workspace.add_pdf('doc-a')
+    prompt = get_prompt('all_in_one')
+    metrics = synthesize(prompt.response_schema, random.Random(0), 4)['metrics']
+    complete = json.dumps({'metrics': metrics})
+    # The first response stops inside the third metric; the continuation returns them all.
+    script = [(complete[:complete.index(json.dumps(metrics[2]))] + '{"code": "', 'MAX_TOKENS'),
+              (complete, 'STOP')]
+    backend, service, sent = caching_backend(script)
+
+    with document_context('doc-a'):
+        output_file = run(pipeline_all_in_one, 'doc-a', backend, None)
+
+    pdf_parts = pipeline.PdfDocument('doc-a', os.path.join(workspace.pdf_dir, 'doc-a.pdf')).parts()
+    prefix_tokens = estimate_tokens(pdf_parts, [prompt.system_instruction])
+    assert len(sent) == 2
+    assert service.created == 1 and service.prefix_tokens == prefix_tokens
+    # Both calls send only what follows the cached prefix: no instruction and no PDF.
+    assert all(instruction is None and prompt.system_instruction not in contents for instruction, contents in sent)
+    assert not any(getattr(part, 'mime_type', None) == 'application/pdf' for _, contents in sent for part in contents)
+    assert service.caches == {}
+    with open(output_file) as file:
+        assert len(file.readlines()) == 4
+
+
+def test_steps_cache_their_instruction_with_the_pdf(workspace, monkeypatch):
+    workspace.add_pdf('doc-a')
+    monkeypatch.setattr(config, 'EXTRACTION_CHUNK_SIZE', 1)
+    backend, service, sent = caching_backend()
+
+    with document_context('doc-a'):
+        run(pipeline, 'doc-a', backend, None)
+
+    instructions = [get_prompt(name).system_instruction for name in pipeline.PROMPTS]
+    # Step 1 is sent whole; the three chunks of steps 2 and 3 each reference their step's cache.
+    assert service.created == 2
+    assert [instruction for instruction, _ in sent] == [[instructions[0]]] + [None] * 6
+    assert not any(text in contents for _, contents in sent for text in instructions)
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from src.generate.backends import UriPart
+from src.generate.fakes import FakeQuota
+from src.generate.fakes import FakeQuotaError
+from src.generate.fakes import ThrottlingFakeModel
+from src.generate.scheduler import RequestScheduler
+from src.generate.scheduler import estimate_tokens
+from src.generate.scheduler import TokenBucket
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate_per_minute=600)
+    now = time.monotonic()
+    assert bucket.wait_time(600, now) == 0
+    bucket.consume(600)
+    assert bucket.wait_time(10, now) == pytest.approx(1.0, abs=0.01)
+    bucket.adjust(-10)
+    assert bucket.wait_time(10, now) == pytest.approx(0.0, abs=0.01)
+
+
+def test_calls_wait_until_the_token_budget_admits_them():
+    scheduler = RequestScheduler(requests_per_minute=6000, tokens_per_minute=6000)
+    scheduler.tokens.tokens = 0
+
+    start = time.monotonic()
+    assert scheduler.call(lambda: 'ok', estimated_tokens=10) == 'ok'
+
+    # 10 tokens at 100 tokens/s.
+    assert time.monotonic() - start >= 0.09
+
+
+def test_quota_errors_are_retried_after_the_hinted_delay():
+    quota = FakeQuota(limit=2, window=0.2)
+    model = ThrottlingFakeModel('fake', quota=quota, payload={'ok': True})
+    scheduler = RequestScheduler(requests_per_minute=6000, max_retries=5, base_delay=0.01)
+    retried = []
+
+    start = time.monotonic()
+    responses = [scheduler.call(lambda: model.generate_content(['prompt']), on_retry=retried.append) for _ in range(4)]
+
+    assert [response.text for response in responses] == ['{"ok": true}'] * 4
+    assert quota.rejected > 0
+    assert scheduler.retries == scheduler.throttled == quota.rejected == len(retried)
+    assert all(isinstance(error, FakeQuotaError) for error in retried)
+    # The third call cannot run before the first window closes.
+    assert time.monotonic() - start >= 0.15
+
+
+def test_backoff_gives_up_after_max_retries():
+    scheduler = RequestScheduler(max_retries=2, base_delay=0.001, max_delay=0.001)
+    attempts = []
+
+    def always_throttled():
+        attempts.append(1)
+        raise FakeQuotaError('429 Quota exceeded')
+
+    with pytest.raises(FakeQuotaError):
+        scheduler.call(always_throttled)
+    assert len(attempts) == 3
+    assert scheduler.retries == 2
+
+
+def test_non_retryable_errors_are_raised_at_once():
+    scheduler = RequestScheduler(base_delay=0.001)
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise ValueError('bad request')
+
+    with pytest.raises(ValueError):
+        scheduler.call(broken)
+    assert len(attempts) == 1
+    assert scheduler.stats()['retries'] == 0
+
+
+def test_exponential_backoff_is_capped_and_jittered():
+    scheduler = RequestScheduler(base_delay=1.0, max_delay=4.0)
+    error = FakeQuotaError('429')
+    delays = [scheduler._backoff(attempt, error) for attempt in range(10) for _ in range(20)]
+    assert all(0 <= delay <= 4.0 for delay in delays)
+    assert scheduler._backoff(3, FakeQuotaError('429', retry_after=7.5)) == 7.5
+
+
+def test_staged_pdfs_are_estimated_from_their_page_count_or_size():
+    uri = 'gs://bucket/staged/abc.pdf'
+    assert estimate_tokens([UriPart(uri, 'application/pdf', pages=120)]) == 258 * 120
+    assert estimate_tokens([UriPart(uri, 'application/pdf', size=5_000_000)]) == 258 * 100
+    assert estimate_tokens([UriPart(uri, 'application/pdf')]) == 258
@@ -0,0 +1,114 @@
+from src.generate import pipeline
+from src.generate.backends import SyntheticBackend
+from src.generate.service import IngestionService
+from src.generate.service import JobQueue
+from src.generate.telemetry import current_document
+
+
+class FailingBackend(SyntheticBackend):
+    """
+    Synthetic backend whose calls fail, without a retryable code, for some documents.
+    """
+
+    def __init__(self, failing, **kwargs):
+        super().__init__(**kwargs)
+        self.failing = set(failing)
+
+    def generate(self, request):
+        if current_document.get() in self.failing:
+            raise ValueError(f"unreadable PDF {current_document.get()}")
+        return super().generate(request)
+
+
+def service(queue, backend, **kwargs):
+    return IngestionService('multi_step', queue, backend, max_workers=2, poll_interval=0.01, settle_seconds=0, **kwargs)
+
+
+def test_a_changed_file_supersedes_its_pending_job(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'))
+
+    assert queue.enqueue('doc-a', 'sha-1', 10, 1)
+    assert not queue.enqueue('doc-a', 'sha-1', 10, 2)
+    assert queue.enqueue('doc-a', 'sha-2', 12, 3)
+
+    assert queue.counts() == {'pending': 1, 'superseded': 1}
+    assert queue.sources() == {'doc-a': (12, 3)}
+    assert queue.claim(5) == [('doc-a', 'sha-2')]
+
+
+def test_a_failing_job_is_retried_then_marked_failed(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), max_attempts=2, retry_delay=60)
+    queue.enqueue('doc-a', 'sha-1', 10, 1)
+
+    assert queue.claim(1) == [('doc-a', 'sha-1')]
+    assert queue.fail('doc-a', 'sha-1', 'timeout') == 'pending'
+    # The retry waits out its backoff.
+    assert queue.claim(1) == []
+    queue.retry_delay = 0
+    queue._execute('UPDATE jobs SET not_before = 0')
+    assert queue.claim(1) == [('doc-a', 'sha-1')]
+    assert queue.fail('doc-a', 'sha-1', 'timeout') == 'failed'
+    assert queue.claim(1) == []
+
+
+def test_the_service_gives_up_on_a_failing_document_only(workspace, tmp_path):
+    workspace.add_pdf('doc-a')
+    workspace.add_pdf('doc-b')
+    queue = JobQueue(str(tmp_path / 'jobs.db'), max_attempts=3, retry_delay=0)
+    backend = FailingBackend({'doc-b'}, items=3, latency=0.005)
+
+    counts = service(queue, backend).run(once=True)
+
+    assert counts == {'done': 1, 'failed': 1}
+    rows = dict(queue._execute('SELECT doc_id, attempts FROM jobs').fetchall())
+    assert rows == {'doc-a': 1, 'doc-b': 3}
+
+
+def test_recover_requeues_jobs_left_running(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    queue = JobQueue(path)
+    queue.enqueue('doc-a', 'sha-1', 10, 1)
+    queue.claim(1)
+    queue.close()
+
+    queue = JobQueue(path)
+    assert queue.counts() == {'running': 1}
+    assert queue.recover() == 1
+    assert queue.counts() == {'pending': 1}
+
+
+def test_an_interrupted_job_is_finished_after_a_restart(workspace, tmp_path):
+    workspace.add_pdf('doc-a')
+    path = str(tmp_path / 'jobs.db')
+    queue = JobQueue(path)
+    # A previous service claimed the job and was killed before finishing it.
+    service(queue, SyntheticBackend(items=3)).scan()
+    queue.claim(1)
+    queue.close()
+
+    backend = SyntheticBackend(items=3)
+    counts = service(JobQueue(path), backend).run(once=True)
+
+    assert counts == {'done': 1}
+    assert backend.calls == 3
+
+
+def test_a_duplicate_waits_for_its_canonical_and_copies_its_output(workspace, dedup_index, tmp_path):
+    workspace.add_pdf('doc-a')
+    workspace.add_pdf('doc-b', 'Sustainability report doc-a')
+    queue = JobQueue(str(tmp_path / 'jobs.db'))
+    backend = SyntheticBackend(items=3, latency=0.005)
+    runner = service(queue, backend)
+
+    runner.scan()
+    # doc-b holds off while doc-a still has to be extracted.
+    assert queue.claim(2) == [('doc-a', dedup_index.documents['doc-a']['sha256'])]
+    # run() returns the claimed job to pending before it starts.
+    counts = runner.run(once=True)
+
+    assert counts == {'done': 2}
+    assert backend.calls == 3
+    outputs = dict(queue._execute('SELECT doc_id, output_file FROM jobs').fetchall())
+    with open(outputs['doc-a']) as original, open(outputs['doc-b']) as copy:
+        assert copy.read() == original.read()
+    assert outputs['doc-b'].startswith(pipeline.GEN_DIR)
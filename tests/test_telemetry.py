@@ -0,0 +1,90 @@
+import json
+import threading
+
+from src.generate.telemetry import document_context
+from src.generate.telemetry import Histogram
+from src.generate.telemetry import JsonlExporter
+from src.generate.telemetry import Telemetry
+
+
+def read_lines(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_spans_are_written_by_the_background_writer(tmp_path):
+    path = str(tmp_path / 'telemetry.jsonl')
+    exporter = JsonlExporter(path)
+    telemetry = Telemetry([exporter])
+
+    with document_context('doc-a'):
+        with telemetry.span('model_call', step='step_1', prompt_tokens=100, completion_tokens=20):
+            pass
+    summary = telemetry.flush()
+
+    lines = read_lines(path)
+    assert [line['type'] for line in lines] == ['span', 'summary']
+    assert lines[0]['doc_id'] == 'doc-a'
+    assert lines[0]['run_id'] == telemetry.run_id
+    assert summary['steps']['step_1']['prompt_tokens'] == 100
+    exporter.close()
+
+
+def test_export_does_not_touch_the_file_on_the_calling_thread(tmp_path, monkeypatch):
+    path = str(tmp_path / 'telemetry.jsonl')
+    exporter = JsonlExporter(path)
+    telemetry = Telemetry([exporter])
+    writers = set()
+    real_open = open
+
+    def recording_open(file, *args, **kwargs):
+        if file == path:
+            writers.add(threading.current_thread().name)
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr('builtins.open', recording_open)
+    for _ in range(50):
+        with telemetry.span('model_call', step='step_2'):
+            pass
+    assert exporter.wait(timeout=5)
+
+    assert writers == {'telemetry-writer'}
+    assert len(read_lines(path)) == 50
+    exporter.close()
+
+
+def test_close_writes_what_is_queued(tmp_path):
+    path = str(tmp_path / 'telemetry.jsonl')
+    exporter = JsonlExporter(path)
+    telemetry = Telemetry([exporter])
+    for _ in range(10):
+        with telemetry.span('document'):
+            pass
+
+    exporter.close()
+
+    assert len(read_lines(path)) == 10
+
+
+def test_histogram_quantiles_stay_within_the_observations():
+    histogram = Histogram()
+    for value in [0.2] * 90 + [3.0] * 9 + [50.0]:
+        histogram.observe(value)
+
+    assert 0.1 <= histogram.quantile(0.5) <= 0.25
+    assert 2.5 <= histogram.quantile(0.95) <= 5.0
+    assert histogram.quantile(1.0) == 50.0
+
+
+def test_summary_reports_p99_latency():
+    telemetry = Telemetry()
+    for _ in range(3):
+        with telemetry.span('model_call', step='step_3'):
+            pass
+        with telemetry.span('document'):
+            pass
+
+    summary = telemetry.summary()
+
+    assert set(summary['steps']['step_3']['latency_s']) == {'p50', 'p95', 'p99', 'max'}
+    assert summary['document_latency_s']['p99'] <= summary['document_latency_s']['max']
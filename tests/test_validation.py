@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from src.generate.validation import SchemaValidator
+
+
+SCHEMA_DIR = './data/templates/response_schemas'
+
+METRIC = {
+    'code': '817', 'item': 'Renewable share', 'scope': 'Group', 'flag': 'Reported', 'page_number': 12,
+    'snippet': 'Renewable energy was 24.5% of the total', 'flag_reasoning': 'Stated in the table',
+    'consumption_type': 'Electricity',
+}
+
+
+def load_validator(name: str) -> SchemaValidator:
+    with open(f'{SCHEMA_DIR}/{name}.json', 'r', encoding='utf-8') as file:
+        return SchemaValidator(json.load(file))
+
+
+@pytest.fixture(scope='module')
+def metrics():
+    return load_validator('all_in_one').at('metrics')
+
+
+@pytest.mark.parametrize('value', ['24428.5', '1,234', '1,234.56', '-3', 24428.5])
+def test_numeric_values_are_kept(metrics, value):
+    records, failures, repairs = metrics.check_items([dict(METRIC, value=value, unit='GJ')])
+    assert failures == {}
+    assert repairs == 0
+    assert records[0]['value'] == str(value)
+
+
+@pytest.mark.parametrize('unit', ['m³', 'GJ/t', "Tonnes ('000)", '%', 'kWh'])
+def test_units_are_kept(metrics, unit):
+    records, failures, _ = metrics.check_items([dict(METRIC, value='1', unit=unit)])
+    assert failures == {}
+    assert records[0]['unit'] == unit
+
+
+def test_value_with_disallowed_characters_fails_instead_of_being_rewritten(metrics):
+    records, failures, repairs = metrics.check_items([dict(METRIC, value='12 GJ!', unit='GJ')])
+    assert list(failures) == [0]
+    assert records[0]['value'] == '12 GJ!'
+    assert repairs == 0
+
+
+def test_verbatim_fields_only_get_whitespace_collapsed(metrics):
+    records, failures, repairs = metrics.check_items([dict(METRIC, value='1', unit=' GJ\tper  t\n')])
+    assert failures == {}
+    assert records[0]['unit'] == 'GJ per t'
+    assert repairs == 1
+
+
+def test_free_text_is_cut_to_length_but_characters_are_kept(metrics):
+    snippet = 'x' * 520
+    records, failures, repairs = metrics.check_items([dict(METRIC, value='1', unit='GJ', snippet=snippet)])
+    assert failures == {}
+    assert records[0]['snippet'] == 'x' * 500
+    assert repairs == 1
+
+    records, failures, _ = metrics.check_items([dict(METRIC, value='1', unit='GJ', item='Energy (GJ)')])
+    assert list(failures) == [0]
+    assert records[0]['item'] == 'Energy (GJ)'
+
+
+def test_step_3_records_normalize_numbers_and_nulls():
+    validator = load_validator('step_3')
+    record = dict(METRIC, value='1,234', unit='%', year='2022.0', scope='null')
+    (normalized,), failures, _ = validator.check_items([record])
+    assert failures == {}
+    assert normalized['value'] == 1234
+    assert normalized['year'] == 2022
+    assert normalized['scope'] is None